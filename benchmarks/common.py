@@ -0,0 +1,72 @@
+"""
+Timing, environment metadata and baseline comparison of the benchmark suite.
+"""
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import torch
+
+
+def synchronize(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def measure(fn, num_samples, device, iters=20, warmup=3):
+    """
+    Runs fn warmup + iters times. Returns the throughput in samples/s (num_samples
+    processed per call) and the p50 / p99 latency of a call.
+    """
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        times.append(time.perf_counter() - start)
+    times = np.array(times)
+    return {'samples_per_s': float(num_samples * len(times) / times.sum()),
+            'latency_p50_ms': float(np.percentile(times, 50) * 1000),
+            'latency_p99_ms': float(np.percentile(times, 99) * 1000),
+            'num_samples': num_samples, 'iters': iters}
+
+
+def environment(device):
+    env = {'torch': torch.__version__, 'numpy': np.__version__, 'python': platform.python_version(),
+           'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+           'num_threads': torch.get_num_threads(), 'device': str(device)}
+    if torch.device(device).type == 'cuda':
+        env['gpu'] = torch.cuda.get_device_name(device)
+        env['cuda'] = torch.version.cuda
+    return env
+
+
+def compare(results, baseline, tolerance):
+    """
+    Benchmarks whose throughput dropped by more than tolerance (a fraction) below the
+    baseline, as (name, current samples/s, baseline samples/s) tuples.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        current, reference = result['samples_per_s'], baseline[name]['samples_per_s']
+        if current < reference * (1 - tolerance):
+            regressions.append((name, current, reference))
+    return regressions
+
+
+def write_report(path, report):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def load_baseline(path):
+    with open(path, 'r') as f:
+        return json.load(f)['results']
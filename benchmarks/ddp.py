@@ -0,0 +1,151 @@
+"""
+Step time of DDP HAMMER training by world size and gradient communication setting,
+on CPU processes with the gloo backend, randomly initialized weights and synthetic
+inputs. From the repo root:
+
+    python -m benchmarks.ddp --world_sizes 1,2,4 --comm_hooks none,fp16,powersgd
+
+Every world size x comm hook x bucket size runs in its own group of processes,
+with --num_threads split between them. Per step it reports the forward, the
+backward with the gradient all-reduce, the optimizer step, and the backward of the
+same step under no_sync(), without communication. Their difference is the part of
+the all-reduce not hidden behind the backward. Times are medians over the steps of
+the slowest rank. Every process holds a full HAMMER with AdamW state, a few GB each.
+--opt_shard_state shards the AdamW state, the optimizer time then includes the
+broadcast of the updated parameters.
+bf16 needs NCCL and is not supported here.
+"""
+import warnings
+warnings.filterwarnings("ignore")
+
+import os
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import argparse
+import itertools
+import json
+import tempfile
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import numpy as np
+import ruamel.yaml as yaml
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from benchmarks.common import environment, write_report
+
+PHASES = ['forward', 'backward', 'backward_no_sync', 'optimizer', 'step']
+
+
+def timed(times, name, fn):
+    start = time.perf_counter()
+    out = fn()
+    times[name].append(time.perf_counter() - start)
+    return out
+
+
+def worker(rank, world_size, setting, args, config, tmp_dir, result_file):
+    from benchmarks.run import Context
+    from tools.ddp import wrap_model
+
+    torch.set_num_threads(max(1, (args.num_threads or os.cpu_count()) // world_size))
+    torch.manual_seed(args.seed)
+    dist.init_process_group('gloo', init_method='file://' + os.path.join(tmp_dir, 'process_group'),
+                            rank=rank, world_size=world_size)
+    ctx = Context(SimpleNamespace(device='cpu', batch_size=args.batch_size, seed=args.seed + rank), config, tmp_dir)
+    inputs = ctx.inputs
+    model = wrap_model(ctx.model, bucket_cap_mb=setting['bucket_cap_mb'], comm_hook=setting['comm_hook'],
+                       powersgd_rank=args.powersgd_rank, powersgd_start_iter=max(args.warmup, 2))
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=1e-5)
+    if args.opt_shard_state:
+        from optim import ShardedOptimizer
+        optimizer = ShardedOptimizer(optimizer)
+
+    def forward():
+        return sum(model(inputs.image, inputs.label, inputs.text, inputs.fake_image_box, inputs.fake_token_pos,
+                         alpha=0.4))
+
+    times = OrderedDict((phase, []) for phase in PHASES)
+    model.train()
+    for i in range(args.warmup + args.iters):
+        if i == args.warmup:
+            times = OrderedDict((phase, []) for phase in PHASES)
+        # compute only reference of the backward, the gradients are dropped
+        with model.no_sync():
+            loss = forward()
+            timed(times, 'backward_no_sync', loss.backward)
+        optimizer.zero_grad(set_to_none=True)
+        dist.barrier()
+
+        start = time.perf_counter()
+        loss = timed(times, 'forward', forward)
+        timed(times, 'backward', loss.backward)
+        timed(times, 'optimizer', optimizer.step)
+        optimizer.zero_grad(set_to_none=True)
+        times['step'].append(time.perf_counter() - start)
+        dist.barrier()
+
+    # median of every phase on the slowest rank
+    medians = torch.tensor([float(np.median(times[phase])) for phase in PHASES], dtype=torch.float64)
+    dist.all_reduce(medians, op=dist.ReduceOp.MAX)
+    if rank == 0:
+        result = OrderedDict(('%s_ms' % phase, value * 1000) for phase, value in zip(PHASES, medians.tolist()))
+        result['comm_exposed_ms'] = max(result['backward_ms'] - result['backward_no_sync_ms'], 0.)
+        result['samples_per_s'] = world_size * args.batch_size / medians[PHASES.index('step')].item()
+        with open(result_file, 'w') as f:
+            json.dump(result, f)
+    dist.destroy_process_group()
+
+
+def main(args):
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.Loader)
+    config['image_res'] = args.image_res
+
+    results = OrderedDict()
+    settings = itertools.product([int(w) for w in args.world_sizes.split(',')], args.comm_hooks.split(','),
+                                 [int(b) for b in args.bucket_cap_mb.split(',')])
+    for world_size, comm_hook, bucket_cap_mb in settings:
+        name = 'ws%d_%s_bucket%dmb' % (world_size, comm_hook, bucket_cap_mb) + ('_sharded' if args.opt_shard_state else '')
+        setting = {'world_size': world_size, 'comm_hook': comm_hook, 'bucket_cap_mb': bucket_cap_mb}
+        # the queue is filled by the global batch
+        global_bs = world_size * args.batch_size
+        run_config = dict(config, queue_size=max(config['queue_size'] // global_bs, 1) * global_bs)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result_file = os.path.join(tmp_dir, 'result.json')
+            mp.spawn(worker, nprocs=world_size, args=(world_size, setting, args, run_config, tmp_dir, result_file))
+            with open(result_file, 'r') as f:
+                results[name] = dict(setting, **json.load(f))
+        print('{:28s} | step {step_ms:9.1f} ms | fwd {forward_ms:8.1f} | bwd {backward_ms:8.1f} '
+              '(no_sync {backward_no_sync_ms:8.1f}, exposed comm {comm_exposed_ms:7.1f}) | '
+              'opt {optimizer_ms:7.1f} | {samples_per_s:8.2f} samples/s'.format(name, **results[name]), flush=True)
+
+    report = {'env': environment('cpu'),
+              'settings': {'batch_size': args.batch_size, 'image_res': args.image_res, 'iters': args.iters,
+                           'warmup': args.warmup, 'num_threads': args.num_threads, 'config': args.config,
+                           'opt_shard_state': args.opt_shard_state},
+              'results': results}
+    write_report(args.output, report)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='./configs/train.yaml')
+    parser.add_argument('--world_sizes', default='1,2')
+    parser.add_argument('--comm_hooks', default='none,fp16,powersgd', help='comma separated, see tools.ddp.COMM_HOOKS')
+    parser.add_argument('--bucket_cap_mb', default='25', help='comma separated bucket sizes')
+    parser.add_argument('--powersgd_rank', default=1, type=int)
+    parser.add_argument('--opt_shard_state', default=False, action='store_true',
+                        help='AdamW state sharded over the processes, see optim/zero.py')
+    parser.add_argument('--batch_size', default=4, type=int, help='per process')
+    parser.add_argument('--image_res', default=256, type=int)
+    parser.add_argument('--iters', default=5, type=int)
+    parser.add_argument('--warmup', default=2, type=int)
+    parser.add_argument('--seed', default=777, type=int)
+    parser.add_argument('--num_threads', default=None, type=int, help='total over the processes, default all cores')
+    parser.add_argument('--output', default='results/benchmarks/ddp_report.json')
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,121 @@
+"""
+Time of optimizer.step() of the optimizers of optim/ on a HAMMER-sized set of CPU
+parameters with random gradients, with the multi-tensor (foreach) step and with the
+per-parameter reference. From the repo root:
+
+    python -m benchmarks.optim --optimizers adamw,adamp --num_threads 8
+
+Each optimizer runs warmup + iters steps with the same gradients in both modes, the
+parameters must then agree within --atol. Every mode reports steps/s (as
+samples_per_s) and the p50 / p99 latency of a step, in the report format of
+benchmarks.run.
+"""
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from benchmarks.common import measure, environment, write_report
+from optim import AdamP, AdamW, Adafactor, Nadam, NovoGrad, NvNovoGrad, RAdam, RMSpropTF, SGDP
+
+OPTIMIZERS = {
+    'adamw': lambda params, foreach: AdamW(params, lr=1e-4, weight_decay=0.02, foreach=foreach),
+    'adamp': lambda params, foreach: AdamP(params, lr=1e-4, weight_decay=0.02, wd_ratio=0.01, nesterov=True, foreach=foreach),
+    'sgdp': lambda params, foreach: SGDP(params, lr=1e-2, momentum=0.9, weight_decay=0.02, nesterov=True, foreach=foreach),
+    'nadam': lambda params, foreach: Nadam(params, lr=1e-4, weight_decay=0.02, foreach=foreach),
+    'radam': lambda params, foreach: RAdam(params, lr=1e-4, weight_decay=0.02, foreach=foreach),
+    'novograd': lambda params, foreach: NovoGrad(params, lr=1e-3, weight_decay=0.02, foreach=foreach),
+    'nvnovograd': lambda params, foreach: NvNovoGrad(params, lr=1e-3, weight_decay=0.02, foreach=foreach),
+    'adafactor': lambda params, foreach: Adafactor(params, lr=None, weight_decay=0.02, betas=(0.9, 0.999), foreach=foreach),
+    'rmsproptf': lambda params, foreach: RMSpropTF(params, lr=1e-4, momentum=0.9, weight_decay=0.02, foreach=foreach),
+}
+
+
+def hammer_param_shapes(image_res=256, patch_size=16, width=768, vision_layers=12, text_layers=12, fusion_layer=6,
+                        vocab_size=30522, embed_dim=256):
+    """shapes of the trainable parameters of HAMMER: ViT-B/16, BERT-base with cross-attention fusion layers and the heads"""
+    linear = lambda n_out, n_in: [(n_out, n_in), (n_out,)]
+    norm = [(width,), (width,)]
+
+    shapes = [(width, 3, patch_size, patch_size), (width,), (1, 1, width), (1, (image_res // patch_size) ** 2 + 1, width)]
+    for _ in range(vision_layers):
+        shapes += norm + linear(3 * width, width) + linear(width, width) + norm \
+            + linear(4 * width, width) + linear(width, 4 * width)
+    shapes += norm
+
+    shapes += [(vocab_size, width), (512, width), (2, width)] + norm
+    for i in range(text_layers):
+        shapes += linear(width, width) * 4 + norm + linear(4 * width, width) + linear(width, 4 * width) + norm
+        if i >= fusion_layer:
+            shapes += linear(width, width) * 4 + norm
+
+    # vision_proj, text_proj, itm_head, bbox_head, cls_head, aggregator / it_cross_attn, token head
+    shapes += linear(embed_dim, width) * 2 + linear(2, width)
+    shapes += linear(width, width) * 2 + linear(4, width) + linear(width * 2, width) + linear(4, width * 2)
+    shapes += [(3 * width, width), (3 * width,)] + linear(width, width) + norm * 2 + [(1, 1, width)]
+    shapes += linear(width * 2, width) + linear(2, width * 2)
+    return shapes
+
+
+def make_params(shapes, seed):
+    generator = torch.Generator().manual_seed(seed)
+    return [torch.nn.Parameter(torch.randn(shape, generator=generator) * 0.02) for shape in shapes]
+
+
+def set_grads(params, seed):
+    generator = torch.Generator().manual_seed(seed)
+    for p in params:
+        p.grad = torch.randn(p.shape, generator=generator) * 1e-2
+
+
+def bench(name, shapes, foreach, args):
+    """timing of the steps, and the parameters after them"""
+    params = make_params(shapes, args.seed)
+    set_grads(params, args.seed + 1)
+    optimizer = OPTIMIZERS[name](params, foreach)
+    result = measure(optimizer.step, 1, 'cpu', iters=args.iters, warmup=args.warmup)
+    return params, result
+
+
+def main(args):
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    shapes = hammer_param_shapes(vision_layers=args.layers, text_layers=args.layers, fusion_layer=args.layers // 2)
+    num_params = sum(int(np.prod(shape)) for shape in shapes)
+    print(f'{len(shapes)} tensors, {num_params / 1e6:.1f}M parameters, {torch.get_num_threads()} threads')
+
+    results = OrderedDict()
+    for name in args.optimizers.split(','):
+        ref_params, reference = bench(name, shapes, False, args)
+        params, result = bench(name, shapes, True, args)
+        # the foreach step must match the per-parameter reference after the same updates
+        result['max_abs_diff'] = max((p - q).abs().max().item() for p, q in zip(params, ref_params))
+        results[name + '_reference'] = reference
+        results[name + '_foreach'] = result
+        print('{:10s} | reference {:9.2f} ms | foreach {:9.2f} ms | x{:5.2f} | max abs diff {:.2e}'.format(
+            name, reference['latency_p50_ms'], result['latency_p50_ms'],
+            reference['latency_p50_ms'] / result['latency_p50_ms'], result['max_abs_diff']), flush=True)
+        if result['max_abs_diff'] > args.atol:
+            raise RuntimeError(f'{name}: foreach step differs from the reference by more than {args.atol}')
+
+    report = {'env': environment('cpu'),
+              'settings': {'layers': args.layers, 'num_tensors': len(shapes), 'num_params': num_params,
+                           'iters': args.iters, 'warmup': args.warmup, 'num_threads': args.num_threads},
+              'results': results}
+    write_report(args.output, report)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--optimizers', default=','.join(OPTIMIZERS))
+    parser.add_argument('--layers', default=12, type=int, help='ViT / BERT layers, 12 = HAMMER size')
+    parser.add_argument('--iters', default=5, type=int)
+    parser.add_argument('--warmup', default=2, type=int)
+    parser.add_argument('--seed', default=777, type=int)
+    parser.add_argument('--num_threads', default=None, type=int, help='intra-op threads, default all available cores')
+    parser.add_argument('--atol', default=1e-5, type=float)
+    parser.add_argument('--output', default='results/benchmarks/optim_report.json')
+
+    args = parser.parse_args()
+    main(args)
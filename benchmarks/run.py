@@ -0,0 +1,307 @@
+"""
+Throughput / latency of the HAMMER components on randomly initialized weights,
+synthetic images and captions, nothing is downloaded. CPU by default, --device cuda
+for the GPU. From the repo root:
+
+    python -m benchmarks.run --save_baseline results/benchmarks/baseline.json
+    python -m benchmarks.run --baseline results/benchmarks/baseline.json
+
+Every benchmark reports samples/s and the p50 / p99 latency of a call. The report
+is written to JSON with the environment, and the benchmarks slower than the
+baseline by more than --tolerance are listed as regressions. A baseline is only
+meaningful on the machine and settings it was recorded with.
+"""
+import warnings
+warnings.filterwarnings("ignore")
+
+import os
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import argparse
+import contextlib
+import io
+import random
+import sys
+import tempfile
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import numpy as np
+import ruamel.yaml as yaml
+import torch
+import torch.distributed as dist
+from PIL import Image
+
+from benchmarks.common import measure, environment, compare, write_report, load_baseline
+from dataset.synthetic import WORDS
+
+SPECIAL_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+
+
+def make_tokenizer(tmp_dir):
+    """WordPiece tokenizer over WORDS, '##s' splits the plurals into two tokens"""
+    from transformers import BertTokenizerFast
+    vocab_file = os.path.join(tmp_dir, 'vocab.txt')
+    with open(vocab_file, 'w') as f:
+        f.write('\n'.join(SPECIAL_TOKENS + WORDS + ['##s']) + '\n')
+    return BertTokenizerFast(vocab_file=vocab_file, do_lower_case=True)
+
+
+def make_captions(rng, num, min_words=8, max_words=30):
+    captions = []
+    for _ in range(num):
+        words = rng.choice(WORDS, rng.randint(min_words, max_words + 1))
+        captions.append(' '.join(w + 's' if rng.rand() < 0.2 else w for w in words))
+    return captions
+
+
+class Context(object):
+    """inputs shared by the benchmarks, the model and its features are built on first use"""
+
+    def __init__(self, args, config, tmp_dir):
+        self.args = args
+        self.config = config
+        self.tmp_dir = tmp_dir
+        self.device = torch.device(args.device)
+        self.bs = args.batch_size
+        self.rng = np.random.RandomState(args.seed)
+        self.tokenizer = make_tokenizer(tmp_dir)
+        self.captions = make_captions(self.rng, self.bs)
+        self.fake_word_pos = torch.zeros(self.bs, config['max_words'])
+        self.fake_word_pos[:, 1:4] = 1
+        self._model = None
+        self._inputs = None
+
+    def tokenize(self):
+        from train import text_input_adjust
+        text_input = self.tokenizer(self.captions, max_length=128, truncation=True, add_special_tokens=True,
+                                    return_attention_mask=True, return_token_type_ids=False)
+        return text_input_adjust(text_input, self.fake_word_pos, self.device)
+
+    @property
+    def model(self):
+        if self._model is None:
+            from models.HAMMER import HAMMER
+            model = HAMMER(args=SimpleNamespace(token_momentum=False), config=self.config, tokenizer=self.tokenizer,
+                           init_deit=False, init_bert=False)
+            self._model = model.to(self.device)
+        return self._model
+
+    @property
+    def inputs(self):
+        if self._inputs is None:
+            res = self.config['image_res']
+            text, fake_token_pos = self.tokenize()
+            image = torch.randn(self.bs, 3, res, res, device=self.device)
+            label = torch.arange(self.bs, device=self.device) % 9
+            fake_image_box = torch.tensor([[0.5, 0.5, 0.3, 0.3]], device=self.device).repeat(self.bs, 1)
+            with torch.no_grad():
+                model = self.model
+                image_embeds = model.visual_encoder(image)
+                image_atts = torch.ones(image_embeds.size()[:-1], dtype=torch.long, device=self.device)
+                text_embeds = model.text_encoder.bert(text.input_ids, attention_mask=text.attention_mask,
+                                                      return_dict=True, mode='text').last_hidden_state
+                image_score = torch.softmax(model.image_mlp(image_embeds).squeeze(2), dim=-1)
+                text_score = torch.softmax(model.text_mlp(text_embeds).squeeze(2), dim=-1)
+            self._inputs = SimpleNamespace(image=image, label=label, text=text, fake_image_box=fake_image_box,
+                                           fake_token_pos=fake_token_pos, image_embeds=image_embeds,
+                                           image_atts=image_atts, text_embeds=text_embeds,
+                                           image_score=image_score, text_score=text_score,
+                                           real_pos=(label == 0).float())
+        return self._inputs
+
+
+def bench_dataset_getitem(ctx):
+    from dataset import create_dataset
+    from dataset.synthetic import generate
+    root = os.path.join(ctx.tmp_dir, 'dgm4')
+    ann_file = generate(root, {'train': ctx.bs}, seed=ctx.args.seed, size_range=(300, 400))['train']
+    train_dataset, _ = create_dataset(dict(ctx.config, train_file=[ann_file], val_file=[ann_file], root_dir=root))
+    return lambda: [train_dataset[i] for i in range(len(train_dataset))], ctx.bs
+
+
+def bench_random_augment(ctx):
+    from dataset.randaugment import RandomAugment
+    augment = RandomAugment(2, 7, isPIL=True, augs=['Identity', 'AutoContrast', 'Equalize', 'Brightness', 'Sharpness'])
+    res = ctx.config['image_res']
+    images = [Image.fromarray(ctx.rng.randint(0, 256, (res, res, 3), dtype=np.uint8)) for _ in range(ctx.bs)]
+    return lambda: [augment(image) for image in images], ctx.bs
+
+
+def bench_tokenize(ctx):
+    return ctx.tokenize, ctx.bs
+
+
+def bench_vit(ctx):
+    image, model = ctx.inputs.image, ctx.model.eval()
+    return torch.no_grad()(lambda: model.visual_encoder(image)), ctx.bs
+
+
+def bench_bert_text(ctx):
+    text, model = ctx.inputs.text, ctx.model.eval()
+    return torch.no_grad()(lambda: model.text_encoder.bert(text.input_ids, attention_mask=text.attention_mask,
+                                                            return_dict=True, mode='text')), ctx.bs
+
+
+def bench_bert_fusion(ctx):
+    inputs, model = ctx.inputs, ctx.model.eval()
+    return torch.no_grad()(lambda: model.text_encoder.bert(encoder_embeds=inputs.text_embeds,
+                                                            attention_mask=inputs.text.attention_mask,
+                                                            encoder_hidden_states=inputs.image_embeds,
+                                                            encoder_attention_mask=inputs.image_atts,
+                                                            return_dict=True, mode='fusion')), ctx.bs
+
+
+def bench_train_step(ctx):
+    """HAMMER.forward in train mode and the backward of the summed losses"""
+    inputs, model = ctx.inputs, ctx.model
+
+    def step():
+        model.train()
+        model.zero_grad(set_to_none=True)
+        losses = model(inputs.image, inputs.label, inputs.text, inputs.fake_image_box, inputs.fake_token_pos, alpha=0.4)
+        sum(losses).backward()
+    return step, ctx.bs
+
+
+def bench_eval_forward(ctx):
+    inputs, model = ctx.inputs, ctx.model.eval()
+    return torch.no_grad()(lambda: model(inputs.image, inputs.label, inputs.text, inputs.fake_image_box,
+                                         inputs.fake_token_pos, is_train=False)), ctx.bs
+
+
+def bench_cos_sim(ctx):
+    inputs, model = ctx.inputs, ctx.model
+    return torch.no_grad()(lambda: model.cos_sim(inputs.image_embeds, inputs.text_embeds, inputs.image_atts,
+                                                 inputs.text.attention_mask, inputs.image_score, inputs.text_score,
+                                                 inputs.real_pos)), ctx.bs
+
+
+def bench_mask_feat(ctx):
+    inputs, model = ctx.inputs, ctx.model
+    return lambda: model._mask_feat(inputs.image_embeds, inputs.image_atts.sum(1), inputs.image_score, mask_rate=0.3), ctx.bs
+
+
+def bench_momentum_update(ctx):
+    return ctx.model._momentum_update, ctx.bs
+
+
+class _EvalOutputs(torch.nn.Module):
+    """stands in for HAMMER in evaluation(), random outputs of the eval branch"""
+
+    def forward(self, image, label, text, fake_image_box, fake_token_pos, is_train=False):
+        bs, seq_len = text.input_ids.shape
+        device = text.input_ids.device
+        return (torch.randn(bs, 2, device=device), torch.randn(bs, 4, device=device),
+                torch.rand(bs, 4, device=device) * 0.5 + 0.25, torch.randn(bs, seq_len - 1, 2, device=device))
+
+
+def bench_evaluation_metrics(ctx, num_batches=8):
+    """metric code of train.evaluation (ROC, mAP, IoU, token F1) over num_batches batches, tokenization included"""
+    from train import evaluation
+    bs, res = ctx.bs, ctx.config['image_res']
+    # the labels continue from batch to batch, so small batches still cover all classes
+    batches = [(torch.zeros(bs, 3, 1, 1), (torch.arange(bs) + b * bs) % 9, make_captions(ctx.rng, bs),
+                torch.tensor([[0.5, 0.5, 0.3, 0.3]]).repeat(bs, 1), ctx.fake_word_pos, res, res)
+               for b in range(num_batches)]
+    args = SimpleNamespace(log=False)
+    stub = _EvalOutputs()
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            evaluation(args, stub, batches, ctx.tokenizer, ctx.device, ctx.config)
+    return run, bs * num_batches
+
+
+BENCHMARKS = OrderedDict([
+    ('dataset_getitem', bench_dataset_getitem),
+    ('random_augment', bench_random_augment),
+    ('tokenize', bench_tokenize),
+    ('vit', bench_vit),
+    ('bert_text', bench_bert_text),
+    ('bert_fusion', bench_bert_fusion),
+    ('train_step', bench_train_step),
+    ('eval_forward', bench_eval_forward),
+    ('cos_sim', bench_cos_sim),
+    ('mask_feat', bench_mask_feat),
+    ('momentum_update', bench_momentum_update),
+    ('evaluation_metrics', bench_evaluation_metrics),
+])
+
+
+def init_single_process_group(device, tmp_dir):
+    """HAMMER.forward gathers the queue keys across processes, a group of one is enough"""
+    if dist.is_initialized():
+        return
+    backend = 'nccl' if torch.device(device).type == 'cuda' else 'gloo'
+    dist.init_process_group(backend, init_method='file://' + os.path.join(tmp_dir, 'process_group'),
+                            rank=0, world_size=1)
+
+
+def main(args):
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    random.seed(args.seed)
+
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.Loader)
+    config['image_res'] = args.image_res
+    # the queue is filled batch by batch
+    config['queue_size'] = config['queue_size'] // args.batch_size * args.batch_size
+
+    names = args.benchmarks.split(',') if args.benchmarks else list(BENCHMARKS)
+    results = OrderedDict()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        init_single_process_group(args.device, tmp_dir)
+        ctx = Context(args, config, tmp_dir)
+        for name in names:
+            fn, num_samples = BENCHMARKS[name](ctx)
+            results[name] = measure(fn, num_samples, ctx.device, iters=args.iters, warmup=args.warmup)
+            print('{:20s} | {samples_per_s:10.2f} samples/s | p50 {latency_p50_ms:9.2f} ms | '
+                  'p99 {latency_p99_ms:9.2f} ms'.format(name, **results[name]), flush=True)
+        dist.destroy_process_group()
+
+    report = {'env': environment(args.device),
+              'settings': {'batch_size': args.batch_size, 'image_res': args.image_res, 'iters': args.iters,
+                           'warmup': args.warmup, 'config': args.config},
+              'results': results}
+
+    regressions = []
+    if args.baseline:
+        regressions = compare(results, load_baseline(args.baseline), args.tolerance)
+        report['baseline'] = args.baseline
+        report['regressions'] = [{'name': name, 'samples_per_s': current, 'baseline_samples_per_s': reference}
+                                 for name, current, reference in regressions]
+        for name, current, reference in regressions:
+            print('REGRESSION {}: {:.2f} samples/s, baseline {:.2f} samples/s ({:+.1f}%)'.format(
+                name, current, reference, (current / reference - 1) * 100), flush=True)
+        if not regressions:
+            print('no regression against %s (tolerance %.0f%%)' % (args.baseline, args.tolerance * 100))
+
+    write_report(args.output, report)
+    if args.save_baseline:
+        write_report(args.save_baseline, report)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='./configs/train.yaml')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--benchmarks', default='', help='comma separated subset of: ' + ','.join(BENCHMARKS))
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--image_res', default=256, type=int)
+    parser.add_argument('--iters', default=10, type=int)
+    parser.add_argument('--warmup', default=2, type=int)
+    parser.add_argument('--seed', default=777, type=int)
+    parser.add_argument('--num_threads', default=None, type=int, help='intra-op threads, default all available cores')
+    parser.add_argument('--output', default='results/benchmarks/report.json')
+    parser.add_argument('--baseline', default='', help='report of a previous run to compare against')
+    parser.add_argument('--tolerance', default=0.1, type=float, help='allowed throughput drop against the baseline')
+    parser.add_argument('--save_baseline', default='', help='also write the report to this path, as the new baseline')
+    parser.add_argument('--fail_on_regression', default=False, action='store_true')
+
+    args = parser.parse_args()
+    main(args)
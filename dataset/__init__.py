@@ -34,9 +34,12 @@ def create_sampler(datasets, shuffles, num_tasks, global_rank):
     return samplers     
 
 
-def create_loader(datasets, samplers, batch_size, num_workers, is_trains, collate_fns):
+def create_loader(datasets, samplers, batch_size, num_workers, is_trains, collate_fns, generators=None):
+    # generators: torch.Generator per loader for the worker base seeds, None draws them from the global RNG
+    if generators is None:
+        generators = [None] * len(datasets)
     loaders = []
-    for dataset,sampler,bs,n_worker,is_train,collate_fn in zip(datasets,samplers,batch_size,num_workers,is_trains,collate_fns):
+    for dataset,sampler,bs,n_worker,is_train,collate_fn,generator in zip(datasets,samplers,batch_size,num_workers,is_trains,collate_fns,generators):
         if is_train:
             shuffle = (sampler is None)
             drop_last = True
@@ -52,6 +55,7 @@ def create_loader(datasets, samplers, batch_size, num_workers, is_trains, collat
             shuffle=shuffle,
             collate_fn=collate_fn,
             drop_last=drop_last,
+            generator=generator,
         )              
         loaders.append(loader)
     return loaders    
\ No newline at end of file
@@ -11,6 +11,7 @@ ImageFile.LOAD_TRUNCATED_IMAGES = True
 Image.MAX_IMAGE_PIXELS = None
 
 from dataset.utils import pre_caption
+from tools.multilabel_metrics import CLS2ID
 import os
 from torchvision.transforms.functional import hflip, resize
 
@@ -21,7 +22,8 @@ from random import random as rand
 class DGM4_Dataset(Dataset):
     def __init__(self, config, ann_file, transform, max_words=30, is_train=True): 
         
-        self.root_dir = '../../datasets'       
+        # directory the image paths of the metadata are relative to
+        self.root_dir = config.get('root_dir', '../../datasets')
         self.ann = []
         for f in ann_file:
             self.ann += json.load(open(f,'r'))
@@ -92,7 +94,7 @@ class DGM4_Dataset(Dataset):
                         h / self.image_res],
                         dtype=torch.float)
 
-        label = ann['fake_cls']
+        label = CLS2ID[ann['fake_cls']] # integer label id, see tools.multilabel_metrics.MANIPULATION_CLASSES
         caption = pre_caption(ann['text'], self.max_words)
         fake_text_pos = ann['fake_text_pos']
 
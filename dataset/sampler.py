@@ -0,0 +1,64 @@
+import random
+
+import numpy as np
+from torch.utils.data import Dataset, DistributedSampler, get_worker_info
+
+
+class ResumableSampler(DistributedSampler):
+    """
+    DistributedSampler that can start an epoch part way through, also used
+    without torch.distributed (num_replicas=1, rank=0).
+
+    set_start_index(step * batch_size) after set_epoch(epoch) skips the samples
+    this rank already consumed in that epoch. The permutation only depends on
+    (seed, epoch), so the remaining samples are the ones the interrupted run
+    would have seen. Yields (index, sample_seed) pairs for SeededDataset.
+    """
+    def __init__(self, dataset, num_replicas=1, rank=0, shuffle=True, seed=0):
+        super().__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=shuffle, seed=seed, drop_last=False)
+        self.start_index = 0
+
+    def set_epoch(self, epoch):
+        super().set_epoch(epoch)
+        self.start_index = 0
+
+    def set_start_index(self, start_index):
+        self.start_index = start_index
+
+    def sample_seed(self, index):
+        return ((self.seed * 1000003 + self.epoch) * 1000003 + index) % 2**32
+
+    def __iter__(self):
+        indices = list(super().__iter__())[self.start_index:]
+        return iter([(index, self.sample_seed(index)) for index in indices])
+
+    def __len__(self):
+        return self.num_samples - self.start_index
+
+
+class SeededDataset(Dataset):
+    """
+    Seeds python random and np.random with the sample seed of ResumableSampler
+    before reading a sample, the augmentation of a sample depends neither on the
+    DataLoader worker it lands on nor on the samples read before it.
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, key):
+        index, seed = key
+        # num_workers=0: the sample is read in the training process, keep its random streams intact
+        main_process = get_worker_info() is None
+        if main_process:
+            states = random.getstate(), np.random.get_state()
+        random.seed(seed)
+        np.random.seed(seed)
+        try:
+            return self.dataset[index]
+        finally:
+            if main_process:
+                random.setstate(states[0])
+                np.random.set_state(states[1])
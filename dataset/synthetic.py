@@ -0,0 +1,172 @@
+"""
+Synthetic DGM4: metadata json files with the schema of DGM4 and matching random
+JPEGs, for load and scaling tests of the data pipeline and of training without
+the real dataset. From the repo root:
+
+    python -m dataset.synthetic --root ../../datasets_synthetic --num_train 200000 --num_images 20000
+
+writes <root>/DGM4/metadata/{train,val,test}.json and the images to
+<root>/DGM4/synthetic/, then point root_dir of the config to <root> and
+train_file / val_file to the metadata. Every sample has the fields read by
+DGM4_Dataset: image, text, fake_cls over the nine manipulation classes,
+fake_image_box ([] when the face is not manipulated) and fake_text_pos ([] when
+the text is not manipulated), plus id and mtcnn_boxes. With --num_images smaller
+than the number of samples the samples cycle through the images, so a 10x larger
+split does not need 10x the disk. Images, captions and labels only depend on
+--seed, not on --workers.
+"""
+import argparse
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+from tools.multilabel_metrics import MANIPULATION_CLASSES
+
+WORDS = ['police', 'minister', 'president', 'crowd', 'city', 'election', 'protest', 'player', 'team', 'game',
+         'court', 'market', 'storm', 'river', 'school', 'student', 'doctor', 'hospital', 'army', 'soldier',
+         'leader', 'party', 'vote', 'speech', 'meeting', 'street', 'fire', 'family', 'child', 'woman', 'man',
+         'celebrate', 'attend', 'visit', 'arrive', 'leave', 'win', 'lose', 'hold', 'speak', 'watch', 'walk',
+         'the', 'a', 'in', 'at', 'of', 'on', 'during', 'after', 'before', 'with', 'for', 'and', 'to', 'new']
+IMAGE_DIR = 'DGM4/synthetic'
+METADATA_DIR = 'DGM4/metadata'
+
+
+def image_path(idx):
+    return '%s/%07d.jpg' % (IMAGE_DIR, idx)
+
+
+def image_size(seed, idx, size_range):
+    """(W, H) of image idx, both sides uniform in size_range"""
+    rng = np.random.RandomState([seed, idx])
+    return tuple(int(s) for s in rng.randint(size_range[0], size_range[1] + 1, 2))
+
+
+def make_image(seed, idx, size_range):
+    """
+    Smooth random image: noise upsampled from 1/16 of the size plus fine noise, which
+    JPEG compresses and decodes closer to a photo than white noise does.
+    """
+    W, H = image_size(seed, idx, size_range)
+    rng = np.random.RandomState([seed, idx, 1])
+    coarse = rng.randint(0, 256, (max(H // 16, 1), max(W // 16, 1), 3), dtype=np.uint8)
+    image = np.asarray(Image.fromarray(coarse).resize((W, H), Image.BICUBIC), dtype=np.int16)
+    image = image + rng.randint(-8, 9, image.shape)
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8))
+
+
+def _write_image(job):
+    root, seed, idx, size_range, quality = job
+    make_image(seed, idx, size_range).save(os.path.join(root, image_path(idx)), quality=quality)
+
+
+def write_images(root, num_images, seed=0, size_range=(256, 640), quality=90, workers=1):
+    os.makedirs(os.path.join(root, IMAGE_DIR), exist_ok=True)
+    jobs = [(root, seed, idx, size_range, quality) for idx in range(num_images)]
+    if workers > 1:
+        with Pool(workers) as pool:
+            for _ in pool.imap_unordered(_write_image, jobs, chunksize=64):
+                pass
+    else:
+        for job in jobs:
+            _write_image(job)
+
+
+def make_caption(rng, words_mean=18., words_std=6., min_words=5, max_words=40):
+    """caption with a normal number of words clipped to [min_words, max_words]"""
+    num_words = int(np.clip(round(rng.normal(words_mean, words_std)), min_words, max_words))
+    return ' '.join(rng.choice(WORDS, num_words))
+
+
+def make_box(rng, W, H):
+    """face box [x0, y0, x1, y1] of 1/8 to 1/2 of the image side"""
+    w = rng.randint(max(W // 8, 1), max(W // 2, 2))
+    h = rng.randint(max(H // 8, 1), max(H // 2, 2))
+    x0, y0 = rng.randint(0, W - w + 1), rng.randint(0, H - h + 1)
+    return [int(x0), int(y0), int(x0 + w), int(y0 + h)]
+
+
+def make_annotation(rng, sample_id, image_idx, W, H, fake_cls, **caption_kwargs):
+    text = make_caption(rng, **caption_kwargs)
+    face_box = make_box(rng, W, H)
+    fake_text_pos = []
+    if 'text' in fake_cls:
+        num_words = len(text.split())
+        num_fake = rng.randint(1, max(num_words // 3, 1) + 1)
+        fake_text_pos = sorted(rng.choice(num_words, num_fake, replace=False).tolist())
+    return {'id': sample_id, 'image': image_path(image_idx), 'text': text, 'fake_cls': fake_cls,
+            'fake_image_box': face_box if 'face' in fake_cls else [],
+            'fake_text_pos': fake_text_pos, 'mtcnn_boxes': [face_box]}
+
+
+def make_split(num_samples, num_images, seed=0, size_range=(256, 640), class_weights=None, first_id=0,
+               first_image=0, **caption_kwargs):
+    """
+    Metadata of num_samples samples using images first_image .. first_image + num_images - 1
+    in turn. class_weights are the relative frequencies of MANIPULATION_CLASSES, uniform by default.
+    """
+    rng = np.random.RandomState([seed, first_id])
+    p = np.ones(len(MANIPULATION_CLASSES)) if class_weights is None else np.asarray(class_weights, dtype=np.float64)
+    if len(p) != len(MANIPULATION_CLASSES):
+        raise ValueError('Expected %d class weights, got %d' % (len(MANIPULATION_CLASSES), len(p)))
+    labels = rng.choice(len(MANIPULATION_CLASSES), num_samples, p=p / p.sum())
+    ann = []
+    for i, label in enumerate(labels.tolist()):
+        image_idx = first_image + i % num_images
+        W, H = image_size(seed, image_idx, size_range)
+        ann.append(make_annotation(rng, first_id + i, image_idx, W, H, MANIPULATION_CLASSES[label], **caption_kwargs))
+    return ann
+
+
+def generate(root, splits, num_images=None, seed=0, size_range=(256, 640), quality=90, class_weights=None,
+             workers=1, **caption_kwargs):
+    """
+    Writes the metadata of splits ({name: num_samples}) and their images under root.
+    Each split cycles through its own num_images images (default: one per sample).
+    Returns {name: metadata file}.
+    """
+    os.makedirs(os.path.join(root, METADATA_DIR), exist_ok=True)
+    ann_files = {}
+    first_id = first_image = 0
+    for name, num_samples in splits.items():
+        split_images = min(num_images or num_samples, num_samples)
+        ann = make_split(num_samples, split_images, seed=seed, size_range=size_range, class_weights=class_weights,
+                         first_id=first_id, first_image=first_image, **caption_kwargs)
+        ann_files[name] = os.path.join(root, METADATA_DIR, '%s.json' % name)
+        with open(ann_files[name], 'w') as f:
+            json.dump(ann, f)
+        first_id += num_samples
+        first_image += split_images
+    write_images(root, first_image, seed=seed, size_range=size_range, quality=quality, workers=workers)
+    return ann_files
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', required=True, help='written to, becomes root_dir of the config')
+    parser.add_argument('--num_train', default=10000, type=int)
+    parser.add_argument('--num_val', default=1000, type=int)
+    parser.add_argument('--num_test', default=1000, type=int)
+    parser.add_argument('--num_images', default=None, type=int, help='distinct images per split, default one per sample')
+    parser.add_argument('--image_size', default=[256, 640], type=int, nargs=2, metavar=('MIN', 'MAX'),
+                        help='range of the image width and height')
+    parser.add_argument('--quality', default=90, type=int, help='JPEG quality')
+    parser.add_argument('--words_mean', default=18., type=float)
+    parser.add_argument('--words_std', default=6., type=float)
+    parser.add_argument('--min_words', default=5, type=int)
+    parser.add_argument('--max_words', default=40, type=int)
+    parser.add_argument('--class_weights', default=None, type=float, nargs=len(MANIPULATION_CLASSES),
+                        help='relative frequency of ' + ' '.join(MANIPULATION_CLASSES))
+    parser.add_argument('--workers', default=1, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    splits = {'train': args.num_train, 'val': args.num_val, 'test': args.num_test}
+    ann_files = generate(args.root, {name: num for name, num in splits.items() if num > 0}, num_images=args.num_images,
+                         seed=args.seed, size_range=args.image_size, quality=args.quality,
+                         class_weights=args.class_weights, workers=args.workers, words_mean=args.words_mean,
+                         words_std=args.words_std, min_words=args.min_words, max_words=args.max_words)
+    for name, ann_file in ann_files.items():
+        print('%s: %d samples in %s' % (name, splits[name], ann_file))
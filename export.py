@@ -0,0 +1,124 @@
+import warnings
+warnings.filterwarnings("ignore")
+
+import os
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import argparse
+import ruamel.yaml as yaml
+import json
+
+import torch
+
+from transformers import BertTokenizerFast
+
+from models.HAMMER import HAMMERInference
+from infer_cpu import build_model
+
+INPUT_NAMES = ['image', 'input_ids', 'attention_mask']
+OUTPUT_NAMES = ['logits_real_fake', 'logits_multicls', 'output_coord', 'logits_tok']
+DYNAMIC_AXES = {'image': {0: 'batch'},
+                'input_ids': {0: 'batch', 1: 'seq'},
+                'attention_mask': {0: 'batch', 1: 'seq'},
+                'logits_real_fake': {0: 'batch'},
+                'logits_multicls': {0: 'batch'},
+                'output_coord': {0: 'batch'},
+                'logits_tok': {0: 'batch', 1: 'seq'}}
+
+EXAMPLE_TEXTS = ['A man speaks at a press conference in Washington on Tuesday.',
+                 'Police officers stand guard outside the court.']
+
+
+def example_inputs(tokenizer, config, batch_size, max_length, seed=0):
+    """random images + tokenized captions, padded so the key padding mask is exercised"""
+    g = torch.Generator().manual_seed(seed)
+    image = torch.randn(batch_size, 3, config['image_res'], config['image_res'], generator=g)
+    texts = [EXAMPLE_TEXTS[i % len(EXAMPLE_TEXTS)] for i in range(batch_size)]
+    text = tokenizer(texts, max_length=max_length, truncation=True, padding='max_length',
+                     return_attention_mask=True, return_token_type_ids=False, return_tensors='pt')
+    return image, text.input_ids, text.attention_mask
+
+
+def max_abs_diff(outputs, references):
+    return {name: (out - ref).abs().max().item() for name, out, ref in zip(OUTPUT_NAMES, outputs, references)}
+
+
+def check_parity(name, diffs, atol):
+    print(f'{name} max abs diff: ' + ', '.join(f'{k} {v:.2e}' for k, v in diffs.items()))
+    if max(diffs.values()) > atol:
+        raise RuntimeError(f'{name} output differs from the eager model by more than {atol}')
+
+
+@torch.no_grad()
+def export_torchscript(model, inputs, check_inputs, output_file, atol):
+    traced = torch.jit.trace(model, inputs, check_trace=False)
+    traced = torch.jit.freeze(traced)
+    traced.save(output_file)
+    print('saved TorchScript model to %s' % output_file)
+
+    loaded = torch.jit.load(output_file, map_location='cpu')
+    for i, x in enumerate([inputs] + check_inputs):
+        check_parity(f'torchscript [{i}]', max_abs_diff(loaded(*x), model(*x)), atol)
+    return loaded
+
+
+@torch.no_grad()
+def export_onnx(model, inputs, check_inputs, output_file, opset, atol):
+    torch.onnx.export(model, inputs, output_file,
+                      input_names=INPUT_NAMES,
+                      output_names=OUTPUT_NAMES,
+                      dynamic_axes=DYNAMIC_AXES,
+                      opset_version=opset,
+                      do_constant_folding=True)
+    print('saved ONNX model to %s' % output_file)
+
+    try:
+        import onnxruntime
+    except ImportError:
+        print('onnxruntime is not installed, skip the ONNX parity check')
+        return
+    session = onnxruntime.InferenceSession(output_file, providers=['CPUExecutionProvider'])
+    for i, x in enumerate([inputs] + check_inputs):
+        outputs = session.run(OUTPUT_NAMES, {name: t.numpy() for name, t in zip(INPUT_NAMES, x)})
+        check_parity(f'onnx [{i}]', max_abs_diff([torch.from_numpy(o) for o in outputs], model(*x)), atol)
+
+
+def main(args, config):
+    tokenizer = BertTokenizerFast.from_pretrained(args.text_encoder)
+    model = HAMMERInference(build_model(args, config, tokenizer)).eval()
+
+    inputs = example_inputs(tokenizer, config, args.batch_size, args.seq_len)
+    # other batch sizes / sequence lengths check the dynamic shapes of the exported graph
+    check_inputs = [example_inputs(tokenizer, config, args.batch_size + 1, args.seq_len // 2, seed=1)]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    formats = args.format.split(',')
+    if 'torchscript' in formats:
+        export_torchscript(model, inputs, check_inputs, os.path.join(args.output_dir, 'HAMMER.torchscript.pt'), args.atol)
+    if 'onnx' in formats:
+        export_onnx(model, inputs, check_inputs, os.path.join(args.output_dir, 'HAMMER.onnx'), args.opset, args.atol)
+
+    with open(os.path.join(args.output_dir, 'export_meta.json'), 'w') as f:
+        json.dump({'checkpoint': args.checkpoint, 'image_res': config['image_res'], 'max_length': args.seq_len,
+                   'inputs': INPUT_NAMES, 'outputs': OUTPUT_NAMES, 'torch': torch.__version__}, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='./configs/test.yaml')
+    parser.add_argument('--checkpoint', required=True)
+    parser.add_argument('--output_dir', default='results/export')
+    parser.add_argument('--text_encoder', default='bert-base-uncased')
+    parser.add_argument('--format', default='torchscript,onnx', type=str)
+    parser.add_argument('--batch_size', default=2, type=int)
+    parser.add_argument('--seq_len', default=128, type=int, help='max_length of the tokenizer, as in evaluation')
+    parser.add_argument('--opset', default=14, type=int)
+    parser.add_argument('--atol', default=1e-4, type=float)
+    parser.add_argument('--token_momentum', default=False, action='store_true')
+
+    args = parser.parse_args()
+    args.log = True
+
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.Loader)
+
+    main(args, config)
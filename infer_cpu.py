@@ -0,0 +1,136 @@
+import warnings
+warnings.filterwarnings("ignore")
+
+import os
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+import argparse
+import ruamel.yaml as yaml
+import numpy as np
+import random
+import time
+import json
+import platform
+from types import SimpleNamespace
+
+import torch
+
+from transformers import BertTokenizerFast
+
+from dataset import create_dataset, create_loader
+from models.builder import build_hammer
+from models.quantization import set_cpu_threads, quantize_hammer_dynamic, model_size_mb
+from train import evaluation
+
+EVAL_METRICS = ['AUC_cls', 'ACC_cls', 'EER_cls',
+                'MAP', 'OP', 'OR', 'OF1', 'CP', 'CR', 'CF1', 'OP_k', 'OR_k', 'OF1_k', 'CP_k', 'CR_k', 'CF1_k',
+                'IOU_score', 'IOU_ACC_50', 'IOU_ACC_75', 'IOU_ACC_95',
+                'ACC_tok', 'Precision_tok', 'Recall_tok', 'F1_tok']
+
+
+def build_model(args, config, tokenizer):
+    model = build_hammer(args, config, args.text_encoder, tokenizer, checkpoint=args.checkpoint, skip_momentum=True)
+    return model.eval()
+
+
+def create_heldout_loader(config, num_samples):
+    _, val_dataset = create_dataset(config)
+    if num_samples > 0:
+        val_dataset = torch.utils.data.Subset(val_dataset, range(min(num_samples, len(val_dataset))))
+    return create_loader([val_dataset], [None],
+                         batch_size=[config['batch_size_val']],
+                         num_workers=[4],
+                         is_trains=[False],
+                         collate_fns=[None])[0]
+
+
+@torch.no_grad()
+def benchmark(model, config, batch_sizes, seq_len=40, warmup=3, iters=20):
+    """latency / throughput of the HAMMER eval forward on synthetic inputs"""
+    results = []
+    for bs in batch_sizes:
+        image = torch.randn(bs, 3, config['image_res'], config['image_res'])
+        input_ids = torch.randint(1000, model.text_encoder.config.vocab_size, (bs, seq_len))
+        input_ids[:, 0] = model.tokenizer.cls_token_id
+        text = SimpleNamespace(input_ids=input_ids, attention_mask=torch.ones_like(input_ids))
+
+        for _ in range(warmup):
+            model(image, None, text, None, None, is_train=False)
+        times = []
+        for _ in range(iters):
+            start = time.perf_counter()
+            model(image, None, text, None, None, is_train=False)
+            times.append(time.perf_counter() - start)
+        times = np.array(times)
+        results.append({'batch_size': bs,
+                        'latency_p50_ms': float(np.percentile(times, 50) * 1000),
+                        'latency_p99_ms': float(np.percentile(times, 99) * 1000),
+                        'throughput_samples_per_s': float(bs / times.mean())})
+        print('bs {batch_size:3d} | p50 {latency_p50_ms:9.2f} ms | p99 {latency_p99_ms:9.2f} ms | {throughput_samples_per_s:8.2f} samples/s'.format(**results[-1]), flush=True)
+    return results
+
+
+def main(args, config):
+    num_threads, num_interop_threads = set_cpu_threads(args.num_threads, args.num_interop_threads)
+    print(f'intra-op threads: {num_threads}, inter-op threads: {num_interop_threads}')
+
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    random.seed(args.seed)
+
+    tokenizer = BertTokenizerFast.from_pretrained(args.text_encoder)
+    model = build_model(args, config, tokenizer)
+    batch_sizes = [int(bs) for bs in args.batch_sizes.split(',')]
+    data_loader = create_heldout_loader(config, args.num_samples) if args.num_samples != 0 else None
+    device = torch.device('cpu')
+
+    report = {'env': {'torch': torch.__version__, 'platform': platform.platform(), 'processor': platform.processor(),
+                      'num_threads': num_threads, 'num_interop_threads': num_interop_threads},
+              'checkpoint': args.checkpoint}
+    for precision in ['fp32', 'int8']:
+        if precision == 'int8':
+            quantize_hammer_dynamic(model)
+        print(f'======== {precision} ({model_size_mb(model):.1f} MB) ========')
+        report[precision] = {'size_mb': model_size_mb(model)}
+        if data_loader is not None:
+            metrics = evaluation(args, model, data_loader, tokenizer, device, config)
+            report[precision]['metrics'] = dict(zip(EVAL_METRICS, metrics))
+        report[precision]['benchmark'] = benchmark(model, config, batch_sizes, args.seq_len, args.warmup, args.iters)
+
+    if data_loader is not None:
+        # accuracy delta of int8 against fp32, in percentage points
+        report['delta'] = {k: round((report['int8']['metrics'][k] - report['fp32']['metrics'][k]) * 100, 4) for k in EVAL_METRICS}
+        print('accuracy delta (int8 - fp32, %):', report['delta'])
+    speedup = [fp32['latency_p50_ms'] / int8['latency_p50_ms'] for fp32, int8 in zip(report['fp32']['benchmark'], report['int8']['benchmark'])]
+    report['speedup_p50'] = dict(zip(batch_sizes, speedup))
+    print('p50 speedup:', report['speedup_p50'])
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, 'cpu_int8_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='./configs/test.yaml')
+    parser.add_argument('--checkpoint', required=True)
+    parser.add_argument('--output_dir', default='results/cpu_int8')
+    parser.add_argument('--text_encoder', default='bert-base-uncased')
+    parser.add_argument('--seed', default=777, type=int)
+    parser.add_argument('--num_threads', default=None, type=int, help='intra-op threads, default all available cores')
+    parser.add_argument('--num_interop_threads', default=1, type=int)
+    parser.add_argument('--num_samples', default=2000, type=int,
+                        help='held-out samples for the accuracy delta, -1 = whole val_file, 0 = benchmark only')
+    parser.add_argument('--batch_sizes', default='1,8,32', type=str)
+    parser.add_argument('--seq_len', default=40, type=int)
+    parser.add_argument('--warmup', default=3, type=int)
+    parser.add_argument('--iters', default=20, type=int)
+    parser.add_argument('--token_momentum', default=False, action='store_true')
+
+    args = parser.parse_args()
+    args.log = True
+    args.device = 'cpu'
+
+    config = yaml.load(open(args.config, 'r'), Loader=yaml.Loader)
+
+    main(args, config)
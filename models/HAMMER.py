@@ -1,3 +1,4 @@
+from contextlib import nullcontext
 from functools import partial
 from models.vit import VisionTransformer, interpolate_pos_embed
 from models.xbert import BertConfig, BertForMaskedLM, BertForTokenClassification
@@ -10,7 +11,8 @@ import numpy as np
 import random
 
 from models import box_ops
-from tools.multilabel_metrics import get_multi_label
+from tools.multilabel_metrics import get_multi_label_from_ids, label_to_ids
+from tools.profiler import region
 from timm.models.layers import trunc_normal_
 from .transformer import DualTransformer
 import pdb
@@ -33,8 +35,15 @@ class HAMMER(nn.Module):
                  config = None,               
                  text_encoder = None,
                  tokenizer = None,
-                 init_deit = True
+                 init_deit = True,
+                 init_bert = True,
+                 init_weights = True
                  ):
+        """
+        init_deit / init_bert: load the DeiT / BERT pretrained weights (network or hub cache),
+        init_weights: run HAMMER._init_weights over the model.
+        Turn them all off when the weights come from a HAMMER checkpoint, see models.builder.
+        """
         super().__init__()
         
         self.args = args
@@ -58,9 +67,12 @@ class HAMMER(nn.Module):
         vision_width = config['vision_width']       
         bert_config = BertConfig.from_json_file(config['bert_config'])
         
-        self.text_encoder = BertForTokenClassification.from_pretrained(text_encoder, 
-                                                                    config=bert_config, 
-                                                                    label_smoothing=config['label_smoothing'])      
+        if init_bert:
+            self.text_encoder = BertForTokenClassification.from_pretrained(text_encoder, 
+                                                                        config=bert_config, 
+                                                                        label_smoothing=config['label_smoothing'])      
+        else:
+            self.text_encoder = BertForTokenClassification(bert_config, label_smoothing=config['label_smoothing'])
 
         text_width = self.text_encoder.config.hidden_size
         self.vision_proj = nn.Linear(vision_width, embed_dim)
@@ -84,9 +96,8 @@ class HAMMER(nn.Module):
             img_size=config['image_res'], patch_size=16, embed_dim=768, depth=12, num_heads=12, 
             mlp_ratio=4, qkv_bias=True, norm_layer=partial(nn.LayerNorm, eps=1e-6)) 
         self.vision_proj_m = nn.Linear(vision_width, embed_dim)
-        self.text_encoder_m = BertForTokenClassification.from_pretrained(text_encoder, 
-                                                                    config=bert_config,
-                                                                    label_smoothing=config['label_smoothing'])       
+        # weights are copied from text_encoder by copy_params, no need to load BERT again
+        self.text_encoder_m = BertForTokenClassification(bert_config, label_smoothing=config['label_smoothing'])
         self.text_proj_m = nn.Linear(text_width, embed_dim)    
 
         # vision_width = text_width = 768
@@ -123,8 +134,51 @@ class HAMMER(nn.Module):
         self.norm_layer_it_cross_atten =nn.LayerNorm(text_width)
         self.it_cross_attn = nn.MultiheadAttention(text_width, 12, dropout=0.0, batch_first=True)
 
-        trunc_normal_(self.cls_token_local, std=.02)
-        self.apply(self._init_weights)
+        if init_weights:
+            trunc_normal_(self.cls_token_local, std=.02)
+            self.apply(self._init_weights)
+
+        # set by update_frozen once the frozen parameters are known
+        self.frozen_vision = False
+        self.frozen_text = False
+        self.momentum_params = None
+
+        # all_gather of the momentum features for the queues
+        self.feat_gather = FeatureGather()
+
+    def text_mode_parameters(self):
+        """parameters of the BERT part run in mode='text': embeddings and the layers below fusion_layer"""
+        bert = self.text_encoder.bert
+        yield from bert.embeddings.parameters()
+        for layer in bert.encoder.layer[:self.text_encoder.config.fusion_layer]:
+            yield from layer.parameters()
+
+    def ddp_unused_parameters(self):
+        """
+        Names of the trainable parameters that forward never uses, for DDP to ignore
+        instead of searching the graph for them (see tools/ddp.py): the encoder attention
+        of decoder1 of the REC transformers, which always run with decoding=2.
+        """
+        return ['%s.%s' % (module, name) for module in ['rec_text_trans', 'rec_image_trans']
+                for name in getattr(self, module).unused_parameters(decoding=2)]
+
+    @torch.no_grad()
+    def update_frozen(self):
+        """
+        Call after freezing parameters (requires_grad=False) and loading the weights.
+        A frozen visual encoder / text part of the BERT then runs without autograd and
+        its output stands in for the momentum encoder's. The frozen parameters are
+        copied to their momentum copies once and skipped by _momentum_update.
+        """
+        self.frozen_vision = not any(p.requires_grad for p in self.visual_encoder.parameters())
+        self.frozen_text = not any(p.requires_grad for p in self.text_mode_parameters())
+        self.momentum_params = []
+        for model_pair in self.model_pairs:
+            for param, param_m in zip(model_pair[0].parameters(), model_pair[1].parameters()):
+                if param.requires_grad:
+                    self.momentum_params.append((param, param_m))
+                else:
+                    param_m.data.copy_(param.data)
 
     def _init_weights(self, m):
         if isinstance(m, nn.Linear):
@@ -181,223 +235,252 @@ class HAMMER(nn.Module):
             with torch.no_grad():
                 self.temp.clamp_(0.001,0.5)
             ##================= multi-label convert ========================## 
-            multicls_label, real_label_pos = get_multi_label(label, image)
+            if not torch.is_tensor(label):
+                label = label_to_ids(label) # fake_cls strings
+            multicls_label, real_label_mask = get_multi_label_from_ids(label, image.device)
             
             ##================= MAC ========================## 
-            image_embeds = self.visual_encoder(image) 
-            image_atts = torch.ones(image_embeds.size()[:-1],dtype=torch.long).to(image.device)
+            with region('forward/vit'):
+                with torch.no_grad() if self.frozen_vision else nullcontext():
+                    image_embeds = self.visual_encoder(image) 
+                image_atts = torch.ones(image_embeds.size()[:-1],dtype=torch.long).to(image.device)
             
-            image_sequence = F.normalize(self.vision_proj(image_embeds),dim=-1)
-            image_feat = F.normalize(self.vision_proj(image_embeds[:,0,:]),dim=-1)  
-
-            text_output = self.text_encoder.bert(text.input_ids, attention_mask = text.attention_mask,                      
-                                            return_dict = True, mode = 'text')            
-            text_embeds = text_output.last_hidden_state
-            text_sequence = F.normalize(self.text_proj(text_embeds),dim=-1)
-            text_feat = F.normalize(self.text_proj(text_embeds[:,0,:]),dim=-1)                 
+                image_sequence = F.normalize(self.vision_proj(image_embeds),dim=-1)
+                image_feat = F.normalize(self.vision_proj(image_embeds[:,0,:]),dim=-1)  
+
+            with region('forward/bert_text'):
+                with torch.no_grad() if self.frozen_text else nullcontext():
+                    text_output = self.text_encoder.bert(text.input_ids, attention_mask = text.attention_mask,                      
+                                                    return_dict = True, mode = 'text')            
+                text_embeds = text_output.last_hidden_state
+                text_sequence = F.normalize(self.text_proj(text_embeds),dim=-1)
+                text_feat = F.normalize(self.text_proj(text_embeds[:,0,:]),dim=-1)                 
             
             ##================= mask modeling ========================## 
-            # get token of interest
-            image_score = self.image_mlp(image_embeds).squeeze(2)
-            text_score = self.text_mlp(text_embeds).squeeze(2)
+            with region('forward/rec'):
+                # get token of interest
+                image_score = self.image_mlp(image_embeds).squeeze(2)
+                text_score = self.text_mlp(text_embeds).squeeze(2)
 
-            image_score.masked_fill_(torch.tensor((1 - image_atts), dtype=torch.bool), float("-inf"))
-            text_score.masked_fill_(torch.tensor((1 - text.attention_mask), dtype=torch.bool), float("-inf"))
+                image_score.masked_fill_(torch.tensor((1 - image_atts), dtype=torch.bool), float("-inf"))
+                text_score.masked_fill_(torch.tensor((1 - text.attention_mask), dtype=torch.bool), float("-inf"))
             
-            image_score, text_score = torch.softmax(image_score, dim=-1), torch.softmax(text_score, dim=-1)
+                image_score, text_score = torch.softmax(image_score, dim=-1), torch.softmax(text_score, dim=-1)
             
-            # mask text and image
-            masked_image, masked_vec_image = self._mask_feat(image_embeds, image_atts.sum(1), image_score, mask_rate=0.3)
-            masked_text, masked_vec_text = self._mask_feat(text_embeds, text.attention_mask.sum(1), text_score, mask_rate=0.3)
+                # mask text and image
+                masked_image, masked_vec_image = self._mask_feat(image_embeds, image_atts.sum(1), image_score, mask_rate=0.3)
+                masked_text, masked_vec_text = self._mask_feat(text_embeds, text.attention_mask.sum(1), text_score, mask_rate=0.3)
 
-            # rec text and image
-            rec_image = self.rec_image_trans(text_embeds, None, masked_image, None,  decoding=2, gauss_weight=text_score)[1]
-            rec_text = self.rec_text_trans(image_embeds, None, masked_text, None,  decoding=2, gauss_weight=image_score)[1]
+                # rec text and image
+                rec_image = self.rec_image_trans(text_embeds, None, masked_image, None,  decoding=2, gauss_weight=text_score)[1]
+                rec_text = self.rec_text_trans(image_embeds, None, masked_text, None,  decoding=2, gauss_weight=image_score)[1]
 
-            # get loss
+                # get loss
             
-            real_pos = torch.ones(image_embeds.size()[0]).to(image.device)
-            real_pos[real_label_pos] = 0
-            text_mse = self.mse_loss(rec_text, text_embeds) * masked_vec_text * text_score.unsqueeze(2) * real_pos.unsqueeze(1).unsqueeze(1)
-            image_mse = self.mse_loss(rec_image, image_embeds) * masked_vec_image * image_score.unsqueeze(2)  * real_pos.unsqueeze(1).unsqueeze(1)
+                real_pos = (~real_label_mask).float()
+                text_mse = self.mse_loss(rec_text, text_embeds) * masked_vec_text * text_score.unsqueeze(2) * real_pos.unsqueeze(1).unsqueeze(1)
+                image_mse = self.mse_loss(rec_image, image_embeds) * masked_vec_image * image_score.unsqueeze(2)  * real_pos.unsqueeze(1).unsqueeze(1)
 
-            text_sim = self.cos_sim(image_embeds, rec_text, image_atts, text.attention_mask, image_score, text_score,  real_pos)
-            image_sim = self.cos_sim(rec_image, text_embeds, image_atts, text.attention_mask, image_score, text_score,  real_pos)
-            sim = self.cos_sim(image_embeds, text_embeds, image_atts, text.attention_mask, image_score, text_score,  1 - real_pos)
+            with region('forward/cos_sim'):
+                text_sim = self.cos_sim(image_embeds, rec_text, image_atts, text.attention_mask, image_score, text_score,  real_pos)
+                image_sim = self.cos_sim(rec_image, text_embeds, image_atts, text.attention_mask, image_score, text_score,  real_pos)
+                sim = self.cos_sim(image_embeds, text_embeds, image_atts, text.attention_mask, image_score, text_score,  1 - real_pos)
 
-            loss_REC = ((1 - text_mse.mean()) + (1 - image_mse.mean())) /2 + (text_sim + image_sim) /2 + sim
+                loss_REC = ((1 - text_mse.mean()) + (1 - image_mse.mean())) /2 + (text_sim + image_sim) /2 + sim
 
             # get momentum features
-            with torch.no_grad():
-                self._momentum_update()
-                image_embeds_m = self.visual_encoder_m(image) 
-                image_feat_m = F.normalize(self.vision_proj_m(image_embeds_m[:,0,:]),dim=-1)  
-                image_feat_all = torch.cat([image_feat_m.t(),self.image_queue.clone().detach()],dim=1)           
-
-                text_output_m = self.text_encoder_m.bert(text.input_ids, attention_mask = text.attention_mask,                      
-                                                    return_dict = True, mode = 'text')    
-                text_feat_m = F.normalize(self.text_proj_m(text_output_m.last_hidden_state[:,0,:]),dim=-1) 
-                text_feat_all = torch.cat([text_feat_m.t(),self.text_queue.clone().detach()],dim=1)
-
-                sim_i2t_m = image_feat_m @ text_feat_all / self.temp 
-                sim_t2i_m = text_feat_m @ image_feat_all / self.temp     
-
-                sim_targets = torch.zeros(sim_i2t_m.size()).to(image.device)
-                # fine-grained alignment: only orig should be aligned, 1 here means img-text aligned 
-                sim_targets[real_label_pos, real_label_pos] = 1 
-
-                sim_targets_g2g = torch.zeros(sim_i2t_m.size()).to(image.device)
-                sim_targets_g2g.fill_diagonal_(1)       
+            with region('forward/momentum'):
+                with torch.no_grad():
+                    self._momentum_update()
+                    # a frozen encoder is its own momentum encoder
+                    image_embeds_m = image_embeds if self.frozen_vision else self.visual_encoder_m(image) 
+                    image_feat_m = F.normalize(self.vision_proj_m(image_embeds_m[:,0,:]),dim=-1)  
+                    image_feat_all = torch.cat([image_feat_m.t(),self.image_queue.clone().detach()],dim=1)           
+
+                    if self.frozen_text:
+                        text_embeds_m = text_embeds
+                    else:
+                        text_embeds_m = self.text_encoder_m.bert(text.input_ids, attention_mask = text.attention_mask,                      
+                                                            return_dict = True, mode = 'text').last_hidden_state
+                    text_feat_m = F.normalize(self.text_proj_m(text_embeds_m[:,0,:]),dim=-1) 
+                    text_feat_all = torch.cat([text_feat_m.t(),self.text_queue.clone().detach()],dim=1)
+
+                    # gathered for the queues while BIC / IMG / TMG run, enqueued at the end
+                    self.feat_gather.start(image_feat_m, text_feat_m)
+
+                    sim_i2t_m = image_feat_m @ text_feat_all / self.temp 
+                    sim_t2i_m = text_feat_m @ image_feat_all / self.temp     
+
+                    sim_targets = torch.zeros(sim_i2t_m.size()).to(image.device)
+                    # fine-grained alignment: only orig should be aligned, 1 here means img-text aligned 
+                    sim_targets[:, :image.size(0)] = torch.diag(real_label_mask.float())
+
+                    sim_targets_g2g = torch.zeros(sim_i2t_m.size()).to(image.device)
+                    sim_targets_g2g.fill_diagonal_(1)       
                 
-                sim_i2t_targets = alpha * F.softmax(sim_i2t_m, dim=1) + (1 - alpha) * sim_targets
-                sim_t2i_targets = alpha * F.softmax(sim_t2i_m, dim=1) + (1 - alpha) * sim_targets        
+                    sim_i2t_targets = alpha * F.softmax(sim_i2t_m, dim=1) + (1 - alpha) * sim_targets
+                    sim_t2i_targets = alpha * F.softmax(sim_t2i_m, dim=1) + (1 - alpha) * sim_targets        
 
-            sim_i2t = image_feat @ text_feat_all / self.temp 
-            sim_t2i = text_feat @ image_feat_all / self.temp 
+            with region('forward/mac'):
+                sim_i2t = image_feat @ text_feat_all / self.temp 
+                sim_t2i = text_feat @ image_feat_all / self.temp 
                                 
-            loss_i2t = -torch.sum(F.log_softmax(sim_i2t, dim=1)*sim_i2t_targets,dim=1).mean()
-            loss_t2i = -torch.sum(F.log_softmax(sim_t2i, dim=1)*sim_t2i_targets,dim=1).mean() 
+                loss_i2t = -torch.sum(F.log_softmax(sim_i2t, dim=1)*sim_i2t_targets,dim=1).mean()
+                loss_t2i = -torch.sum(F.log_softmax(sim_t2i, dim=1)*sim_t2i_targets,dim=1).mean() 
             
-            # in-modality g2g loss
-            sim_i2i = image_feat @ image_feat_all / self.temp
-            sim_t2t = text_feat @ text_feat_all / self.temp
+                # in-modality g2g loss
+                sim_i2i = image_feat @ image_feat_all / self.temp
+                sim_t2t = text_feat @ text_feat_all / self.temp
 
-            loss_i2i = -torch.sum(F.log_softmax(sim_i2i, dim=1)*sim_targets_g2g,dim=1).mean()
-            loss_t2t = -torch.sum(F.log_softmax(sim_t2t, dim=1)*sim_targets_g2g,dim=1).mean()
+                loss_i2i = -torch.sum(F.log_softmax(sim_i2i, dim=1)*sim_targets_g2g,dim=1).mean()
+                loss_t2t = -torch.sum(F.log_softmax(sim_t2t, dim=1)*sim_targets_g2g,dim=1).mean()
 
-            loss_MAC = (loss_i2t+loss_t2i+loss_i2i+loss_t2t)/4
-
-            self._dequeue_and_enqueue(image_feat_m, text_feat_m)
+                loss_MAC = (loss_i2t+loss_t2i+loss_i2i+loss_t2t)/4
 
             ##================= BIC ========================## 
             # forward the positve image-text pair
-            output_pos = self.text_encoder.bert(encoder_embeds = text_embeds, 
-                                            attention_mask = text.attention_mask,
-                                            encoder_hidden_states = image_embeds,
-                                            encoder_attention_mask = image_atts,      
-                                            return_dict = True,
-                                            mode = 'fusion',
-                                        )            
-            with torch.no_grad():
-                bs = image.size(0)          
+            with region('forward/fusion'):
+                output_pos = self.text_encoder.bert(encoder_embeds = text_embeds, 
+                                                attention_mask = text.attention_mask,
+                                                encoder_hidden_states = image_embeds,
+                                                encoder_attention_mask = image_atts,      
+                                                return_dict = True,
+                                                mode = 'fusion',
+                                            )            
+                with torch.no_grad():
+                    bs = image.size(0)          
 
-            itm_labels = torch.ones(bs, dtype=torch.long).to(image.device)
-            itm_labels[real_label_pos] = 0 # fine-grained matching: only orig should be matched, 0 here means img-text matching
-            vl_output = self.itm_head(output_pos.last_hidden_state[:,0,:])   
-            loss_BIC = F.cross_entropy(vl_output, itm_labels) 
+                itm_labels = (~real_label_mask).long() # fine-grained matching: only orig should be matched, 0 here means img-text matching
+                vl_output = self.itm_head(output_pos.last_hidden_state[:,0,:])   
+                loss_BIC = F.cross_entropy(vl_output, itm_labels) 
 
-            ##================= MLC ========================## 
-            output_cls = self.cls_head(output_pos.last_hidden_state[:,0,:])
-            loss_MLC = F.binary_cross_entropy_with_logits(output_cls, multicls_label.type(torch.float))
+                ##================= MLC ========================## 
+                output_cls = self.cls_head(output_pos.last_hidden_state[:,0,:])
+                loss_MLC = F.binary_cross_entropy_with_logits(output_cls, multicls_label.type(torch.float))
 
             ##================= IMG ========================## 
             # local features of visual part
-            cls_tokens_local = self.cls_token_local.expand(bs, -1, -1)
-
-            text_attention_mask_clone = text.attention_mask.clone() # [:,1:] for ingoring class token
-            local_feat_padding_mask_text = text_attention_mask_clone==0 # 0 = pad token
-
-            local_feat_it_cross_attn = image_embeds + self.it_cross_attn(query=self.norm_layer_it_cross_atten(image_embeds), 
-                                              key=self.norm_layer_it_cross_atten(text_embeds), 
-                                              value=self.norm_layer_it_cross_atten(text_embeds),
-                                              key_padding_mask=local_feat_padding_mask_text)[0]
-
-            local_feat_aggr = self.aggregator(query=self.norm_layer_aggr(cls_tokens_local), 
-                                              key=self.norm_layer_aggr(local_feat_it_cross_attn[:,1:,:]), 
-                                              value=self.norm_layer_aggr(local_feat_it_cross_attn[:,1:,:]))[0]
-            output_coord = self.bbox_head(local_feat_aggr.squeeze(1)).sigmoid()
-            loss_bbox, loss_giou = self.get_bbox_loss(output_coord, fake_image_box)
+            with region('forward/img'):
+                cls_tokens_local = self.cls_token_local.expand(bs, -1, -1)
+
+                text_attention_mask_clone = text.attention_mask.clone() # [:,1:] for ingoring class token
+                local_feat_padding_mask_text = text_attention_mask_clone==0 # 0 = pad token
+
+                local_feat_it_cross_attn = image_embeds + self.it_cross_attn(query=self.norm_layer_it_cross_atten(image_embeds), 
+                                                  key=self.norm_layer_it_cross_atten(text_embeds), 
+                                                  value=self.norm_layer_it_cross_atten(text_embeds),
+                                                  key_padding_mask=local_feat_padding_mask_text)[0]
+
+                local_feat_aggr = self.aggregator(query=self.norm_layer_aggr(cls_tokens_local), 
+                                                  key=self.norm_layer_aggr(local_feat_it_cross_attn[:,1:,:]), 
+                                                  value=self.norm_layer_aggr(local_feat_it_cross_attn[:,1:,:]))[0]
+                output_coord = self.bbox_head(local_feat_aggr.squeeze(1)).sigmoid()
+                loss_bbox, loss_giou = self.get_bbox_loss(output_coord, fake_image_box)
             
             ##================= TMG ========================##    
-            token_label = text.attention_mask[:,1:].clone() # [:,1:] for ingoring class token
-            token_label[token_label==0] = -100 # -100 index = padding token
-            token_label[token_label==1] = 0
-
-            for batch_idx in range(len(fake_text_pos)):
-                fake_pos_sample = fake_text_pos[batch_idx]
-                if fake_pos_sample:
-                    for pos in fake_pos_sample:
-                        token_label[batch_idx, pos] = 1
-
-            input_ids = text.input_ids.clone()
-
-            if self.args.token_momentum:
-                with torch.no_grad():
-                    logits_m = self.text_encoder_m(input_ids, 
+            with region('forward/tmg'):
+                token_label = text.attention_mask[:,1:].clone() # [:,1:] for ingoring class token
+                token_label[token_label==0] = -100 # -100 index = padding token
+                token_label[token_label==1] = 0
+
+                for batch_idx in range(len(fake_text_pos)):
+                    fake_pos_sample = fake_text_pos[batch_idx]
+                    if fake_pos_sample:
+                        for pos in fake_pos_sample:
+                            token_label[batch_idx, pos] = 1
+
+                input_ids = text.input_ids.clone()
+
+                if self.args.token_momentum:
+                    with torch.no_grad():
+                        logits_m = self.text_encoder_m(input_ids, 
+                                                    attention_mask = text.attention_mask,
+                                                    encoder_hidden_states = image_embeds_m,
+                                                    encoder_attention_mask = image_atts,      
+                                                    return_dict = True,
+                                                    return_logits = True,   
+                                                    )    
+                    token_cls_output = self.text_encoder(input_ids, 
                                                 attention_mask = text.attention_mask,
-                                                encoder_hidden_states = image_embeds_m,
+                                                encoder_hidden_states = image_embeds,
                                                 encoder_attention_mask = image_atts,      
                                                 return_dict = True,
-                                                return_logits = True,   
+                                                labels = token_label,   
+                                                soft_labels = F.softmax(logits_m.view(-1, 2),dim=-1),
+                                                alpha = alpha
                                                 )    
-                token_cls_output = self.text_encoder(input_ids, 
-                                            attention_mask = text.attention_mask,
-                                            encoder_hidden_states = image_embeds,
-                                            encoder_attention_mask = image_atts,      
-                                            return_dict = True,
-                                            labels = token_label,   
-                                            soft_labels = F.softmax(logits_m.view(-1, 2),dim=-1),
-                                            alpha = alpha
-                                            )    
-            else:
-                token_cls_output  = self.text_encoder(input_ids, 
-                                            attention_mask = text.attention_mask,
-                                            encoder_hidden_states = image_embeds,
-                                            encoder_attention_mask = image_atts,      
-                                            return_dict = True,
-                                            labels = token_label,   
-                                            )  
-
-            loss_TMG = token_cls_output.loss
+                else:
+                    token_cls_output  = self.text_encoder(input_ids, 
+                                                attention_mask = text.attention_mask,
+                                                encoder_hidden_states = image_embeds,
+                                                encoder_attention_mask = image_atts,      
+                                                return_dict = True,
+                                                labels = token_label,   
+                                                )  
+
+                loss_TMG = token_cls_output.loss
+
+            with region('forward/queue'):
+                self._dequeue_and_enqueue()
 
             return loss_MAC, loss_BIC, loss_bbox, loss_giou, loss_TMG, loss_MLC, loss_REC
 
         else:
-            image_embeds = self.visual_encoder(image) 
-            image_atts = torch.ones(image_embeds.size()[:-1],dtype=torch.long).to(image.device)
+            return self.inference(image, text.input_ids, text.attention_mask)
 
-            text_output = self.text_encoder.bert(text.input_ids, attention_mask = text.attention_mask,                      
-                                            return_dict = True, mode = 'text')            
-            text_embeds = text_output.last_hidden_state
 
-            # forward the positve image-text pair
-            output_pos = self.text_encoder.bert(encoder_embeds = text_embeds, 
-                                            attention_mask = text.attention_mask,
-                                            encoder_hidden_states = image_embeds,
-                                            encoder_attention_mask = image_atts,      
-                                            return_dict = True,
-                                            mode = 'fusion',
-                                        )               
-            ##================= IMG ========================## 
-            bs = image.size(0)
-            cls_tokens_local = self.cls_token_local.expand(bs, -1, -1)
-
-            text_attention_mask_clone = text.attention_mask.clone() # [:,1:] for ingoring class token
-            local_feat_padding_mask_text = text_attention_mask_clone==0 # 0 = pad token
+    def inference(self, image, input_ids, attention_mask):
+        """
+        Pure tensor inference graph, traceable to TorchScript / ONNX.
+        Args:
+            image (Tensor): Bx3xHxW
+            input_ids, attention_mask (LongTensor): BxL
+        Returns:
+            logits_real_fake (Bx2), logits_multicls (Bx4), output_coord (Bx4, cxcywh), logits_tok (BxLx2)
+        """
+        image_embeds = self.visual_encoder(image) 
+        image_atts = torch.ones(image_embeds.size()[:-1],dtype=torch.long,device=image.device)
 
-            local_feat_it_cross_attn = image_embeds + self.it_cross_attn(query=self.norm_layer_it_cross_atten(image_embeds), 
-                                              key=self.norm_layer_it_cross_atten(text_embeds), 
-                                              value=self.norm_layer_it_cross_atten(text_embeds),
-                                              key_padding_mask=local_feat_padding_mask_text)[0]
+        text_output = self.text_encoder.bert(input_ids, attention_mask = attention_mask,                      
+                                        return_dict = True, mode = 'text')            
+        text_embeds = text_output.last_hidden_state
 
-            local_feat_aggr = self.aggregator(query=self.norm_layer_aggr(cls_tokens_local), 
-                                              key=self.norm_layer_aggr(local_feat_it_cross_attn[:,1:,:]), 
-                                              value=self.norm_layer_aggr(local_feat_it_cross_attn[:,1:,:]))[0]
-            output_coord = self.bbox_head(local_feat_aggr.squeeze(1)).sigmoid()
-            ##================= BIC ========================## 
-            logits_real_fake = self.itm_head(output_pos.last_hidden_state[:,0,:])
-            ##================= MLC ========================## 
-            logits_multicls = self.cls_head(output_pos.last_hidden_state[:,0,:])
-            ##================= TMG ========================##   
-            input_ids = text.input_ids.clone()
-            logits_tok = self.text_encoder(input_ids, 
-                                        attention_mask = text.attention_mask,
+        # forward the positve image-text pair
+        output_pos = self.text_encoder.bert(encoder_embeds = text_embeds, 
+                                        attention_mask = attention_mask,
                                         encoder_hidden_states = image_embeds,
                                         encoder_attention_mask = image_atts,      
                                         return_dict = True,
-                                        return_logits = True,   
-                                        )     
-            return logits_real_fake, logits_multicls, output_coord, logits_tok   
+                                        mode = 'fusion',
+                                    )               
+        ##================= IMG ========================## 
+        bs = image.size(0)
+        cls_tokens_local = self.cls_token_local.expand(bs, -1, -1)
+
+        local_feat_padding_mask_text = attention_mask==0 # 0 = pad token
+
+        local_feat_it_cross_attn = image_embeds + self.it_cross_attn(query=self.norm_layer_it_cross_atten(image_embeds), 
+                                          key=self.norm_layer_it_cross_atten(text_embeds), 
+                                          value=self.norm_layer_it_cross_atten(text_embeds),
+                                          key_padding_mask=local_feat_padding_mask_text)[0]
+
+        local_feat_aggr = self.aggregator(query=self.norm_layer_aggr(cls_tokens_local), 
+                                          key=self.norm_layer_aggr(local_feat_it_cross_attn[:,1:,:]), 
+                                          value=self.norm_layer_aggr(local_feat_it_cross_attn[:,1:,:]))[0]
+        output_coord = self.bbox_head(local_feat_aggr.squeeze(1)).sigmoid()
+        ##================= BIC ========================## 
+        logits_real_fake = self.itm_head(output_pos.last_hidden_state[:,0,:])
+        ##================= MLC ========================## 
+        logits_multicls = self.cls_head(output_pos.last_hidden_state[:,0,:])
+        ##================= TMG ========================##   
+        logits_tok = self.text_encoder(input_ids, 
+                                    attention_mask = attention_mask,
+                                    encoder_hidden_states = image_embeds,
+                                    encoder_attention_mask = image_atts,      
+                                    return_dict = True,
+                                    return_logits = True,   
+                                    )     
+        return logits_real_fake, logits_multicls, output_coord, logits_tok
 
 
     def cos_sim(self, image, text, image_mask, text_mask, image_score, text_score, real_pos):
@@ -428,7 +511,7 @@ class HAMMER(nn.Module):
             l = int(l)
             # num_masked_vec = max(l // 3, 1) 
             num_masked_vec = max(int(l * mask_rate), 1) 
-            masked_vec.append(torch.zeros([feat.size(1)]).byte().cuda())
+            masked_vec.append(torch.zeros([feat.size(1)], dtype=torch.uint8, device=feat.device))
             if l < 1:
                 continue
             p = weights[i, :l].cpu().detach().numpy() if weights is not None else None
@@ -453,6 +536,10 @@ class HAMMER(nn.Module):
             
     @torch.no_grad()        
     def _momentum_update(self):
+        if self.momentum_params is not None:
+            for param, param_m in self.momentum_params:
+                param_m.data = param_m.data * self.momentum + param.data * (1. - self.momentum)
+            return
         for model_pair in self.model_pairs:           
             for param, param_m in zip(model_pair[0].parameters(), model_pair[1].parameters()):
                 param_m.data = param_m.data * self.momentum + param.data * (1. - self.momentum)
@@ -460,10 +547,12 @@ class HAMMER(nn.Module):
             
             
     @torch.no_grad()
-    def _dequeue_and_enqueue(self, image_feat, text_feat):
-        # gather keys before updating queue
-        image_feats = concat_all_gather(image_feat)
-        text_feats = concat_all_gather(text_feat)
+    def _dequeue_and_enqueue(self, image_feat=None, text_feat=None):
+        # gather keys before updating queue, without arguments the ones of the
+        # gather started by forward
+        if image_feat is not None:
+            self.feat_gather.start(image_feat, text_feat)
+        image_feats, text_feats = self.feat_gather.wait()
 
         batch_size = image_feats.shape[0]
 
@@ -476,18 +565,101 @@ class HAMMER(nn.Module):
         ptr = (ptr + batch_size) % self.queue_size  # move pointer
 
         self.queue_ptr[0] = ptr 
+
+
+# submodules used by HAMMER.inference, everything else (momentum encoders,
+# queues, projections, REC transformers) is only needed for training
+INFERENCE_MODULES = ['visual_encoder', 'text_encoder', 'it_cross_attn', 'norm_layer_it_cross_atten',
+                     'aggregator', 'norm_layer_aggr', 'itm_head', 'bbox_head', 'cls_head']
+
+
+class HAMMERInference(nn.Module):
+    """
+    Inference only HAMMER, (image, input_ids, attention_mask) ->
+    (logits_real_fake, logits_multicls, output_coord, logits_tok).
+    Shares the parameters of the given HAMMER model.
+    """
+    def __init__(self, model):
+        super().__init__()
+        for name in INFERENCE_MODULES:
+            setattr(self, name, getattr(model, name))
+        self.cls_token_local = model.cls_token_local
+
+    def forward(self, image, input_ids, attention_mask):
+        return HAMMER.inference(self, image, input_ids, attention_mask)
         
         
+def _gather_world_size(group=None):
+    if not torch.distributed.is_available() or not torch.distributed.is_initialized():
+        return 1
+    return torch.distributed.get_world_size(group)
+
+
+class FeatureGather(object):
+    """
+    Fused all_gather of [n, d_i] tensors of the same length n: their concatenation is
+    gathered by a single collective into a [world_size, n, sum(d_i)] buffer that is reused
+    as long as the shapes do not change. start() issues it asynchronously, wait() blocks
+    until it is done and returns the gathered [world_size * n, d_i] tensors, rank by rank.
+    The returned tensors are views of the buffer, valid until the next start().
+    Without an initialized process group, or with a single process, the tensors are
+    returned as they are.
+    *** Warning ***: torch.distributed.all_gather has no gradient.
+    """
+    def __init__(self, group=None):
+        self.group = group
+        self._send = None
+        self._recv = None
+        self._work = None
+        self._pending = None
+
+    def _buffers(self, tensors, world_size):
+        n, dim = tensors[0].size(0), sum(t.size(1) for t in tensors)
+        like = tensors[0]
+        if self._recv is None or self._recv.shape != (world_size, n, dim) \
+                or self._recv.dtype != like.dtype or self._recv.device != like.device:
+            self._send = like.new_empty(n, dim)
+            self._recv = like.new_empty(world_size, n, dim)
+        return self._send, self._recv
+
+    @torch.no_grad()
+    def start(self, *tensors):
+        if self._pending is not None:
+            # left over by a forward that did not get to the enqueue
+            self.wait()
+        world_size = _gather_world_size(self.group)
+        if world_size == 1:
+            self._pending = tensors
+            return self
+        send, recv = self._buffers(tensors, world_size)
+        torch.cat(tensors, dim=1, out=send)
+        if hasattr(torch.distributed, 'all_gather_into_tensor') \
+                and torch.distributed.get_backend(self.group) == 'nccl':
+            # one flat output, no copy from the collective's buffer into a list of tensors
+            self._work = torch.distributed.all_gather_into_tensor(recv, send, group=self.group, async_op=True)
+        else:
+            # gloo: the rows of the buffer are the output tensors
+            self._work = torch.distributed.all_gather(list(recv.unbind(0)), send, group=self.group, async_op=True)
+        self._pending = [t.size(1) for t in tensors]
+        return self
+
+    @torch.no_grad()
+    def wait(self):
+        pending, self._pending = self._pending, None
+        if pending is None:
+            raise RuntimeError('FeatureGather.wait() called without start()')
+        if self._work is None:
+            return tuple(pending)
+        self._work.wait()
+        self._work = None
+        return torch.split(self._recv.flatten(0, 1), pending, dim=1)
+
+
 @torch.no_grad()
 def concat_all_gather(tensor):
     """
     Performs all_gather operation on the provided tensors.
     *** Warning ***: torch.distributed.all_gather has no gradient.
     """
-    tensors_gather = [torch.ones_like(tensor)
-        for _ in range(torch.distributed.get_world_size())]
-    torch.distributed.all_gather(tensors_gather, tensor, async_op=False)
-
-    output = torch.cat(tensors_gather, dim=0)
-    return output
+    return FeatureGather().start(tensor).wait()[0]
 
@@ -3,7 +3,6 @@
 Utilities for bounding box manipulation and GIoU.
 """
 import torch
-from torchvision.ops.boxes import box_area
 import math
 
 def box_cxcywh_to_xyxy(x):  # 这个用了
@@ -20,33 +19,38 @@ def box_xyxy_to_cxcywh(x):
     return torch.stack(b, dim=-1)
 
 
+def box_area(boxes):
+    # same as torchvision.ops.boxes.box_area but works on any leading dims, [..., 4] -> [...]
+    return (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+
+
 # modified from torchvision to also return the union
 def box_iou(boxes1, boxes2, test=False):
+    """
+    Element-wise IoU between paired boxes in [x0, y0, x1, y1] format.
 
+    boxes1 and boxes2 are [..., 4] tensors with the same shape, the result
+    is [...]. With test=True, a ground-truth all-zero box (no fake region)
+    that is predicted as an all-zero box (all coords < 1e-4) counts as IoU 1.
+    """
     area1 = box_area(boxes1)
     area2 = box_area(boxes2)
 
-    # lt = torch.max(boxes1[:, None, :2], boxes2[:, :2])  # [N,M,2]
-    # rb = torch.min(boxes1[:, None, 2:], boxes2[:, 2:])  # [N,M,2]
-    lt = torch.max(boxes1[:, :2], boxes2[:, :2])  # [N,2]
-    rb = torch.min(boxes1[:, 2:], boxes2[:, 2:])  # [N,2]
+    lt = torch.max(boxes1[..., :2], boxes2[..., :2])  # [...,2]
+    rb = torch.min(boxes1[..., 2:], boxes2[..., 2:])  # [...,2]
 
-    wh = (rb - lt).clamp(min=0)  # [N,2]
-    # inter = wh[:, :, 0] * wh[:, :, 1]  # [N,M]
-    inter = wh[:, 0] * wh[:, 1]  # [N]
+    wh = (rb - lt).clamp(min=0)  # [...,2]
+    inter = wh[..., 0] * wh[..., 1]  # [...]
 
-    # union = area1[:, None] + area2 - inter
     union = area1 + area2 - inter
 
     iou = inter / union
 
     if test:
-        zero_lines = boxes2==torch.zeros_like(boxes2)
-        zero_lines_idx = torch.where(zero_lines[:,0]==True)[0]
-
-        for idx in zero_lines_idx:
-            if all(boxes1[idx,:] < 1e-4):
-                iou[idx]=1
+        # no python loop / host sync: empty gt boxes correctly predicted as empty get iou 1
+        gt_empty = (boxes2 == 0).all(dim=-1)
+        pred_empty = (boxes1 < 1e-4).all(dim=-1)
+        iou = torch.where(gt_empty & pred_empty, torch.ones_like(iou), iou)
 
     return iou, union
 
@@ -57,18 +61,27 @@ def generalized_box_iou(boxes1, boxes2):
 
     The boxes should be in [x0, y0, x1, y1] format
 
-    Returns a [N, M] pairwise matrix, where N = len(boxes1)
-    and M = len(boxes2)
+    Returns the element-wise GIoU of paired boxes, boxes1 and boxes2 are
+    [..., 4] tensors with the same shape (e.g. [N, 4] or [B, N, 4]) and the
+    result is [...].
     """
     iou, union = box_iou(boxes1, boxes2)
 
-    # lt = torch.min(boxes1[:, None, :2], boxes2[:, :2])
-    # rb = torch.max(boxes1[:, None, 2:], boxes2[:, 2:])
-    lt = torch.min(boxes1[:, :2], boxes2[:, :2])
-    rb = torch.max(boxes1[:, 2:], boxes2[:, 2:])
+    lt = torch.min(boxes1[..., :2], boxes2[..., :2])
+    rb = torch.max(boxes1[..., 2:], boxes2[..., 2:])
 
-    wh = (rb - lt).clamp(min=0)  # [N,M,2]
-    # area = wh[:, :, 0] * wh[:, :, 1]
-    area = wh[:, 0] * wh[:, 1]
+    wh = (rb - lt).clamp(min=0)  # [...,2]
+    area = wh[..., 0] * wh[..., 1]
 
     return iou - (area - union) / area
+
+
+def iou_accuracy(iou, thresholds=(0.5, 0.75, 0.95)):
+    """
+    Number of boxes whose IoU is above each threshold.
+
+    Returns a [len(thresholds)] long tensor on the device of iou, so the
+    counts can be accumulated across batches without a host sync.
+    """
+    thresholds = torch.as_tensor(thresholds, dtype=iou.dtype, device=iou.device)
+    return (iou.reshape(-1, 1) > thresholds).sum(dim=0)
@@ -0,0 +1,97 @@
+"""
+HAMMER construction.
+
+For training the model is built with the DeiT / BERT pretrained weights. When a
+HAMMER checkpoint is given, every weight is overwritten anyway, so the modules
+are built on the meta device (no memory, no init) and materialized directly
+from the checkpoint tensors, without network calls or pretrained loads.
+"""
+import contextlib
+import time
+
+import torch
+
+from models.HAMMER import HAMMER
+from models.vit import interpolate_pos_embed
+from tools.checkpoint import load_model_state_dict, is_momentum_key
+
+POS_EMBED_KEYS = [('visual_encoder.pos_embed', 'visual_encoder'),
+                  ('visual_encoder_m.pos_embed', 'visual_encoder_m')]
+
+
+def meta_device_supported():
+    # torch.device as a context manager and load_state_dict(assign=True), torch >= 2.1
+    return hasattr(torch.device, '__enter__') and 'assign' in torch.nn.Module.load_state_dict.__code__.co_varnames
+
+
+def load_checkpoint_state_dict(checkpoint, skip_momentum=False):
+    """model state dict of a checkpoint path (directory or .pth) or an already loaded checkpoint"""
+    if isinstance(checkpoint, str):
+        return load_model_state_dict(checkpoint, skip_momentum=skip_momentum)
+    state_dict = checkpoint['model'] if 'model' in checkpoint else checkpoint
+    return {k: v for k, v in state_dict.items() if not (skip_momentum and is_momentum_key(k))}
+
+
+def adapt_pos_embed(state_dict, model):
+    """interpolate the ViT position embeddings of the checkpoint to the model image_res"""
+    for key, name in POS_EMBED_KEYS:
+        if key in state_dict:
+            state_dict[key] = interpolate_pos_embed(state_dict[key], getattr(model, name))
+    return state_dict
+
+
+def share_momentum_weights(model):
+    """
+    Inference without momentum weights in the checkpoint: the momentum encoders
+    share the tensors of their online encoder and the queues are zeroed.
+    Only valid for evaluation, training needs the full checkpoint.
+    """
+    for model_pair in model.model_pairs:
+        model_pair[1].load_state_dict(model_pair[0].state_dict(), assign=True)
+    for name, buf in list(model.named_buffers(recurse=False)):
+        if buf.is_meta:
+            setattr(model, name, torch.zeros_like(buf, device='cpu'))
+
+
+def build_hammer(args, config, text_encoder, tokenizer, checkpoint=None, init_deit=True, use_meta=True,
+                 skip_momentum=False, log=True):
+    """
+    Args:
+        checkpoint: None to build the model for training, else a HAMMER checkpoint
+            (path, checkpoint dict or model state dict) to load the weights from.
+        init_deit: load the DeiT weights, only used without checkpoint.
+        use_meta: build on the meta device when loading a checkpoint (torch >= 2.1),
+            otherwise the modules are built on CPU with all the init skipped.
+        skip_momentum: do not read the momentum encoders and queues of the checkpoint,
+            for evaluation / serving only.
+    """
+    if checkpoint is None:
+        return HAMMER(args=args, config=config, text_encoder=text_encoder, tokenizer=tokenizer, init_deit=init_deit)
+
+    start_time = time.time()
+    use_meta = use_meta and meta_device_supported()
+    with torch.device('meta') if use_meta else contextlib.nullcontext():
+        model = HAMMER(args=args, config=config, text_encoder=text_encoder, tokenizer=tokenizer,
+                       init_deit=False, init_bert=False, init_weights=False)
+    build_time = time.time() - start_time
+
+    if log and isinstance(checkpoint, str):
+        print('load checkpoint from %s' % checkpoint)
+    state_dict = adapt_pos_embed(load_checkpoint_state_dict(checkpoint, skip_momentum), model)
+    if use_meta:
+        msg = model.load_state_dict(state_dict, strict=False, assign=True)
+    else:
+        msg = model.load_state_dict(state_dict, strict=False)
+    missing_keys = [k for k in msg.missing_keys if not (skip_momentum and is_momentum_key(k))]
+    if missing_keys:
+        # the weights of these keys would be left uninitialized
+        raise KeyError('checkpoint is missing keys: %s' % ', '.join(missing_keys))
+    if skip_momentum:
+        if use_meta:
+            share_momentum_weights(model)
+        else:
+            model.copy_params()
+    if log:
+        print(msg)
+        print('model built in %.2fs, loaded in %.2fs' % (build_time, time.time() - start_time - build_time))
+    return model
@@ -0,0 +1,74 @@
+"""
+CPU inference helpers: thread pinning and dynamic int8 quantization of HAMMER.
+"""
+import os
+import platform
+
+import torch
+from torch import nn
+
+try:
+    from torch.ao.quantization import quantize_dynamic
+except ImportError:
+    from torch.quantization import quantize_dynamic
+
+
+# submodules whose nn.Linear layers are quantized, the ViT, the BERT encoder
+# (text + fusion layers) and the MLP heads built by build_mlp
+QUANTIZED_MODULES = ['visual_encoder', 'text_encoder.bert', 'text_encoder.classifier',
+                     'itm_head', 'bbox_head', 'cls_head']
+
+
+def set_cpu_threads(num_threads=None, num_interop_threads=1):
+    """
+    Pin the intra-op (OpenMP / MKL) and inter-op thread pools. torch.set_num_threads
+    sizes the already initialized OpenMP pool, OMP_NUM_THREADS would come too late here.
+    num_threads defaults to the number of cores available to this process,
+    HAMMER inference runs one graph at a time so a single inter-op thread is enough.
+    """
+    if num_threads is None:
+        num_threads = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(num_interop_threads)
+    except RuntimeError:
+        # can only be set once, before any inter-op parallel work started
+        pass
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def select_quantized_engine():
+    """fbgemm on x86, qnnpack on ARM"""
+    engines = torch.backends.quantized.supported_engines
+    machine = platform.machine().lower()
+    preferred = ['qnnpack', 'fbgemm'] if machine.startswith(('arm', 'aarch')) else ['x86', 'fbgemm', 'qnnpack']
+    for engine in preferred:
+        if engine in engines:
+            torch.backends.quantized.engine = engine
+            return engine
+    return torch.backends.quantized.engine
+
+
+def quantize_hammer_dynamic(model, modules=QUANTIZED_MODULES, dtype=torch.qint8):
+    """
+    Apply dynamic int8 quantization in place to the nn.Linear layers of the given
+    HAMMER submodules. Weights are quantized once, activations per batch at run
+    time, so no calibration data is needed. The model must stay on CPU.
+    """
+    select_quantized_engine()
+    model.eval()
+    for name in modules:
+        module = model.get_submodule(name)
+        quantize_dynamic(module, {nn.Linear}, dtype=dtype, inplace=True)
+    return model
+
+
+def model_size_mb(model):
+    """size of the serialized state dict in MB"""
+    size = 0
+    for v in model.state_dict().values():
+        if isinstance(v, torch.Tensor):
+            size += v.numel() * v.element_size()
+        elif isinstance(v, tuple): # packed params of quantized linear: (weight, bias)
+            size += sum(t.numel() * t.element_size() for t in v if isinstance(t, torch.Tensor))
+    return size / 1024. / 1024.
@@ -41,3 +41,16 @@ class DualTransformer(nn.Module):
         if need_weight:
             return enc_out, out, weight
         return enc_out, out
+
+    def unused_parameters(self, decoding):
+        """
+        Names of the parameters that get no gradient when forward always runs with
+        this decoding and enc_out=None: the decoder run without a source skips its
+        encoder attention, and decoding 3 only runs decoder1, without self attention.
+        """
+        if decoding == 3:
+            unused = [('decoder2', ''), ('decoder1', 'self_attn')]
+        else:
+            unused = [('decoder1' if decoding == 2 else 'decoder2', 'encoder_attn')]
+        return [name for name, _ in self.named_parameters()
+                if any(name.startswith(decoder + '.') and '.%s' % sub in name for decoder, sub in unused)]
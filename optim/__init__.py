@@ -10,4 +10,6 @@ from .radam import RAdam
 from .rmsprop_tf import RMSpropTF
 from .sgdp import SGDP
 
-from .optim_factory import create_optimizer
\ No newline at end of file
+from .optim_factory import create_optimizer
+from .param_groups import build_param_groups
+from .zero import ShardedOptimizer, gather_optimizer_state, load_optimizer_state
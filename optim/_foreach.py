@@ -0,0 +1,106 @@
+""" Multi-tensor (foreach) helpers shared by the optimizers of this package
+
+The foreach step of an optimizer buckets the parameters of a param group by
+(device, dtype) and updates each bucket with torch._foreach_* ops, one kernel
+launch per op for the whole bucket instead of one per parameter. The per
+parameter loops are kept as the reference implementation (foreach=False).
+"""
+import math
+from collections import defaultdict
+
+import torch
+
+
+def has_foreach():
+    return hasattr(torch, '_foreach_addcdiv_')
+
+
+def use_foreach(foreach):
+    """foreach=None picks the foreach step whenever torch provides it"""
+    if foreach is None:
+        return has_foreach()
+    return foreach and has_foreach()
+
+
+def grouped_params(group, name='This optimizer'):
+    """params of the group that have a gradient, as lists bucketed by device and dtype"""
+    buckets = defaultdict(list)
+    for p in group['params']:
+        if p.grad is None:
+            continue
+        if p.grad.is_sparse:
+            raise RuntimeError('%s does not support sparse gradients' % name)
+        buckets[(p.device, p.dtype, p.grad.dtype)].append(p)
+    return list(buckets.values())
+
+
+def foreach_norm(tensors):
+    """list of 0-dim L2 norms"""
+    if hasattr(torch, '_foreach_norm'):
+        return list(torch._foreach_norm(tensors))
+    return [t.norm() for t in tensors]
+
+
+def foreach_maximum_(tensors, others):
+    if hasattr(torch, '_foreach_maximum_'):
+        torch._foreach_maximum_(tensors, others)
+    else:
+        for t, o in zip(tensors, others):
+            torch.max(t, o, out=t)
+
+
+def _channel_view(x):
+    return x.view(x.size(0), -1)
+
+
+def _layer_view(x):
+    return x.view(1, -1)
+
+
+def _cosine_similarity(x, y, eps, view_func):
+    x = view_func(x)
+    y = view_func(y)
+    return (x * y).sum(dim=1).abs() / x.norm(dim=1).add_(eps) / y.norm(dim=1).add_(eps)
+
+
+def projection_multi(params, grads, perturbs, delta, wd_ratio, eps):
+    """
+    AdamP / SGDP projection of a bucket, perturbs are updated in place.
+    Same as AdamP._projection per parameter, but the channel / layer tests of
+    all parameters are resolved with one host sync instead of one per test.
+    Returns the weight decay ratio of every parameter.
+    """
+    wd_ratios = [1.] * len(params)
+    index = [i for i, p in enumerate(params) if p.dim() > 1]
+    if not index:
+        return wd_ratios
+
+    view_funcs = [_channel_view, _layer_view]
+    sims = torch.stack([_cosine_similarity(grads[i], params[i], eps, view_func).max()
+                        for i in index for view_func in view_funcs]).tolist()
+    for k, i in enumerate(index):
+        p, perturb = params[i], perturbs[i]
+        expand_size = [-1] + [1] * (p.dim() - 1)
+        for j, view_func in enumerate(view_funcs):
+            if sims[2 * k + j] < delta / math.sqrt(view_func(p).size(1)):
+                p_n = p / view_func(p).norm(dim=1).view(expand_size).add_(eps)
+                perturb -= p_n * view_func(p_n * perturb).sum(dim=1).view(expand_size)
+                wd_ratios[i] = wd_ratio
+                break
+    return wd_ratios
+
+
+def foreach_copy_(tensors, sources):
+    if hasattr(torch, '_foreach_copy_'):
+        torch._foreach_copy_(tensors, sources)
+    else:
+        for t, s in zip(tensors, sources):
+            t.copy_(s)
+
+
+def foreach_lerp_(tensors, ends, weight):
+    """tensors += weight * (ends - tensors)"""
+    if hasattr(torch, '_foreach_lerp_'):
+        torch._foreach_lerp_(tensors, ends, weight)
+    else:
+        torch._foreach_add_(tensors, torch._foreach_sub(ends, tensors), alpha=weight)
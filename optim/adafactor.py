@@ -12,6 +12,8 @@ Original header/copyright below.
 import torch
 import math
 
+from ._foreach import use_foreach, grouped_params, foreach_norm
+
 
 class Adafactor(torch.optim.Optimizer):
     """Implements Adafactor algorithm.
@@ -38,10 +40,12 @@ class Adafactor(torch.optim.Optimizer):
             instead of external learning rate (default: True)
         warmup_init (bool): time-dependent learning rate computation depends on
             whether warm-up initialization is being used (default: False)
+        foreach (bool, optional): multi-tensor step, None uses it when torch supports it (default: None)
     """
 
     def __init__(self, params, lr=None, eps=1e-30, eps_scale=1e-3, clip_threshold=1.0,
-                 decay_rate=-0.8, betas=None, weight_decay=0.0, scale_parameter=True, warmup_init=False):
+                 decay_rate=-0.8, betas=None, weight_decay=0.0, scale_parameter=True, warmup_init=False,
+                 foreach=None):
         relative_step = lr is None
         if warmup_init and not relative_step:
             raise ValueError('warmup_init requires relative_step=True')
@@ -49,7 +53,7 @@ class Adafactor(torch.optim.Optimizer):
         beta1 = None if betas is None else betas[0]   # make it compat with standard betas arg
         defaults = dict(lr=lr, eps=eps, eps_scale=eps_scale, clip_threshold=clip_threshold, decay_rate=decay_rate,
                         beta1=beta1, weight_decay=weight_decay, scale_parameter=scale_parameter,
-                        relative_step=relative_step, warmup_init=warmup_init)
+                        relative_step=relative_step, warmup_init=warmup_init, foreach=foreach)
         super(Adafactor, self).__init__(params, defaults)
 
     @staticmethod
@@ -88,6 +92,10 @@ class Adafactor(torch.optim.Optimizer):
             loss = closure()
 
         for group in self.param_groups:
+            if use_foreach(group.get('foreach')):
+                self._step_foreach(group)
+                continue
+
             for p in group['params']:
                 if p.grad is None:
                     continue
@@ -171,4 +179,85 @@ class Adafactor(torch.optim.Optimizer):
                 if p.data.dtype in {torch.float16, torch.bfloat16}:
                     p.data.copy_(p_data_fp32)
 
-        return loss
\ No newline at end of file
+        return loss
+
+    def _step_foreach(self, group):
+        for params in grouped_params(group, 'Adafactor'):
+            half = params[0].dtype in {torch.float16, torch.bfloat16}
+            grads = [p.grad.data for p in params]
+            if grads[0].dtype in {torch.float16, torch.bfloat16}:
+                grads = [grad.float() for grad in grads]
+            params_fp32 = [p.data.float() for p in params] if half else [p.data for p in params]
+            states = [self.state[p] for p in params]
+
+            factored = []
+            for grad, state in zip(grads, states):
+                is_factored, use_first_moment = self._get_options(group, grad.shape)
+                factored.append(is_factored)
+                if len(state) == 0:
+                    state['step'] = 0
+                    if use_first_moment:
+                        state['exp_avg'] = torch.zeros_like(grad)
+                    if is_factored:
+                        state['exp_avg_sq_row'] = torch.zeros(grad.shape[:-1]).to(grad)
+                        state['exp_avg_sq_col'] = torch.zeros(grad.shape[:-2] + grad.shape[-1:]).to(grad)
+                    else:
+                        state['exp_avg_sq'] = torch.zeros_like(grad)
+                    state['RMS'] = 0
+                else:
+                    for k in ['exp_avg', 'exp_avg_sq_row', 'exp_avg_sq_col', 'exp_avg_sq']:
+                        if k in state:
+                            state[k] = state[k].to(grad)
+
+            # RMS of every parameter with one host sync
+            norms = torch.stack(foreach_norm(params_fp32)).tolist()
+            lrs, beta2ts = [], []
+            for p_data_fp32, state, norm in zip(params_fp32, states, norms):
+                state['step'] += 1
+                state['RMS'] = norm / (p_data_fp32.numel() ** 0.5)
+                lrs.append(self._get_lr(group, state))
+                beta2ts.append(1.0 - math.pow(state['step'], group['decay_rate']))
+
+            updates = list(torch._foreach_mul(grads, grads))
+            torch._foreach_add_(updates, group['eps'])
+
+            # factored second moments reduce over rows / columns of differently shaped tensors
+            for i in [i for i, f in enumerate(factored) if f]:
+                exp_avg_sq_row = states[i]['exp_avg_sq_row']
+                exp_avg_sq_col = states[i]['exp_avg_sq_col']
+                exp_avg_sq_row.mul_(beta2ts[i]).add_(updates[i].mean(dim=-1), alpha=1.0 - beta2ts[i])
+                exp_avg_sq_col.mul_(beta2ts[i]).add_(updates[i].mean(dim=-2), alpha=1.0 - beta2ts[i])
+                updates[i] = self._approx_sq_grad(exp_avg_sq_row, exp_avg_sq_col).mul_(grads[i])
+
+            unfactored = [i for i, f in enumerate(factored) if not f]
+            if unfactored:
+                exp_avg_sqs = [states[i]['exp_avg_sq'] for i in unfactored]
+                torch._foreach_mul_(exp_avg_sqs, [beta2ts[i] for i in unfactored])
+                torch._foreach_add_(exp_avg_sqs, torch._foreach_mul([updates[i] for i in unfactored],
+                                                                    [1.0 - beta2ts[i] for i in unfactored]))
+                rsqrts = torch._foreach_sqrt(exp_avg_sqs)
+                torch._foreach_reciprocal_(rsqrts)
+                torch._foreach_mul_(rsqrts, [grads[i] for i in unfactored])
+                for i, update in zip(unfactored, rsqrts):
+                    updates[i] = update
+
+            # clip by the RMS of the update and scale by lr, one host sync
+            numels = torch.tensor([u.numel() ** 0.5 for u in updates], device=updates[0].device)
+            clip = (torch.stack(foreach_norm(updates)) / numels / group['clip_threshold']).clamp_(min=1.0)
+            scales = (torch.tensor(lrs, device=clip.device) / clip).tolist()
+            torch._foreach_mul_(updates, scales)
+
+            if group['beta1'] is not None:
+                exp_avgs = [state['exp_avg'] for state in states]
+                torch._foreach_mul_(exp_avgs, group['beta1'])
+                torch._foreach_add_(exp_avgs, updates, alpha=1 - group['beta1'])
+                updates = exp_avgs
+
+            if group['weight_decay'] != 0:
+                torch._foreach_mul_(params_fp32, [1 - group['weight_decay'] * lr_t for lr_t in lrs])
+
+            torch._foreach_sub_(params_fp32, updates)
+
+            if half:
+                for p, p_data_fp32 in zip(params, params_fp32):
+                    p.data.copy_(p_data_fp32)
@@ -3,6 +3,8 @@
 Lifted from https://github.com/davda54/ada-hessian/blob/master/ada_hessian.py
 Originally licensed MIT, Copyright 2020, David Samuel
 """
+import inspect
+
 import torch
 
 
@@ -21,10 +23,17 @@ class Adahessian(torch.optim.Optimizer):
         update_each (int, optional): compute the hessian trace approximation only after *this* number of steps
             (to save time) (default: 1)
         n_samples (int, optional): how many times to sample `z` for the approximation of the hessian trace (default: 1)
+        hessian_params (iterable, optional): the only parameters whose hessian trace is estimated, e.g. the heads
+            of HAMMER. The others use the squared gradient in its place, i.e. they are updated like AdamW.
+            None estimates it for all parameters (default: None)
+        batched_hvp (bool, optional): compute the `n_samples` hessian-vector products in one batched double
+            backward (torch >= 1.11), at the cost of `n_samples` times the parameter memory for `z`. None uses
+            it whenever torch supports it (default: None)
     """
 
     def __init__(self, params, lr=0.1, betas=(0.9, 0.999), eps=1e-8, weight_decay=0.0,
-                 hessian_power=1.0, update_each=1, n_samples=1, avg_conv_kernel=False):
+                 hessian_power=1.0, update_each=1, n_samples=1, avg_conv_kernel=False,
+                 hessian_params=None, batched_hvp=None):
         if not 0.0 <= lr:
             raise ValueError(f"Invalid learning rate: {lr}")
         if not 0.0 <= eps:
@@ -39,6 +48,9 @@ class Adahessian(torch.optim.Optimizer):
         self.n_samples = n_samples
         self.update_each = update_each
         self.avg_conv_kernel = avg_conv_kernel
+        if batched_hvp is None:
+            batched_hvp = 'is_grads_batched' in inspect.signature(torch.autograd.grad).parameters
+        self.batched_hvp = batched_hvp
 
         # use a separate generator that deterministically generates the same `z`s across all GPUs in case of distributed training
         self.seed = 2147483647
@@ -47,8 +59,8 @@ class Adahessian(torch.optim.Optimizer):
         defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay, hessian_power=hessian_power)
         super(Adahessian, self).__init__(params, defaults)
 
+        self.hessian_params = None if hessian_params is None else set(hessian_params)
         for p in self.get_params():
-            p.hess = 0.0
             self.state[p]["hessian step"] = 0
 
     @property
@@ -62,26 +74,34 @@ class Adahessian(torch.optim.Optimizer):
 
         return (p for group in self.param_groups for p in group['params'] if p.requires_grad)
 
+    def has_hessian(self, p):
+        return self.hessian_params is None or p in self.hessian_params
+
     def zero_hessian(self):
         """
-        Zeros out the accumalated hessian traces.
+        Drops the cached hessian traces that are recomputed in this step.
         """
 
         for p in self.get_params():
-            if not isinstance(p.hess, float) and self.state[p]["hessian step"] % self.update_each == 0:
-                p.hess.zero_()
+            if self.state[p].setdefault("hessian step", 0) % self.update_each == 0:
+                self.state[p].pop('hessian', None)
 
     @torch.no_grad()
     def set_hessian(self):
         """
-        Computes the Hutchinson approximation of the hessian trace and accumulates it for each trainable parameter.
+        Computes the Hutchinson approximation of the hessian trace of the trainable parameters. The trace is cached
+        in state['hessian'] and reused until the next `update_each` step.
         """
 
         params = []
         for p in filter(lambda p: p.grad is not None, self.get_params()):
-            if self.state[p]["hessian step"] % self.update_each == 0:  # compute the trace only each `update_each` step
+            state = self.state[p]
+            if not self.has_hessian(p):
+                state['hessian'] = p.grad.abs()  # squared in the second moment, as in Adam
+            elif state["hessian step"] % self.update_each == 0 or 'hessian' not in state:
+                # compute the trace only each `update_each` step
                 params.append(p)
-            self.state[p]["hessian step"] += 1
+            state["hessian step"] += 1
 
         if len(params) == 0:
             return
@@ -91,13 +111,24 @@ class Adahessian(torch.optim.Optimizer):
 
         grads = [p.grad for p in params]
 
+        if self.batched_hvp:
+            # Rademacher distribution {-1.0, 1.0}, all samples stacked along a leading batch dimension
+            zs = [torch.randint(0, 2, (self.n_samples,) + p.size(), generator=self.generator, device=p.device) * 2.0 - 1.0
+                  for p in params]
+            h_zs = torch.autograd.grad(grads, params, grad_outputs=zs, only_inputs=True, is_grads_batched=True)
+            for h_z, z, p in zip(h_zs, zs, params):
+                self.state[p]['hessian'] = (h_z * z).mean(dim=0)  # approximate the expected values of z*(H@z)
+            return
+
+        for p in params:
+            self.state[p]['hessian'] = torch.zeros_like(p)
         for i in range(self.n_samples):
             # Rademacher distribution {-1.0, 1.0}
             zs = [torch.randint(0, 2, p.size(), generator=self.generator, device=p.device) * 2.0 - 1.0 for p in params]
             h_zs = torch.autograd.grad(
                 grads, params, grad_outputs=zs, only_inputs=True, retain_graph=i < self.n_samples - 1)
             for h_z, z, p in zip(h_zs, zs, params):
-                p.hess += h_z * z / self.n_samples  # approximate the expected values of z*(H@z)
+                self.state[p]['hessian'] += h_z * z / self.n_samples  # approximate the expected values of z*(H@z)
 
     @torch.no_grad()
     def step(self, closure=None):
@@ -116,11 +147,12 @@ class Adahessian(torch.optim.Optimizer):
 
         for group in self.param_groups:
             for p in group['params']:
-                if p.grad is None or p.hess is None:
+                if p.grad is None or 'hessian' not in self.state[p]:
                     continue
 
+                hess = self.state[p]['hessian']
                 if self.avg_conv_kernel and p.dim() == 4:
-                    p.hess = torch.abs(p.hess).mean(dim=[2, 3], keepdim=True).expand_as(p.hess).clone()
+                    hess = torch.abs(hess).mean(dim=[2, 3], keepdim=True).expand_as(hess)
 
                 # Perform correct stepweight decay as in AdamW
                 p.mul_(1 - group['lr'] * group['weight_decay'])
@@ -128,7 +160,7 @@ class Adahessian(torch.optim.Optimizer):
                 state = self.state[p]
 
                 # State initialization
-                if len(state) == 1:
+                if 'step' not in state:
                     state['step'] = 0
                     # Exponential moving average of gradient values
                     state['exp_avg'] = torch.zeros_like(p)
@@ -141,7 +173,7 @@ class Adahessian(torch.optim.Optimizer):
 
                 # Decay the first and second moment running average coefficient
                 exp_avg.mul_(beta1).add_(p.grad, alpha=1 - beta1)
-                exp_hessian_diag_sq.mul_(beta2).addcmul_(p.hess, p.hess, value=1 - beta2)
+                exp_hessian_diag_sq.mul_(beta2).addcmul_(hess, hess, value=1 - beta2)
 
                 bias_correction1 = 1 - beta1 ** state['step']
                 bias_correction2 = 1 - beta2 ** state['step']
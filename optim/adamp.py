@@ -13,11 +13,13 @@ import torch.nn as nn
 from torch.optim.optimizer import Optimizer, required
 import math
 
+from ._foreach import use_foreach, grouped_params, projection_multi
+
 class AdamP(Optimizer):
     def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8,
-                 weight_decay=0, delta=0.1, wd_ratio=0.1, nesterov=False):
+                 weight_decay=0, delta=0.1, wd_ratio=0.1, nesterov=False, foreach=None):
         defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay,
-                        delta=delta, wd_ratio=wd_ratio, nesterov=nesterov)
+                        delta=delta, wd_ratio=wd_ratio, nesterov=nesterov, foreach=foreach)
         super(AdamP, self).__init__(params, defaults)
 
     def _channel_view(self, x):
@@ -58,6 +60,10 @@ class AdamP(Optimizer):
             loss = closure()
 
         for group in self.param_groups:
+            if use_foreach(group.get('foreach')):
+                self._step_foreach(group)
+                continue
+
             for p in group['params']:
                 if p.grad is None:
                     continue
@@ -105,3 +111,47 @@ class AdamP(Optimizer):
                 p.data.add_(-step_size, perturb)
 
         return loss
+
+    def _step_foreach(self, group):
+        beta1, beta2 = group['betas']
+        for params in grouped_params(group, 'AdamP'):
+            states = [self.state[p] for p in params]
+            for p, state in zip(params, states):
+                if len(state) == 0:
+                    state['step'] = 0
+                    state['exp_avg'] = torch.zeros_like(p.data)
+                    state['exp_avg_sq'] = torch.zeros_like(p.data)
+                state['step'] += 1
+
+            params_data = [p.data for p in params]
+            grads = [p.grad.data for p in params]
+            exp_avgs = [state['exp_avg'] for state in states]
+            exp_avg_sqs = [state['exp_avg_sq'] for state in states]
+
+            # Adam
+            torch._foreach_mul_(exp_avgs, beta1)
+            torch._foreach_add_(exp_avgs, grads, alpha=1 - beta1)
+            torch._foreach_mul_(exp_avg_sqs, beta2)
+            torch._foreach_addcmul_(exp_avg_sqs, grads, grads, value=1 - beta2)
+
+            denoms = torch._foreach_sqrt(exp_avg_sqs)
+            torch._foreach_div_(denoms, [math.sqrt(1 - beta2 ** state['step']) for state in states])
+            torch._foreach_add_(denoms, group['eps'])
+
+            if group['nesterov']:
+                perturbs = torch._foreach_mul(exp_avgs, beta1)
+                torch._foreach_add_(perturbs, grads, alpha=1 - beta1)
+                torch._foreach_div_(perturbs, denoms)
+            else:
+                perturbs = torch._foreach_div(exp_avgs, denoms)
+
+            # Projection
+            wd_ratios = projection_multi(params_data, grads, perturbs, group['delta'], group['wd_ratio'], group['eps'])
+
+            # Weight decay
+            if group['weight_decay'] > 0:
+                torch._foreach_mul_(params_data, [1 - group['lr'] * group['weight_decay'] * r for r in wd_ratios])
+
+            # Step
+            torch._foreach_mul_(perturbs, [-group['lr'] / (1 - beta1 ** state['step']) for state in states])
+            torch._foreach_add_(params_data, perturbs)
@@ -5,6 +5,8 @@ import math
 import torch
 from torch.optim.optimizer import Optimizer
 
+from ._foreach import use_foreach, grouped_params, foreach_maximum_
+
 
 class AdamW(Optimizer):
     r"""Implements AdamW algorithm.
@@ -24,6 +26,8 @@ class AdamW(Optimizer):
         amsgrad (boolean, optional): whether to use the AMSGrad variant of this
             algorithm from the paper `On the Convergence of Adam and Beyond`_
             (default: False)
+        foreach (boolean, optional): multi-tensor step, None uses it when
+            torch supports it (default: None)
 
     .. _Adam\: A Method for Stochastic Optimization:
         https://arxiv.org/abs/1412.6980
@@ -34,7 +38,7 @@ class AdamW(Optimizer):
     """
 
     def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8,
-                 weight_decay=1e-2, amsgrad=False):
+                 weight_decay=1e-2, amsgrad=False, foreach=None):
         if not 0.0 <= lr:
             raise ValueError("Invalid learning rate: {}".format(lr))
         if not 0.0 <= eps:
@@ -44,7 +48,7 @@ class AdamW(Optimizer):
         if not 0.0 <= betas[1] < 1.0:
             raise ValueError("Invalid beta parameter at index 1: {}".format(betas[1]))
         defaults = dict(lr=lr, betas=betas, eps=eps,
-                        weight_decay=weight_decay, amsgrad=amsgrad)
+                        weight_decay=weight_decay, amsgrad=amsgrad, foreach=foreach)
         super(AdamW, self).__init__(params, defaults)
 
     def __setstate__(self, state):
@@ -64,6 +68,10 @@ class AdamW(Optimizer):
             loss = closure()
 
         for group in self.param_groups:
+            if use_foreach(group.get('foreach')):
+                self._step_foreach(group)
+                continue
+
             for p in group['params']:
                 if p.grad is None:
                     continue
@@ -115,3 +123,40 @@ class AdamW(Optimizer):
                 p.data.addcdiv_(-step_size, exp_avg, denom)
 
         return loss
+
+    def _step_foreach(self, group):
+        amsgrad = group['amsgrad']
+        beta1, beta2 = group['betas']
+        for params in grouped_params(group, 'Adam'):
+            states = [self.state[p] for p in params]
+            for p, state in zip(params, states):
+                if len(state) == 0:
+                    state['step'] = 0
+                    state['exp_avg'] = torch.zeros_like(p.data)
+                    state['exp_avg_sq'] = torch.zeros_like(p.data)
+                    if amsgrad:
+                        state['max_exp_avg_sq'] = torch.zeros_like(p.data)
+                state['step'] += 1
+
+            params_data = [p.data for p in params]
+            grads = [p.grad.data for p in params]
+            exp_avgs = [state['exp_avg'] for state in states]
+            exp_avg_sqs = [state['exp_avg_sq'] for state in states]
+
+            torch._foreach_mul_(params_data, 1 - group['lr'] * group['weight_decay'])
+
+            torch._foreach_mul_(exp_avgs, beta1)
+            torch._foreach_add_(exp_avgs, grads, alpha=1 - beta1)
+            torch._foreach_mul_(exp_avg_sqs, beta2)
+            torch._foreach_addcmul_(exp_avg_sqs, grads, grads, value=1 - beta2)
+            if amsgrad:
+                max_exp_avg_sqs = [state['max_exp_avg_sq'] for state in states]
+                foreach_maximum_(max_exp_avg_sqs, exp_avg_sqs)
+                denoms = torch._foreach_sqrt(max_exp_avg_sqs)
+            else:
+                denoms = torch._foreach_sqrt(exp_avg_sqs)
+            torch._foreach_div_(denoms, [math.sqrt(1 - beta2 ** state['step']) for state in states])
+            torch._foreach_add_(denoms, group['eps'])
+
+            step_sizes = [-group['lr'] / (1 - beta1 ** state['step']) for state in states]
+            torch._foreach_addcdiv_(params_data, exp_avgs, denoms, step_sizes)
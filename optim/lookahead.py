@@ -3,14 +3,21 @@ Implementation modified from: https://github.com/alphadl/lookahead.pytorch
 Paper: `Lookahead Optimizer: k steps forward, 1 step back` - https://arxiv.org/abs/1907.08610
 
 Hacked together by / Copyright 2020 Ross Wightman
+
+The slow weights of a param group live in one flat buffer per (device, dtype),
+state[p]['slow_buffer'] is a view into it, and every k steps they are synced
+with one foreach lerp / copy per buffer. With offload=True the flat buffers are
+kept in pinned CPU memory and only moved to the accelerator for the sync.
 """
 import torch
 from torch.optim.optimizer import Optimizer
 from collections import defaultdict
 
+from ._foreach import foreach_copy_, foreach_lerp_
+
 
 class Lookahead(Optimizer):
-    def __init__(self, base_optimizer, alpha=0.5, k=6):
+    def __init__(self, base_optimizer, alpha=0.5, k=6, offload=False):
         if not 0.0 <= alpha <= 1.0:
             raise ValueError(f'Invalid slow update rate: {alpha}')
         if not 1 <= k:
@@ -21,22 +28,54 @@ class Lookahead(Optimizer):
         self.defaults = base_optimizer.defaults
         self.defaults.update(defaults)
         self.state = defaultdict(dict)
+        self.offload = offload
+        # id(param group) -> [(params, flat slow buffer)], built on the first sync of the group
+        self._slow_buckets = {}
         # manually add our defaults to the param groups
         for name, default in defaults.items():
             for group in self.param_groups:
                 group.setdefault(name, default)
 
+    def _build_slow_buckets(self, group):
+        buckets = defaultdict(list)
+        for p in group['params']:
+            buckets[(p.device, p.dtype)].append(p)
+
+        slow_buckets = []
+        for (device, dtype), params in buckets.items():
+            offload = self.offload and device.type != 'cpu'
+            flat = torch.empty(sum(p.numel() for p in params), dtype=dtype,
+                               device='cpu' if offload else device, pin_memory=offload)
+            offset = 0
+            for p in params:
+                slow = flat[offset:offset + p.numel()].view_as(p)
+                offset += p.numel()
+                # slow weights restored by load_state_dict, else they start from the fast weights
+                slow.copy_(self.state[p].get('slow_buffer', p.data))
+                self.state[p]['slow_buffer'] = slow
+            slow_buckets.append((params, flat))
+        return slow_buckets
+
     def update_slow(self, group):
-        for fast_p in group["params"]:
-            if fast_p.grad is None:
+        if id(group) not in self._slow_buckets:
+            self._slow_buckets[id(group)] = self._build_slow_buckets(group)
+
+        for params, flat in self._slow_buckets[id(group)]:
+            with_grad = [i for i, p in enumerate(params) if p.grad is not None]
+            if not with_grad:
                 continue
-            param_state = self.state[fast_p]
-            if 'slow_buffer' not in param_state:
-                param_state['slow_buffer'] = torch.empty_like(fast_p.data)
-                param_state['slow_buffer'].copy_(fast_p.data)
-            slow = param_state['slow_buffer']
-            slow.add_(group['lookahead_alpha'], fast_p.data - slow)
-            fast_p.data.copy_(slow)
+            slow_flat = flat.to(params[0].device, non_blocking=True) if flat.device != params[0].device else flat
+            slow, offset = [], 0
+            for p in params:
+                slow.append(slow_flat[offset:offset + p.numel()].view_as(p))
+                offset += p.numel()
+
+            slow = [slow[i] for i in with_grad]
+            fast = [params[i].data for i in with_grad]
+            foreach_lerp_(slow, fast, group['lookahead_alpha'])
+            foreach_copy_(fast, slow)
+            if slow_flat is not flat:
+                flat.copy_(slow_flat)
 
     def sync_lookahead(self):
         for group in self.param_groups:
@@ -53,10 +92,9 @@ class Lookahead(Optimizer):
 
     def state_dict(self):
         fast_state_dict = self.base_optimizer.state_dict()
-        slow_state = {
-            (id(k) if isinstance(k, torch.Tensor) else k): v
-            for k, v in self.state.items()
-        }
+        # keyed by the same param index as the state of the base optimizer
+        params = [p for group in self.param_groups for p in group['params']]
+        slow_state = {i: self.state[p] for i, p in enumerate(params) if p in self.state}
         fast_state = fast_state_dict['state']
         param_groups = fast_state_dict['param_groups']
         return {
@@ -71,22 +109,21 @@ class Lookahead(Optimizer):
             'param_groups': state_dict['param_groups'],
         }
         self.base_optimizer.load_state_dict(fast_state_dict)
+        self.param_groups = self.base_optimizer.param_groups  # make both ref same container
+        # reapply defaults to catch missing lookahead specific ones
+        for name, default in self.defaults.items():
+            for group in self.param_groups:
+                group.setdefault(name, default)
 
-        # We want to restore the slow state, but share param_groups reference
-        # with base_optimizer. This is a bit redundant but least code
-        slow_state_new = False
+        self.state = defaultdict(dict)
+        self._slow_buckets = {}
         if 'slow_state' not in state_dict:
             print('Loading state_dict from optimizer without Lookahead applied.')
-            state_dict['slow_state'] = defaultdict(dict)
-            slow_state_new = True
-        slow_state_dict = {
-            'state': state_dict['slow_state'],
-            'param_groups': state_dict['param_groups'],  # this is pointless but saves code
-        }
-        super(Lookahead, self).load_state_dict(slow_state_dict)
-        self.param_groups = self.base_optimizer.param_groups  # make both ref same container
-        if slow_state_new:
-            # reapply defaults to catch missing lookahead specific ones
-            for name, default in self.defaults.items():
-                for group in self.param_groups:
-                    group.setdefault(name, default)
+            return
+        params = [p for group in self.param_groups for p in group['params']]
+        for k, v in state_dict['slow_state'].items():
+            # older checkpoints keyed the slow state by id(param), which cannot be matched to a
+            # param again, those slow weights restart from the fast weights
+            if isinstance(k, int) and 0 <= k < len(params) and 'slow_buffer' in v:
+                p = params[k]
+                self.state[p]['slow_buffer'] = v['slow_buffer'].to(device=p.device, dtype=p.dtype)
@@ -1,6 +1,8 @@
 import torch
 from torch.optim import Optimizer
 
+from ._foreach import use_foreach, grouped_params
+
 
 class Nadam(Optimizer):
     """Implements Nadam algorithm (a variant of Adam based on Nesterov momentum).
@@ -17,6 +19,8 @@ class Nadam(Optimizer):
             numerical stability (default: 1e-8)
         weight_decay (float, optional): weight decay (L2 penalty) (default: 0)
         schedule_decay (float, optional): momentum schedule decay (default: 4e-3)
+        foreach (boolean, optional): multi-tensor step, None uses it when
+            torch supports it (default: None)
 
     __ http://cs229.stanford.edu/proj2015/054_report.pdf
     __ http://www.cs.toronto.edu/~fritz/absps/momentum.pdf
@@ -26,9 +30,9 @@ class Nadam(Optimizer):
     """
 
     def __init__(self, params, lr=2e-3, betas=(0.9, 0.999), eps=1e-8,
-                 weight_decay=0, schedule_decay=4e-3):
+                 weight_decay=0, schedule_decay=4e-3, foreach=None):
         defaults = dict(lr=lr, betas=betas, eps=eps,
-                        weight_decay=weight_decay, schedule_decay=schedule_decay)
+                        weight_decay=weight_decay, schedule_decay=schedule_decay, foreach=foreach)
         super(Nadam, self).__init__(params, defaults)
 
     def step(self, closure=None):
@@ -43,6 +47,10 @@ class Nadam(Optimizer):
             loss = closure()
 
         for group in self.param_groups:
+            if use_foreach(group.get('foreach')):
+                self._step_foreach(group)
+                continue
+
             for p in group['params']:
                 if p.grad is None:
                     continue
@@ -86,3 +94,47 @@ class Nadam(Optimizer):
                 p.data.addcdiv_(-group['lr'] * momentum_cache_t_1 / (1. - m_schedule_next), exp_avg, denom)
 
         return loss
+
+    def _step_foreach(self, group):
+        beta1, beta2 = group['betas']
+        schedule_decay = group['schedule_decay']
+        for params in grouped_params(group, 'Nadam'):
+            states = [self.state[p] for p in params]
+            grad_sizes, exp_avg_sizes, bias_corrections2 = [], [], []
+            for p, state in zip(params, states):
+                if len(state) == 0:
+                    state['step'] = 0
+                    state['m_schedule'] = 1.
+                    state['exp_avg'] = torch.zeros_like(p.grad.data)
+                    state['exp_avg_sq'] = torch.zeros_like(p.grad.data)
+                state['step'] += 1
+                t = state['step']
+
+                momentum_cache_t = beta1 * (1. - 0.5 * (0.96 ** (t * schedule_decay)))
+                momentum_cache_t_1 = beta1 * (1. - 0.5 * (0.96 ** ((t + 1) * schedule_decay)))
+                m_schedule_new = state['m_schedule'] * momentum_cache_t
+                m_schedule_next = state['m_schedule'] * momentum_cache_t * momentum_cache_t_1
+                state['m_schedule'] = m_schedule_new
+
+                grad_sizes.append(-group['lr'] * (1. - momentum_cache_t) / (1. - m_schedule_new))
+                exp_avg_sizes.append(-group['lr'] * momentum_cache_t_1 / (1. - m_schedule_next))
+                bias_corrections2.append(1. - beta2 ** t)
+
+            params_data = [p.data for p in params]
+            grads = [p.grad.data for p in params]
+            exp_avgs = [state['exp_avg'] for state in states]
+            exp_avg_sqs = [state['exp_avg_sq'] for state in states]
+
+            if group['weight_decay'] != 0:
+                grads = torch._foreach_add(grads, params_data, alpha=group['weight_decay'])
+
+            torch._foreach_mul_(exp_avgs, beta1)
+            torch._foreach_add_(exp_avgs, grads, alpha=1. - beta1)
+            torch._foreach_mul_(exp_avg_sqs, beta2)
+            torch._foreach_addcmul_(exp_avg_sqs, grads, grads, value=1. - beta2)
+            denoms = torch._foreach_div(exp_avg_sqs, bias_corrections2)
+            torch._foreach_sqrt_(denoms)
+            torch._foreach_add_(denoms, group['eps'])
+
+            torch._foreach_addcdiv_(params_data, grads, denoms, grad_sizes)
+            torch._foreach_addcdiv_(params_data, exp_avgs, denoms, exp_avg_sizes)
@@ -8,10 +8,13 @@ import torch
 from torch.optim.optimizer import Optimizer
 import math
 
+from ._foreach import use_foreach, grouped_params, foreach_norm
+
 
 class NovoGrad(Optimizer):
-    def __init__(self, params, grad_averaging=False, lr=0.1, betas=(0.95, 0.98), eps=1e-8, weight_decay=0):
-        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
+    def __init__(self, params, grad_averaging=False, lr=0.1, betas=(0.95, 0.98), eps=1e-8, weight_decay=0,
+                 foreach=None):
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay, foreach=foreach)
         super(NovoGrad, self).__init__(params, defaults)
         self._lr = lr
         self._beta1 = betas[0]
@@ -46,6 +49,10 @@ class NovoGrad(Optimizer):
             self._momentum_initialized = True
 
         for group in self.param_groups:
+            if use_foreach(group.get('foreach')):
+                self._step_foreach(group)
+                continue
+
             for p in group['params']:
                 if p.grad is None:
                     continue
@@ -75,3 +82,40 @@ class NovoGrad(Optimizer):
                 state['grad_ema'] = grad_ema
                 p.data.add_(-step_size, m)
         return loss
+
+    def _step_foreach(self, group):
+        for params in grouped_params(group, 'NovoGrad'):
+            states = [self.state[p] for p in params]
+            for state in states:
+                state['step'] += 1
+
+            params_data = [p.data for p in params]
+            grads = [p.grad.data for p in params]
+
+            # the per-parameter scalars of the bucket are handled as one vector
+            g2 = torch.stack(foreach_norm(grads)) ** 2
+            first = torch.tensor([state['grad_ema'] is None for state in states], device=g2.device)
+            grad_ema = torch.stack([g2[i] if state['grad_ema'] is None else state['grad_ema']
+                                    for i, state in enumerate(states)])
+            grad_ema = torch.where(first, g2, grad_ema * self._beta2 + g2 * (1. - self._beta2))
+            torch._foreach_mul_(grads, (1.0 / (torch.sqrt(grad_ema) + self._eps)).tolist())
+
+            if self._grad_averaging:
+                torch._foreach_mul_(grads, 1. - self._beta1)
+
+            g2 = torch.stack(foreach_norm(grads)) ** 2
+            v = self._beta2 * torch.stack([state['v'] for state in states]) + (1. - self._beta2) * g2
+            updates = torch._foreach_mul(grads, (1.0 / (torch.sqrt(v) + self._eps)).tolist())
+            if self._wd != 0:
+                torch._foreach_add_(updates, params_data, alpha=self._wd)
+            m = torch._foreach_mul([state['m'] for state in states], self._beta1)
+            torch._foreach_add_(m, updates)
+
+            step_sizes = []
+            for i, state in enumerate(states):
+                state['v'], state['m'] = v[i], m[i]
+                state['grad_ema'] = grad_ema[i]
+                bias_correction1 = 1 - self._beta1 ** state['step']
+                bias_correction2 = 1 - self._beta2 ** state['step']
+                step_sizes.append(-group['lr'] * math.sqrt(bias_correction2) / bias_correction1)
+            torch._foreach_add_(params_data, torch._foreach_mul(m, step_sizes))
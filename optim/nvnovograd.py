@@ -9,6 +9,8 @@ import torch
 from torch.optim.optimizer import Optimizer
 import math
 
+from ._foreach import use_foreach, grouped_params, foreach_norm
+
 
 class NvNovoGrad(Optimizer):
     """
@@ -27,10 +29,12 @@ class NvNovoGrad(Optimizer):
         amsgrad (boolean, optional): whether to use the AMSGrad variant of this
             algorithm from the paper `On the Convergence of Adam and Beyond`_
             (default: False)
+        foreach (boolean, optional): multi-tensor step, None uses it when
+            torch supports it (default: None)
     """
 
     def __init__(self, params, lr=1e-3, betas=(0.95, 0.98), eps=1e-8,
-                 weight_decay=0, grad_averaging=False, amsgrad=False):
+                 weight_decay=0, grad_averaging=False, amsgrad=False, foreach=None):
         if not 0.0 <= lr:
             raise ValueError("Invalid learning rate: {}".format(lr))
         if not 0.0 <= eps:
@@ -42,7 +46,8 @@ class NvNovoGrad(Optimizer):
         defaults = dict(lr=lr, betas=betas, eps=eps,
                         weight_decay=weight_decay,
                         grad_averaging=grad_averaging,
-                        amsgrad=amsgrad)
+                        amsgrad=amsgrad,
+                        foreach=foreach)
 
         super(NvNovoGrad, self).__init__(params, defaults)
 
@@ -63,6 +68,10 @@ class NvNovoGrad(Optimizer):
             loss = closure()
 
         for group in self.param_groups:
+            if use_foreach(group.get('foreach')):
+                self._step_foreach(group)
+                continue
+
             for p in group['params']:
                 if p.grad is None:
                     continue
@@ -116,3 +125,45 @@ class NvNovoGrad(Optimizer):
                 p.data.add_(-group['lr'], exp_avg)
 
         return loss
+
+    def _step_foreach(self, group):
+        amsgrad = group['amsgrad']
+        beta1, beta2 = group['betas']
+        for params in grouped_params(group):
+            states = [self.state[p] for p in params]
+            for p, state in zip(params, states):
+                if len(state) == 0:
+                    state['step'] = 0
+                    state['exp_avg'] = torch.zeros_like(p.data)
+                    state['exp_avg_sq'] = torch.zeros([]).to(state['exp_avg'].device)
+                    if amsgrad:
+                        state['max_exp_avg_sq'] = torch.zeros([]).to(state['exp_avg'].device)
+                state['step'] += 1
+
+            params_data = [p.data for p in params]
+            grads = [p.grad.data for p in params]
+            exp_avgs = [state['exp_avg'] for state in states]
+
+            # the layer-wise second moments of the bucket are handled as one vector
+            norm = torch.stack(foreach_norm(grads)).float() ** 2
+            exp_avg_sq = torch.stack([state['exp_avg_sq'] for state in states])
+            exp_avg_sq = torch.where(exp_avg_sq == 0, norm, exp_avg_sq * beta2 + (1 - beta2) * norm)
+            for i, state in enumerate(states):
+                state['exp_avg_sq'] = exp_avg_sq[i]
+            if amsgrad:
+                max_exp_avg_sq = torch.max(torch.stack([state['max_exp_avg_sq'] for state in states]), exp_avg_sq)
+                for i, state in enumerate(states):
+                    state['max_exp_avg_sq'] = max_exp_avg_sq[i]
+                denom = max_exp_avg_sq.sqrt().add_(group['eps'])
+            else:
+                denom = exp_avg_sq.sqrt().add_(group['eps'])
+
+            torch._foreach_div_(grads, denom.tolist())
+            if group['weight_decay'] != 0:
+                torch._foreach_add_(grads, params_data, alpha=group['weight_decay'])
+            if group['grad_averaging']:
+                torch._foreach_mul_(grads, 1 - beta1)
+            torch._foreach_mul_(exp_avgs, beta1)
+            torch._foreach_add_(exp_avgs, grads)
+
+            torch._foreach_add_(params_data, exp_avgs, alpha=-group['lr'])
@@ -11,9 +11,11 @@ from .lookahead import Lookahead
 from .nadam import Nadam
 from .novograd import NovoGrad
 from .nvnovograd import NvNovoGrad
+from .param_groups import build_param_groups
 from .radam import RAdam
 from .rmsprop_tf import RMSpropTF
 from .sgdp import SGDP
+from .zero import ShardedOptimizer
 
 try:
     from apex.optimizers import FusedNovoGrad, FusedAdam, FusedLAMB, FusedSGD
@@ -85,13 +87,19 @@ def create_optimizer(args, model, filter_bias_and_bn=True):
     opt_lower = args.opt.lower()
     weight_decay = args.weight_decay
 
-    if weight_decay and filter_bias_and_bn:
+    if hasattr(args, 'param_groups') and args.param_groups is not None:
+        # declarative per-module lr / weight decay / freeze, see optim/param_groups.py
+        skip = model.no_weight_decay() if hasattr(model, 'no_weight_decay') else {}
+        parameters = build_param_groups(model, args.param_groups, args.lr, weight_decay,
+                                        layer_decay=getattr(args, 'layer_decay', None), skip_list=skip,
+                                        filter_bias_and_bn=filter_bias_and_bn)
+    elif weight_decay and filter_bias_and_bn:
         skip = {}
         if hasattr(model, 'no_weight_decay'):
             skip = model.no_weight_decay()
         if 'lr_text' in args: 
             parameters = add_weight_lr(args, model, weight_decay, skip)
-        if 'lr_img' in args: 
+        elif 'lr_img' in args: 
             parameters = add_weight_lr_img(args, model, weight_decay, skip)
         else:
             parameters = add_weight_decay(model, weight_decay, skip)
@@ -99,8 +107,10 @@ def create_optimizer(args, model, filter_bias_and_bn=True):
     else:
         parameters = model.parameters()
 
-    if 'fused' in opt_lower:
-        assert has_apex and torch.cuda.is_available(), 'APEX and CUDA required for fused optimizers'
+    if 'fused' in opt_lower and not (has_apex and torch.cuda.is_available()):
+        # without APEX the fused optimizers fall back to the multi-tensor (foreach) implementations
+        assert 'lamb' not in opt_lower, 'APEX and CUDA required for fused LAMB'
+        opt_lower = opt_lower.replace('fusednovograd', 'nvnovograd').replace('fused', '')
 
     opt_args = dict(lr=args.lr, weight_decay=weight_decay)
     if hasattr(args, 'opt_eps') and args.opt_eps is not None:
@@ -109,43 +119,51 @@ def create_optimizer(args, model, filter_bias_and_bn=True):
         opt_args['betas'] = args.opt_betas
     if hasattr(args, 'opt_args') and args.opt_args is not None:
         opt_args.update(args.opt_args)
+    # multi-tensor step of the optimizers of this package and of torch.optim, None picks it whenever
+    # torch supports it (torch.optim: when all params are on CUDA)
+    foreach_args = {}
+    if hasattr(args, 'opt_foreach') and args.opt_foreach is not None:
+        foreach_args['foreach'] = args.opt_foreach
 
     opt_split = opt_lower.split('_')
     opt_lower = opt_split[-1]
     if opt_lower == 'sgd' or opt_lower == 'nesterov':
         opt_args.pop('eps', None)
-        optimizer = optim.SGD(parameters, momentum=args.momentum, nesterov=True, **opt_args)
+        optimizer = optim.SGD(parameters, momentum=args.momentum, nesterov=True, **opt_args, **foreach_args)
     elif opt_lower == 'momentum':
         opt_args.pop('eps', None)
-        optimizer = optim.SGD(parameters, momentum=args.momentum, nesterov=False, **opt_args)
+        optimizer = optim.SGD(parameters, momentum=args.momentum, nesterov=False, **opt_args, **foreach_args)
     elif opt_lower == 'adam':
-        optimizer = optim.Adam(parameters, **opt_args)
+        optimizer = optim.Adam(parameters, **opt_args, **foreach_args)
     elif opt_lower == 'adamw':
-        optimizer = optim.AdamW(parameters, **opt_args)
+        optimizer = optim.AdamW(parameters, **opt_args, **foreach_args)
     elif opt_lower == 'nadam':
-        optimizer = Nadam(parameters, **opt_args)
+        optimizer = Nadam(parameters, **opt_args, **foreach_args)
     elif opt_lower == 'radam':
-        optimizer = RAdam(parameters, **opt_args)
+        optimizer = RAdam(parameters, **opt_args, **foreach_args)
     elif opt_lower == 'adamp':        
-        optimizer = AdamP(parameters, wd_ratio=0.01, nesterov=True, **opt_args)
+        optimizer = AdamP(parameters, wd_ratio=0.01, nesterov=True, **opt_args, **foreach_args)
     elif opt_lower == 'sgdp':        
-        optimizer = SGDP(parameters, momentum=args.momentum, nesterov=True, **opt_args)
+        optimizer = SGDP(parameters, momentum=args.momentum, nesterov=True, **opt_args, **foreach_args)
     elif opt_lower == 'adadelta':
-        optimizer = optim.Adadelta(parameters, **opt_args)
+        optimizer = optim.Adadelta(parameters, **opt_args, **foreach_args)
     elif opt_lower == 'adafactor':
         if not args.lr:
             opt_args['lr'] = None
-        optimizer = Adafactor(parameters, **opt_args)
+        optimizer = Adafactor(parameters, **opt_args, **foreach_args)
     elif opt_lower == 'adahessian':
+        if hasattr(args, 'hessian_modules') and args.hessian_modules:
+            # curvature of these modules only, e.g. [bbox_head, cls_head, itm_head]
+            opt_args['hessian_params'] = [p for n, p in model.named_parameters() if n.startswith(tuple(args.hessian_modules))]
         optimizer = Adahessian(parameters, **opt_args)
     elif opt_lower == 'rmsprop':
-        optimizer = optim.RMSprop(parameters, alpha=0.9, momentum=args.momentum, **opt_args)
+        optimizer = optim.RMSprop(parameters, alpha=0.9, momentum=args.momentum, **opt_args, **foreach_args)
     elif opt_lower == 'rmsproptf':
-        optimizer = RMSpropTF(parameters, alpha=0.9, momentum=args.momentum, **opt_args)
+        optimizer = RMSpropTF(parameters, alpha=0.9, momentum=args.momentum, **opt_args, **foreach_args)
     elif opt_lower == 'novograd':
-        optimizer = NovoGrad(parameters, **opt_args)
+        optimizer = NovoGrad(parameters, **opt_args, **foreach_args)
     elif opt_lower == 'nvnovograd':
-        optimizer = NvNovoGrad(parameters, **opt_args)
+        optimizer = NvNovoGrad(parameters, **opt_args, **foreach_args)
     elif opt_lower == 'fusedsgd':
         opt_args.pop('eps', None)
         optimizer = FusedSGD(parameters, momentum=args.momentum, nesterov=True, **opt_args)
@@ -165,8 +183,16 @@ def create_optimizer(args, model, filter_bias_and_bn=True):
         assert False and "Invalid optimizer"
         raise ValueError
 
+    if hasattr(args, 'opt_shard_state') and args.opt_shard_state:
+        # ZeRO-1: each data parallel rank keeps the state of 1 / world_size of the params, see optim/zero.py
+        assert len(opt_split) == 1, 'opt_shard_state does not support lookahead'
+        # Adahessian creates its state in __init__ and is a second order optimizer, read by train.py
+        assert opt_lower != 'adahessian', 'opt_shard_state does not support adahessian'
+        optimizer = ShardedOptimizer(optimizer)
+
     if len(opt_split) > 1:
         if opt_split[0] == 'lookahead':
-            optimizer = Lookahead(optimizer)
+            # lookahead_offload: keep the slow weights in CPU memory
+            optimizer = Lookahead(optimizer, offload=bool(getattr(args, 'lookahead_offload', False)))
 
     return optimizer
@@ -0,0 +1,127 @@
+""" Declarative param groups for HAMMER
+
+A spec is a list of rules, the first rule whose pattern matches the name of a
+parameter owns it, unmatched parameters fall in the default group (base lr and
+weight decay). In the optimizer section of the config:
+
+    optimizer: {opt: adamW, lr: 2e-5, weight_decay: 0.02, layer_decay: 0.75,
+                param_groups: [{modules: [vision, text_lower], freeze: True},
+                               {modules: [fusion], lr: 5e-5},
+                               {modules: [heads, dual_transformer], lr: 1e-4}]}
+
+`modules` entries are the aliases of HAMMER_MODULES or regexes matched against
+the start of the parameter name. A rule sets lr, weight_decay and / or freeze,
+frozen parameters get requires_grad=False and are left out of the optimizer, so
+they have no optimizer state. With layer_decay the lr of ViT block / BERT layer i
+of n is further scaled by layer_decay ** (n + 1 - (i + 1)), the embeddings by
+layer_decay ** (n + 1).
+"""
+import re
+from collections import OrderedDict
+
+# heads and the modules on top of the encoders
+HEADS = ['vision_proj', 'text_proj', 'temp', 'itm_head', 'bbox_head', 'cls_head', 'text_mlp', 'image_mlp',
+         'cls_token_local', 'aggregator', 'it_cross_attn', 'norm_layer_aggr', 'norm_layer_it_cross_atten',
+         'text_encoder.classifier']
+
+
+def _layer_range(prefix, start, stop):
+    return [r'%s\.%d\.' % (re.escape(prefix), i) for i in range(start, stop)]
+
+
+def hammer_module_patterns(model):
+    """alias -> name regexes of the HAMMER modules, the text split follows the fusion layer of the BERT config"""
+    patterns = {
+        'vision': [r'visual_encoder\.'],
+        'text': [r'text_encoder\.'],
+        'heads': [re.escape(name) + r'(\.|$)' for name in HEADS],
+        'dual_transformer': [r'rec_text_trans\.', r'rec_image_trans\.'],
+    }
+    text_config = getattr(getattr(model, 'text_encoder', None), 'config', None)
+    if text_config is not None:
+        layer = 'text_encoder.bert.encoder.layer'
+        patterns['text_lower'] = [r'text_encoder\.bert\.embeddings\.'] \
+            + _layer_range(layer, 0, text_config.fusion_layer)
+        patterns['fusion'] = _layer_range(layer, text_config.fusion_layer, text_config.num_hidden_layers)
+    return patterns
+
+
+def _layer_scale(name, model, layer_decay):
+    """layer-wise lr decay scale of the ViT / BERT parameters, 1 for everything else"""
+    if name.startswith('visual_encoder.'):
+        num_layers = len(model.visual_encoder.blocks)
+        if name.startswith(('visual_encoder.cls_token', 'visual_encoder.pos_embed', 'visual_encoder.patch_embed')):
+            layer_id = 0
+        elif name.startswith('visual_encoder.blocks.'):
+            layer_id = int(name.split('.')[2]) + 1
+        else:
+            layer_id = num_layers + 1
+    elif name.startswith('text_encoder.bert.'):
+        num_layers = model.text_encoder.config.num_hidden_layers
+        if name.startswith('text_encoder.bert.embeddings.'):
+            layer_id = 0
+        elif name.startswith('text_encoder.bert.encoder.layer.'):
+            layer_id = int(name.split('.')[4]) + 1
+        else:
+            layer_id = num_layers + 1
+    else:
+        return 1.
+    return layer_decay ** (num_layers + 1 - layer_id)
+
+
+def compile_spec(model, spec):
+    """the rules of the spec with their regexes compiled"""
+    aliases = hammer_module_patterns(model)
+    rules = []
+    for i, rule in enumerate(spec):
+        rule = dict(rule)
+        modules = rule.pop('modules')
+        if isinstance(modules, str):
+            modules = [modules]
+        regexes = [p for m in modules for p in aliases.get(m, [m])]
+        rule['name'] = rule.get('name', '_'.join(modules) if all(m in aliases for m in modules) else 'group%d' % i)
+        rule['pattern'] = re.compile('|'.join('(?:%s)' % r for r in regexes))
+        unknown = set(rule) - {'name', 'pattern', 'lr', 'weight_decay', 'freeze'}
+        if unknown:
+            raise ValueError('Unknown param group settings %s' % sorted(unknown))
+        rules.append(rule)
+    return rules
+
+
+def build_param_groups(model, spec, lr, weight_decay, layer_decay=None, skip_list=(), filter_bias_and_bn=True):
+    """
+    Param groups of the model following the spec, one group per rule, layer
+    scale and decay / no decay. Every group has its lr_scale relative to lr,
+    which scheduler.lr_sched.adjust_learning_rate applies.
+    """
+    rules = compile_spec(model, spec)
+    default = {'name': 'default'}
+    groups = OrderedDict()
+    num_frozen = 0
+    for name, param in model.named_parameters():
+        if not param.requires_grad:
+            continue  # frozen weights, momentum encoders
+        rule = next((r for r in rules if r['pattern'].match(name)), default)
+        if rule.get('freeze', False):
+            param.requires_grad_(False)
+            num_frozen += param.numel()
+            continue
+
+        no_decay = filter_bias_and_bn and (len(param.shape) == 1 or name.endswith(".bias") or name in skip_list)
+        scale = rule.get('lr', lr) / lr
+        if layer_decay is not None:
+            scale *= _layer_scale(name, model, layer_decay)
+        key = (rule['name'], scale, no_decay)
+        if key not in groups:
+            groups[key] = {
+                'params': [],
+                'lr': lr * scale,
+                'lr_scale': scale,
+                'weight_decay': 0. if no_decay else rule.get('weight_decay', weight_decay),
+                'group_name': rule['name'] + ('_no_decay' if no_decay else ''),
+            }
+        groups[key]['params'].append(param)
+
+    if num_frozen:
+        print('Frozen %.1fM parameters' % (num_frozen / 1e6))
+    return list(groups.values())
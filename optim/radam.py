@@ -6,11 +6,13 @@ import math
 import torch
 from torch.optim.optimizer import Optimizer, required
 
+from ._foreach import use_foreach, grouped_params
+
 
 class RAdam(Optimizer):
 
-    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=0):
-        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=0, foreach=None):
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay, foreach=foreach)
         self.buffer = [[None, None, None] for ind in range(10)]
         super(RAdam, self).__init__(params, defaults)
 
@@ -24,6 +26,9 @@ class RAdam(Optimizer):
             loss = closure()
 
         for group in self.param_groups:
+            if use_foreach(group.get('foreach')):
+                self._step_foreach(group)
+                continue
 
             for p in group['params']:
                 if p.grad is None:
@@ -84,6 +89,61 @@ class RAdam(Optimizer):
 
         return loss
 
+    def _step_foreach(self, group):
+        beta1, beta2 = group['betas']
+        N_sma_max = 2 / (1 - beta2) - 1
+        for params in grouped_params(group, 'RAdam'):
+            states = [self.state[p] for p in params]
+            params_fp32 = [p.data.float() for p in params]
+            grads = [p.grad.data.float() for p in params]
+            rectified, step_sizes = [], []
+            for p_data_fp32, state in zip(params_fp32, states):
+                if len(state) == 0:
+                    state['step'] = 0
+                    state['exp_avg'] = torch.zeros_like(p_data_fp32)
+                    state['exp_avg_sq'] = torch.zeros_like(p_data_fp32)
+                else:
+                    state['exp_avg'] = state['exp_avg'].type_as(p_data_fp32)
+                    state['exp_avg_sq'] = state['exp_avg_sq'].type_as(p_data_fp32)
+                state['step'] += 1
+
+                beta2_t = beta2 ** state['step']
+                N_sma = N_sma_max - 2 * state['step'] * beta2_t / (1 - beta2_t)
+                # more conservative since it's an approximated value
+                if N_sma >= 5:
+                    step_size = group['lr'] * math.sqrt(
+                        (1 - beta2_t) * (N_sma - 4) / (N_sma_max - 4) * (N_sma - 2) / N_sma * N_sma_max / (
+                                    N_sma_max - 2)) / (1 - beta1 ** state['step'])
+                else:
+                    step_size = group['lr'] / (1 - beta1 ** state['step'])
+                rectified.append(N_sma >= 5)
+                step_sizes.append(-step_size)
+
+            exp_avgs = [state['exp_avg'] for state in states]
+            exp_avg_sqs = [state['exp_avg_sq'] for state in states]
+            torch._foreach_mul_(exp_avg_sqs, beta2)
+            torch._foreach_addcmul_(exp_avg_sqs, grads, grads, value=1 - beta2)
+            torch._foreach_mul_(exp_avgs, beta1)
+            torch._foreach_add_(exp_avgs, grads, alpha=1 - beta1)
+
+            if group['weight_decay'] != 0:
+                torch._foreach_add_(params_fp32, params_fp32, alpha=-group['weight_decay'] * group['lr'])
+
+            rect = [i for i, r in enumerate(rectified) if r]
+            if rect:
+                denoms = torch._foreach_sqrt([exp_avg_sqs[i] for i in rect])
+                torch._foreach_add_(denoms, group['eps'])
+                torch._foreach_addcdiv_([params_fp32[i] for i in rect], [exp_avgs[i] for i in rect], denoms,
+                                        [step_sizes[i] for i in rect])
+            unrect = [i for i, r in enumerate(rectified) if not r]
+            if unrect:
+                updates = torch._foreach_mul([exp_avgs[i] for i in unrect], [step_sizes[i] for i in unrect])
+                torch._foreach_add_([params_fp32[i] for i in unrect], updates)
+
+            if params[0].dtype != torch.float32:
+                for p, p_data_fp32 in zip(params, params_fp32):
+                    p.data.copy_(p_data_fp32)
+
 
 class PlainRAdam(Optimizer):
 
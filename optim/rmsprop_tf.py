@@ -10,6 +10,8 @@ Modifications Copyright 2020 Ross Wightman
 import torch
 from torch.optim import Optimizer
 
+from ._foreach import use_foreach, grouped_params
+
 
 class RMSpropTF(Optimizer):
     """Implements RMSprop algorithm (TensorFlow style epsilon)
@@ -42,11 +44,12 @@ class RMSpropTF(Optimizer):
         decoupled_decay (bool, optional): decoupled weight decay as per https://arxiv.org/abs/1711.05101
         lr_in_momentum (bool, optional): learning rate scaling is included in the momentum buffer
             update as per defaults in Tensorflow
+        foreach (bool, optional): multi-tensor step, None uses it when torch supports it
 
     """
 
     def __init__(self, params, lr=1e-2, alpha=0.9, eps=1e-10, weight_decay=0, momentum=0., centered=False,
-                 decoupled_decay=False, lr_in_momentum=True):
+                 decoupled_decay=False, lr_in_momentum=True, foreach=None):
         if not 0.0 <= lr:
             raise ValueError("Invalid learning rate: {}".format(lr))
         if not 0.0 <= eps:
@@ -59,7 +62,7 @@ class RMSpropTF(Optimizer):
             raise ValueError("Invalid alpha value: {}".format(alpha))
 
         defaults = dict(lr=lr, momentum=momentum, alpha=alpha, eps=eps, centered=centered, weight_decay=weight_decay,
-                        decoupled_decay=decoupled_decay, lr_in_momentum=lr_in_momentum)
+                        decoupled_decay=decoupled_decay, lr_in_momentum=lr_in_momentum, foreach=foreach)
         super(RMSpropTF, self).__init__(params, defaults)
 
     def __setstate__(self, state):
@@ -80,6 +83,10 @@ class RMSpropTF(Optimizer):
             loss = closure()
 
         for group in self.param_groups:
+            if use_foreach(group.get('foreach')):
+                self._step_foreach(group)
+                continue
+
             for p in group['params']:
                 if p.grad is None:
                     continue
@@ -134,3 +141,56 @@ class RMSpropTF(Optimizer):
                     p.data.addcdiv_(-group['lr'], grad, avg)
 
         return loss
+
+    def _step_foreach(self, group):
+        one_minus_alpha = 1. - group['alpha']
+        for params in grouped_params(group, 'RMSprop'):
+            states = [self.state[p] for p in params]
+            for p, state in zip(params, states):
+                if len(state) == 0:
+                    state['step'] = 0
+                    state['square_avg'] = torch.ones_like(p.data)  # PyTorch inits to zero
+                    if group['momentum'] > 0:
+                        state['momentum_buffer'] = torch.zeros_like(p.data)
+                    if group['centered']:
+                        state['grad_avg'] = torch.zeros_like(p.data)
+                state['step'] += 1
+
+            params_data = [p.data for p in params]
+            grads = [p.grad.data for p in params]
+            square_avgs = [state['square_avg'] for state in states]
+
+            if group['weight_decay'] != 0:
+                if 'decoupled_decay' in group and group['decoupled_decay']:
+                    torch._foreach_add_(params_data, params_data, alpha=-group['weight_decay'])
+                else:
+                    grads = torch._foreach_add(grads, params_data, alpha=group['weight_decay'])
+
+            # Tensorflow order of ops for updating squared avg
+            deltas = torch._foreach_mul(grads, grads)
+            torch._foreach_sub_(deltas, square_avgs)
+            torch._foreach_add_(square_avgs, deltas, alpha=one_minus_alpha)
+
+            if group['centered']:
+                grad_avgs = [state['grad_avg'] for state in states]
+                deltas = torch._foreach_sub(grads, grad_avgs)
+                torch._foreach_add_(grad_avgs, deltas, alpha=one_minus_alpha)
+                avgs = torch._foreach_addcmul(square_avgs, grad_avgs, grad_avgs, value=-1)
+                torch._foreach_add_(avgs, group['eps'])
+            else:
+                avgs = torch._foreach_add(square_avgs, group['eps'])
+            torch._foreach_sqrt_(avgs)  # eps moved in sqrt
+
+            if group['momentum'] > 0:
+                bufs = [state['momentum_buffer'] for state in states]
+                torch._foreach_mul_(bufs, group['momentum'])
+                # Tensorflow accumulates the LR scaling in the momentum buffer
+                if 'lr_in_momentum' in group and group['lr_in_momentum']:
+                    torch._foreach_addcdiv_(bufs, grads, avgs, value=group['lr'])
+                    torch._foreach_sub_(params_data, bufs)
+                else:
+                    # PyTorch scales the param update by LR
+                    torch._foreach_addcdiv_(bufs, grads, avgs)
+                    torch._foreach_add_(params_data, bufs, alpha=-group['lr'])
+            else:
+                torch._foreach_addcdiv_(params_data, grads, avgs, value=-group['lr'])
@@ -13,11 +13,13 @@ import torch.nn as nn
 from torch.optim.optimizer import Optimizer, required
 import math
 
+from ._foreach import use_foreach, grouped_params, projection_multi
+
 class SGDP(Optimizer):
     def __init__(self, params, lr=required, momentum=0, dampening=0,
-                 weight_decay=0, nesterov=False, eps=1e-8, delta=0.1, wd_ratio=0.1):
+                 weight_decay=0, nesterov=False, eps=1e-8, delta=0.1, wd_ratio=0.1, foreach=None):
         defaults = dict(lr=lr, momentum=momentum, dampening=dampening, weight_decay=weight_decay,
-                        nesterov=nesterov, eps=eps, delta=delta, wd_ratio=wd_ratio)
+                        nesterov=nesterov, eps=eps, delta=delta, wd_ratio=wd_ratio, foreach=foreach)
         super(SGDP, self).__init__(params, defaults)
 
     def _channel_view(self, x):
@@ -58,6 +60,10 @@ class SGDP(Optimizer):
             loss = closure()
 
         for group in self.param_groups:
+            if use_foreach(group.get('foreach')):
+                self._step_foreach(group)
+                continue
+
             weight_decay = group['weight_decay']
             momentum = group['momentum']
             dampening = group['dampening']
@@ -94,3 +100,34 @@ class SGDP(Optimizer):
                 p.data.add_(-group['lr'], d_p)
 
         return loss
+
+    def _step_foreach(self, group):
+        momentum = group['momentum']
+        for params in grouped_params(group, 'SGDP'):
+            states = [self.state[p] for p in params]
+            for p, state in zip(params, states):
+                if len(state) == 0:
+                    state['momentum'] = torch.zeros_like(p.data)
+
+            params_data = [p.data for p in params]
+            grads = [p.grad.data for p in params]
+            bufs = [state['momentum'] for state in states]
+
+            # SGD
+            torch._foreach_mul_(bufs, momentum)
+            torch._foreach_add_(bufs, grads, alpha=1 - group['dampening'])
+            if group['nesterov']:
+                d_ps = torch._foreach_add(grads, bufs, alpha=momentum)
+            else:
+                d_ps = bufs
+
+            # Projection
+            wd_ratios = projection_multi(params_data, grads, d_ps, group['delta'], group['wd_ratio'], group['eps'])
+
+            # Weight decay
+            if group['weight_decay'] != 0:
+                torch._foreach_mul_(params_data, [1 - group['lr'] * group['weight_decay'] * r / (1 - momentum)
+                                                  for r in wd_ratios])
+
+            # Step
+            torch._foreach_add_(params_data, d_ps, alpha=-group['lr'])
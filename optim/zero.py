@@ -0,0 +1,189 @@
+""" Sharded optimizer state (ZeRO stage 1)
+
+Every data parallel rank keeps the optimizer state (e.g. the AdamW moments) of its
+own share of the parameters only. The gradients are still all-reduced in full by
+DDP, each rank steps the optimizer on its share, then every rank broadcasts its
+updated parameters to the others, one flat buffer per rank. The parameters are
+assigned to ranks greedily by size so that the shards hold about the same number
+of elements, independently of the param groups.
+
+ShardedOptimizer wraps an optimizer that creates its state lazily on the first
+step (all optimizers of this package and torch.optim): its param groups are cut
+down to the local parameters, while ShardedOptimizer.param_groups keeps the full
+groups, so that schedulers and logging see the usual optimizer.
+
+Checkpoints: state_dict() is the shard of this rank, keyed by the global parameter
+index like the state of a regular optimizer. gather_state_dict() collects the
+shards of all ranks on one rank, over a gloo group so that the full state is only
+ever held in CPU memory. load_state_dict() accepts the gathered shards of any
+number of ranks, or the state_dict of a regular optimizer, and keeps the state of
+the parameters of this rank, so a run can resume on a different world size.
+"""
+import torch
+import torch.distributed as dist
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+from torch.optim.optimizer import Optimizer
+
+
+def _to_cpu(obj):
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().cpu()
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def partition_params(params, world_size):
+    """owner rank of every param, the largest params first to the rank with the fewest elements"""
+    owners = [0] * len(params)
+    load = [0] * world_size
+    for i in sorted(range(len(params)), key=lambda i: -params[i].numel()):
+        rank = load.index(min(load))
+        owners[i] = rank
+        load[rank] += params[i].numel()
+    return owners
+
+
+class ShardedOptimizer(Optimizer):
+    def __init__(self, base_optimizer):
+        if any(len(s) for s in base_optimizer.state.values()):
+            raise ValueError('ShardedOptimizer needs an optimizer without state, wrap it before the first step')
+        # hooks and profiling state of the base class, used by zero_grad and step,
+        # the param group dicts are shared with base_optimizer
+        super().__init__(base_optimizer.param_groups, base_optimizer.defaults)
+        self.base_optimizer = base_optimizer
+        self.distributed = dist.is_available() and dist.is_initialized()
+        self.world_size = dist.get_world_size() if self.distributed else 1
+        self.rank = dist.get_rank() if self.distributed else 0
+
+        self.param_groups = base_optimizer.param_groups
+        params = [p for group in self.param_groups for p in group['params']]
+        owners = partition_params(params, self.world_size)
+        # params of every rank in global order, for the broadcast
+        self._rank_params = [[p for p, owner in zip(params, owners) if owner == rank] for rank in range(self.world_size)]
+        # global index of the local params, in the order of the local state_dict
+        self._local_to_global = [i for i, owner in enumerate(owners) if owner == self.rank]
+        local_params = set(self._rank_params[self.rank])
+        self.base_optimizer.param_groups = [dict(group, params=[p for p in group['params'] if p in local_params])
+                                            for group in self.param_groups]
+        self.state = self.base_optimizer.state
+
+        # shards are gathered for checkpoints as CPU tensors
+        self._cpu_group = None
+        if self.distributed and dist.get_backend() != 'gloo':
+            self._cpu_group = dist.new_group(backend='gloo')
+
+    def _sync_hyperparameters(self):
+        # lr and co. are set by the schedulers on the full param groups
+        for group, local_group in zip(self.param_groups, self.base_optimizer.param_groups):
+            for k, v in group.items():
+                if k != 'params':
+                    local_group[k] = v
+
+    @torch.no_grad()
+    def _broadcast_params(self):
+        if self.world_size == 1:
+            return
+        works, flats = [], []
+        for rank, params in enumerate(self._rank_params):
+            if not params:
+                flats.append(None)
+                continue
+            if rank == self.rank:
+                flat = _flatten_dense_tensors([p.data for p in params])
+            else:
+                flat = params[0].new_empty(sum(p.numel() for p in params))
+            works.append(dist.broadcast(flat, rank, async_op=True))
+            flats.append(flat)
+        for work in works:
+            work.wait()
+        for rank, (params, flat) in enumerate(zip(self._rank_params, flats)):
+            if flat is None or rank == self.rank:
+                continue
+            for p, value in zip(params, _unflatten_dense_tensors(flat, params)):
+                p.data.copy_(value)
+
+    def step(self, closure=None):
+        self._sync_hyperparameters()
+        loss = self.base_optimizer.step(closure)
+        self._broadcast_params()
+        return loss
+
+    def _param_groups_state(self):
+        param_groups, start = [], 0
+        for group in self.param_groups:
+            param_groups.append(dict({k: v for k, v in group.items() if k != 'params'},
+                                     params=list(range(start, start + len(group['params'])))))
+            start += len(group['params'])
+        return param_groups
+
+    def state_dict(self):
+        """the shard of this rank"""
+        local_state = self.base_optimizer.state_dict()['state']
+        return {
+            'state': {self._local_to_global[i]: v for i, v in local_state.items()},
+            'param_groups': self._param_groups_state(),
+            'shard': self.rank,
+            'num_shards': self.world_size,
+        }
+
+    def gather_state_dict(self, dst=0):
+        """
+        Collective, call on all ranks: {'shards': [state_dict() of every rank], 'param_groups'}
+        on rank dst, None on the others.
+        """
+        shard = _to_cpu(self.state_dict())
+        if self.world_size == 1:
+            return {'shards': [shard], 'param_groups': shard['param_groups']}
+        shards = [None] * self.world_size if self.rank == dst else None
+        dist.gather_object(shard, shards, dst=dst, group=self._cpu_group)
+        if self.rank != dst:
+            return None
+        return {'shards': shards, 'param_groups': shard['param_groups']}
+
+    def load_state_dict(self, state_dict):
+        state = merge_shards(state_dict)['state']
+        saved_groups = state_dict['param_groups']
+        if len(saved_groups) != len(self.param_groups):
+            raise ValueError('loaded state dict has a different number of parameter groups')
+        for group, saved_group in zip(self.param_groups, saved_groups):
+            group.update({k: v for k, v in saved_group.items() if k != 'params'})
+
+        local_state = {i: state[g] for i, g in enumerate(self._local_to_global) if g in state}
+        local_groups, start = [], 0
+        for group, saved_group in zip(self.base_optimizer.param_groups, saved_groups):
+            local_groups.append(dict({k: v for k, v in saved_group.items() if k != 'params'},
+                                     params=list(range(start, start + len(group['params'])))))
+            start += len(group['params'])
+        self.base_optimizer.load_state_dict({'state': local_state, 'param_groups': local_groups})
+        self.state = self.base_optimizer.state
+
+
+def merge_shards(state_dict):
+    """state_dict of a regular optimizer from the gathered shards of a ShardedOptimizer"""
+    if 'shards' not in state_dict:
+        return state_dict
+    state = {}
+    for shard in state_dict['shards']:
+        state.update(shard['state'])
+    return {'state': state, 'param_groups': state_dict['param_groups']}
+
+
+def load_optimizer_state(optimizer, state_dict):
+    """loads a sharded or regular optimizer checkpoint into a sharded or regular optimizer"""
+    if isinstance(optimizer, ShardedOptimizer):
+        optimizer.load_state_dict(state_dict)
+    else:
+        optimizer.load_state_dict(merge_shards(state_dict))
+
+
+def gather_optimizer_state(optimizer, dst=0):
+    """
+    Optimizer state for a checkpoint written by rank dst. Collective for a ShardedOptimizer,
+    which returns None on the other ranks.
+    """
+    if isinstance(optimizer, ShardedOptimizer):
+        return optimizer.gather_state_dict(dst)
+    return optimizer.state_dict()
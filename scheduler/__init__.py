@@ -2,4 +2,5 @@ from .cosine_lr import CosineLRScheduler
 from .plateau_lr import PlateauLRScheduler
 from .step_lr import StepLRScheduler
 from .tanh_lr import TanhLRScheduler
-from .scheduler_factory import create_scheduler
+from .step_table import StepLRTable
+from .scheduler_factory import create_scheduler, create_step_scheduler
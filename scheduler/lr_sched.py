@@ -6,13 +6,17 @@
 
 import math
 
+def get_lr(epoch, base_lr, sched_cfg):
+    """half-cycle cosine after linear warmup, epoch can be fractional"""
+    if epoch < sched_cfg['warmup_epochs']:
+        return base_lr * epoch / sched_cfg['warmup_epochs']
+    return sched_cfg['min_lr'] + (base_lr - sched_cfg['min_lr']) * 0.5 * \
+        (1. + math.cos(math.pi * (epoch - sched_cfg['warmup_epochs']) / (sched_cfg['epochs'] - sched_cfg['warmup_epochs'])))
+
+
 def adjust_learning_rate(optimizer, epoch, args, cfg):
     """Decay the learning rate with half-cycle cosine after warmup"""
-    if epoch < cfg['schedular']['warmup_epochs']:
-        lr = args.lr * epoch / cfg['schedular']['warmup_epochs'] 
-    else:
-        lr = cfg['schedular']['min_lr'] + (args.lr - cfg['schedular']['min_lr']) * 0.5 * \
-            (1. + math.cos(math.pi * (epoch - cfg['schedular']['warmup_epochs']) / (cfg['schedular']['epochs'] - cfg['schedular']['warmup_epochs'])))
+    lr = get_lr(epoch, args.lr, cfg['schedular'])
     for param_group in optimizer.param_groups:
         if "lr_scale" in param_group:
             param_group["lr"] = lr * param_group["lr_scale"]
@@ -5,6 +5,10 @@ from .cosine_lr import CosineLRScheduler
 from .tanh_lr import TanhLRScheduler
 from .step_lr import StepLRScheduler
 from .plateau_lr import PlateauLRScheduler
+from .step_table import StepLRTable, epoch_positions, step_positions, table_from_scheduler
+from . import lr_sched
+
+import numpy as np
 
 
 def create_scheduler(args, optimizer):
@@ -87,3 +91,25 @@ def create_scheduler(args, optimizer):
         import scheduler.lr_sched as lr_scheduler
 
     return lr_scheduler, num_epochs
+
+
+def create_step_scheduler(args, optimizer, updates_per_epoch, lr=None):
+    """
+    StepLRTable of the `sched` of args over args.epochs epochs of updates_per_epoch
+    optimizer updates. lr is the base lr of cosine_in_step, scaled by the lr_scale of
+    each param group. The epoch schedulers follow the staircase train.py stepped them
+    with (warmup every warmup_step_size updates of epoch 0, then once per epoch),
+    lr_per_step evaluates them at every update instead.
+    """
+    num_updates = args.epochs * updates_per_epoch
+    if args.sched == 'cosine_in_step':
+        base = np.array([lr_sched.get_lr(t, lr, args) for t in (np.arange(num_updates) / updates_per_epoch).tolist()])
+        scales = np.array([group.get('lr_scale', 1.) for group in optimizer.param_groups])
+        return StepLRTable(optimizer, base[:, None] * scales[None, :])
+    if args.sched == 'plateau':
+        raise ValueError('The plateau schedule depends on the eval metric and cannot be precomputed')
+
+    lr_scheduler, _ = create_scheduler(args, optimizer)
+    positions = step_positions if getattr(args, 'lr_per_step', False) else epoch_positions
+    positions = positions(num_updates, updates_per_epoch, args.warmup_epochs, getattr(args, 'warmup_step_size', 100))
+    return StepLRTable(optimizer, table_from_scheduler(lr_scheduler, positions))
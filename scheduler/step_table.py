@@ -0,0 +1,78 @@
+""" Step LR Table
+
+The LR of every optimizer update of the run, precomputed as a
+(num_updates, num_param_groups) table when the scheduler is created. Warmup,
+cycles and noise of the epoch schedulers of this package, and the cosine of
+lr_sched, are evaluated once per distinct schedule position. Training then only
+writes row `num_updates` into the param groups, and the scheduler state is that
+update index.
+"""
+import numpy as np
+import torch
+
+
+def epoch_positions(num_updates, updates_per_epoch, warmup_t, warmup_step_size):
+    """
+    Schedule position of every update when the epoch schedulers are stepped as train.py
+    always did: scheduler.step(i // warmup_step_size) every warmup_step_size updates of
+    epoch 0 until warmup_t, then scheduler.step(epoch + warmup_t) at the end of every epoch.
+    """
+    updates = np.arange(num_updates)
+    epoch, i = updates // updates_per_epoch, updates % updates_per_epoch
+    warmup = np.minimum(np.maximum(i - 1, 0) // warmup_step_size, warmup_t)
+    return np.where(epoch == 0, warmup, epoch + warmup_t)
+
+
+def step_positions(num_updates, updates_per_epoch, warmup_t, warmup_step_size):
+    """Same schedule with a linear warmup over warmup_t * warmup_step_size updates and fractional epochs after it"""
+    updates = np.arange(num_updates, dtype=np.float64)
+    warmup_updates = warmup_t * warmup_step_size
+    if not warmup_updates:
+        return updates / updates_per_epoch
+    return np.where(updates < warmup_updates, warmup_t * updates / warmup_updates,
+                    warmup_t + (updates - warmup_updates) / updates_per_epoch)
+
+
+def table_from_scheduler(scheduler, positions):
+    """LR rows of a Cosine / Tanh / Step LR scheduler at the given positions, noise included"""
+    unique, inverse = np.unique(positions, return_inverse=True)
+    rows = np.array([scheduler._add_noise(scheduler._get_lr(t), int(t)) for t in unique.tolist()], dtype=np.float64)
+    return rows[inverse]
+
+
+class StepLRTable:
+    """
+    Applies a precomputed table of param group values, one row per optimizer update.
+    Call step_update(num_updates) before every optimizer step, with num_updates the
+    number of optimizer updates done so far (not batches, under gradient accumulation).
+    """
+
+    def __init__(self, optimizer: torch.optim.Optimizer, table, param_group_field: str = 'lr') -> None:
+        table = np.asarray(table, dtype=np.float64)
+        if table.ndim != 2 or table.shape[1] != len(optimizer.param_groups):
+            raise ValueError(f"Expected a (num_updates, {len(optimizer.param_groups)}) table, got {table.shape}")
+        self.optimizer = optimizer
+        self.table = table
+        self.param_group_field = param_group_field
+        self.num_updates = 0
+        self.step_update(0)
+
+    def __len__(self):
+        return len(self.table)
+
+    def state_dict(self):
+        return {'num_updates': self.num_updates}
+
+    def load_state_dict(self, state_dict):
+        # the state of the epoch schedulers of older checkpoints has no update index,
+        # train() sets it from the epoch and step at the first update anyway
+        self.step_update(state_dict.get('num_updates', 0))
+
+    def step(self, epoch: int, metric: float = None) -> None:
+        pass
+
+    def step_update(self, num_updates: int, metric: float = None):
+        self.num_updates = num_updates
+        row = self.table[min(num_updates, len(self.table) - 1)].tolist()
+        for param_group, value in zip(self.optimizer.param_groups, row):
+            param_group[self.param_group_field] = value
@@ -0,0 +1,8 @@
+python -m benchmarks.ddp \
+--world_sizes 1,2,4 \
+--comm_hooks none,fp16,powersgd \
+--bucket_cap_mb 25 \
+--batch_size 4 \
+--image_res 256 \
+--iters 5 \
+--output results/benchmarks/ddp_report.json
@@ -0,0 +1,5 @@
+python -m benchmarks.optim \
+--layers 12 \
+--iters 5 \
+--num_threads 8 \
+--output results/benchmarks/optim_report.json
@@ -0,0 +1,7 @@
+python -m benchmarks.run \
+--device cpu \
+--batch_size 8 \
+--image_res 256 \
+--iters 10 \
+--num_threads 8 \
+--output results/benchmarks/report.json
@@ -0,0 +1,7 @@
+EXPID=your_best_model_dir_name
+
+python export.py \
+--config 'configs/test.yaml' \
+--checkpoint results/${EXPID}/checkpoint_best \
+--output_dir results/${EXPID}/export \
+--format torchscript,onnx \
@@ -0,0 +1,8 @@
+EXPID=your_best_model_dir_name
+
+python infer_cpu.py \
+--config 'configs/test.yaml' \
+--checkpoint results/${EXPID}/checkpoint_best \
+--output_dir results/${EXPID}/cpu_int8 \
+--num_samples 2000 \
+--batch_sizes 1,8,32 \
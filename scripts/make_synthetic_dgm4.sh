@@ -0,0 +1,10 @@
+python -m dataset.synthetic \
+--root ../../datasets_synthetic \
+--num_train 200000 \
+--num_val 10000 \
+--num_test 10000 \
+--num_images 20000 \
+--image_size 256 640 \
+--words_mean 18 \
+--words_std 6 \
+--workers 16
@@ -0,0 +1,19 @@
+EXPID=$(date +"%Y%m%d_%H%M%S")
+
+NUM_NODES=1
+NUM_GPU=8
+torchrun \
+--nnodes ${NUM_NODES} \
+--nproc_per_node $NUM_GPU \
+--rdzv_backend c10d \
+--rdzv_endpoint ${MASTER_ADDR:-127.0.0.1}:29500 \
+--rdzv_id ${EXPID} \
+--max_restarts 3 \
+train.py \
+--config 'configs/train.yaml' \
+--output_dir 'results' \
+--checkpoint 'ALBEF_4M.pth' \
+--log_num ${EXPID} \
+--token_momentum \
+--model_save_epoch 100 \
+--checkpoint_steps 1000
@@ -32,18 +32,17 @@ import torch.multiprocessing as mp
 from torch.utils.tensorboard import SummaryWriter
 import logging
 from types import MethodType
-from tools.env import init_dist
+from tools.env import LAUNCHERS, init_dist
+from tools.ddp import wrap_model
 from tqdm import tqdm
 
-from sklearn.metrics import roc_auc_score
-from sklearn.metrics import roc_curve
-from scipy.optimize import brentq
-from scipy.interpolate import interp1d
-
 from models import box_ops
-from tools.multilabel_metrics import AveragePrecisionMeter, get_multi_label
+from tools.multilabel_metrics import AveragePrecisionMeter, get_multi_label_from_ids
+from tools.breakdown_metrics import BreakdownMeter, format_breakdown_table, write_breakdown
 
 from models.HAMMER import HAMMER
+from models.builder import build_hammer
+from tools.checkpoint import resolve_checkpoint
 
 def setlogger(log_file):
     filehandler = logging.FileHandler(log_file)
@@ -113,7 +112,11 @@ def evaluation(args, model, data_loader, tokenizer, device, config):
     print('Computing features for evaluation...')
     print_freq = 200 
 
-    y_true, y_pred, IOU_pred, IOU_50, IOU_75, IOU_95 = [], [], [], [], [], []
+    # every metric bucketed by manipulation type, also used for the global AUC / EER
+    breakdown_meter = BreakdownMeter(roc_num_bins=config.get('roc_num_bins', None))
+    IOU_sum = torch.zeros((), dtype=torch.float64, device=device)
+    IOU_acc_all = torch.zeros(3, dtype=torch.long, device=device)
+    IOU_nums_all = 0
     cls_nums_all = 0
     cls_acc_all = 0   
 
@@ -134,6 +137,7 @@ def evaluation(args, model, data_loader, tokenizer, device, config):
     for i, (image, label, text, fake_image_box, fake_word_pos, W, H) in enumerate(metric_logger.log_every(args, data_loader, print_freq, header)):
         
         image = image.to(device,non_blocking=True) 
+        label = label.to(device,non_blocking=True) 
         
         text_input = tokenizer(text, max_length=128, truncation=True, add_special_tokens=True, return_attention_mask=True, return_token_type_ids=False) 
         
@@ -142,20 +146,16 @@ def evaluation(args, model, data_loader, tokenizer, device, config):
         logits_real_fake, logits_multicls, output_coord, logits_tok = model(image, label, text_input, fake_image_box, fake_token_pos, is_train=False)
 
         ##================= real/fake cls ========================## 
-        cls_label = torch.ones(len(label), dtype=torch.long).to(image.device) 
-        real_label_pos = np.where(np.array(label) == 'orig')[0].tolist()
-        cls_label[real_label_pos] = 0
-
-        y_pred.extend(F.softmax(logits_real_fake,dim=1)[:,1].cpu().flatten().tolist())
-        y_true.extend(cls_label.cpu().flatten().tolist())
+        target, real_label_mask = get_multi_label_from_ids(label, image.device)
+        cls_label = (~real_label_mask).long()
 
         pred_acc = logits_real_fake.argmax(1)
         cls_nums_all += cls_label.shape[0]
         cls_acc_all += torch.sum(pred_acc == cls_label).item()
 
         # ----- multi metrics -----
-        target, _ = get_multi_label(label, image)
         multi_label_meter.add(logits_multicls, target)
+        logits_multicls_raw = logits_multicls.clone() # binarized in place below
         
         for cls_idx in range(logits_multicls.shape[1]):
             cls_pred = logits_multicls[:, cls_idx]
@@ -173,19 +173,9 @@ def evaluation(args, model, data_loader, tokenizer, device, config):
 
         IOU, _ = box_ops.box_iou(boxes1, boxes2.to(device), test=True)
 
-        IOU_pred.extend(IOU.cpu().tolist())
-
-        IOU_50_bt = torch.zeros(IOU.shape, dtype=torch.long)
-        IOU_75_bt = torch.zeros(IOU.shape, dtype=torch.long)
-        IOU_95_bt = torch.zeros(IOU.shape, dtype=torch.long)
-
-        IOU_50_bt[IOU>0.5] = 1
-        IOU_75_bt[IOU>0.75] = 1
-        IOU_95_bt[IOU>0.95] = 1
-
-        IOU_50.extend(IOU_50_bt.cpu().tolist())
-        IOU_75.extend(IOU_75_bt.cpu().tolist())
-        IOU_95.extend(IOU_95_bt.cpu().tolist())
+        IOU_sum += IOU.double().sum()
+        IOU_acc_all += box_ops.iou_accuracy(IOU, thresholds=(0.5, 0.75, 0.95))
+        IOU_nums_all += IOU.shape[0]
 
         ##================= token cls ========================##  
         token_label = text_input.attention_mask[:,1:].clone() # [:,1:] for ingoring class token
@@ -207,19 +197,22 @@ def evaluation(args, model, data_loader, tokenizer, device, config):
         TN_all += torch.sum((token_label_reshape == 0) * (logits_tok_pred == 0)).item()
         FP_all += torch.sum((token_label_reshape == 0) * (logits_tok_pred == 1)).item()
         FN_all += torch.sum((token_label_reshape == 1) * (logits_tok_pred == 0)).item()
+
+        ##================= per manipulation type ========================##
+        breakdown_meter.add(label, F.softmax(logits_real_fake,dim=1)[:,1], pred_acc == cls_label,
+                            logits_multicls_raw, target, IOU,
+                            token_label, logits_tok_pred.view(token_label.shape))
                  
     ##================= real/fake cls ========================## 
-    y_true, y_pred = np.array(y_true), np.array(y_pred)
-    AUC_cls = roc_auc_score(y_true, y_pred)
+    breakdown = breakdown_meter.compute()
+    roc_cls = breakdown[0] # 'all' bucket
+    AUC_cls = roc_cls['AUC_cls']
     ACC_cls = cls_acc_all / cls_nums_all
-    fpr, tpr, thresholds = roc_curve(y_true, y_pred, pos_label=1)
-    EER_cls = brentq(lambda x: 1. - x - interp1d(fpr, tpr)(x), 0., 1.)
+    EER_cls = roc_cls['EER_cls']
     
     ##================= bbox cls ========================##
-    IOU_score = sum(IOU_pred)/len(IOU_pred)
-    IOU_ACC_50 = sum(IOU_50)/len(IOU_50)
-    IOU_ACC_75 = sum(IOU_75)/len(IOU_75)
-    IOU_ACC_95 = sum(IOU_95)/len(IOU_95)
+    IOU_score = IOU_sum.item()/IOU_nums_all
+    IOU_ACC_50, IOU_ACC_75, IOU_ACC_95 = (IOU_acc_all.double()/IOU_nums_all).tolist()
     # ##================= token cls========================##
     ACC_tok = (TP_all + TN_all) / (TP_all + TN_all + FP_all + FN_all)
     Precision_tok = TP_all / (TP_all + FP_all)
@@ -237,7 +230,8 @@ def evaluation(args, model, data_loader, tokenizer, device, config):
     return AUC_cls, ACC_cls, EER_cls, \
         MAP.item(), OP, OR, OF1, CP, CR, CF1, F1_multicls, \
         IOU_score, IOU_ACC_50, IOU_ACC_75, IOU_ACC_95, \
-        ACC_tok, Precision_tok, Recall_tok, F1_tok
+        ACC_tok, Precision_tok, Recall_tok, F1_tok, \
+        breakdown
     
 def main_worker(gpu, args, config):
 
@@ -276,24 +270,12 @@ def main_worker(gpu, args, config):
     tokenizer = BertTokenizerFast.from_pretrained(args.text_encoder)
     if args.log:
         print(f"Creating MAMMER")
-    model = HAMMER(args=args, config=config, text_encoder=args.text_encoder, tokenizer=tokenizer, init_deit=True)
-    
+    checkpoint_dir = resolve_checkpoint(f'{args.output_dir}/{args.log_num}/checkpoint_{args.test_epoch}')
+    # modules are materialized directly from the checkpoint, no DeiT / BERT download,
+    # the momentum encoders and the optimizer state are not read
+    model = build_hammer(args, config, args.text_encoder, tokenizer, checkpoint=checkpoint_dir, skip_momentum=True, log=args.log)
     model = model.to(device)   
 
-    checkpoint_dir = f'{args.output_dir}/{args.log_num}/checkpoint_{args.test_epoch}.pth'
-    checkpoint = torch.load(checkpoint_dir, map_location='cpu') 
-    state_dict = checkpoint['model']                       
-
-    pos_embed_reshaped = interpolate_pos_embed(state_dict['visual_encoder.pos_embed'],model.visual_encoder)   
-    state_dict['visual_encoder.pos_embed'] = pos_embed_reshaped       
-                   
-    # model.load_state_dict(state_dict)  
-    if args.log:
-        print('load checkpoint from %s'%checkpoint_dir)  
-    msg = model.load_state_dict(state_dict, strict=False)
-    if args.log:
-        print(msg)  
-
     #### Dataset #### 
     if args.log:
         print("Creating dataset")
@@ -314,7 +296,7 @@ def main_worker(gpu, args, config):
     
     model_without_ddp = model
     if args.distributed:
-        model = torch.nn.parallel.DistributedDataParallel(model, device_ids=[args.gpu], find_unused_parameters=True)
+        model = wrap_model(model, device_ids=[args.gpu] if args.device.startswith('cuda') else None)
         model_without_ddp = model.module
 
     if args.log:
@@ -323,7 +305,8 @@ def main_worker(gpu, args, config):
     AUC_cls, ACC_cls, EER_cls, \
     MAP, OP, OR, OF1, CP, CR, CF1, F1_multicls, \
     IOU_score, IOU_ACC_50, IOU_ACC_75, IOU_ACC_95, \
-    ACC_tok, Precision_tok, Recall_tok, F1_tok  = evaluation(args, model_without_ddp, val_loader, tokenizer, device, config)
+    ACC_tok, Precision_tok, Recall_tok, F1_tok, \
+    breakdown = evaluation(args, model_without_ddp, val_loader, tokenizer, device, config)
     #============ evaluation info ============#
     val_stats = {"AUC_cls": "{:.4f}".format(AUC_cls*100),
                     "ACC_cls": "{:.4f}".format(ACC_cls*100),
@@ -356,6 +339,12 @@ def main_worker(gpu, args, config):
         with open(os.path.join(log_dir, f"results_{eval_type}.txt"),"a") as f:
             f.write(json.dumps(log_stats) + "\n")
 
+        #============ per manipulation type ============#
+        print(format_breakdown_table(breakdown))
+        write_breakdown(breakdown, 
+                        os.path.join(log_dir, f"results_{eval_type}_breakdown_{args.test_epoch}.json"),
+                        os.path.join(log_dir, f"results_{eval_type}_breakdown_{args.test_epoch}.csv"))
+
  
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -375,10 +364,10 @@ if __name__ == '__main__':
                         help='world size for distributed training')
     parser.add_argument('--dist-url', default='tcp://127.0.0.1:23451', type=str,
                         help='url used to set up distributed training')
-    parser.add_argument('--dist-backend', default='nccl', type=str,
-                        help='distributed backend')
-    parser.add_argument('--launcher', choices=['none', 'pytorch', 'slurm', 'mpi'], default='none',
-                        help='job launcher')
+    parser.add_argument('--dist-backend', default='auto', type=str,
+                        help='distributed backend, auto: nccl on GPU, gloo on CPU')
+    parser.add_argument('--launcher', choices=LAUNCHERS, default='none',
+                        help='job launcher, see tools/env.py')
     parser.add_argument('--log_num', '-l', type=str)
     parser.add_argument('--model_save_epoch', type=int, default=5)
     parser.add_argument('--token_momentum', default=False, action='store_true')
@@ -0,0 +1,79 @@
+"""
+Helpers of the tests: process groups of CPU processes with the gloo backend, and a
+small randomly initialized HAMMER (the full ViT, a 2 layer BERT fused from layer 1,
+64x64 images and a short queue) with synthetic batches.
+"""
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+
+import ruamel.yaml as yaml
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _worker(rank, world_size, init_file, fn, args):
+    torch.set_num_threads(1)
+    dist.init_process_group('gloo', init_method='file://' + init_file, rank=rank, world_size=world_size)
+    try:
+        fn(rank, world_size, *args)
+    finally:
+        dist.destroy_process_group()
+
+
+def run_distributed(fn, world_size, *args):
+    """
+    Runs fn(rank, world_size, *args) in world_size processes of a gloo group, fn must
+    be a module level function. An exception in any process is raised here.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mp.spawn(_worker, nprocs=world_size, args=(world_size, os.path.join(tmp_dir, 'process_group'), fn, args))
+
+
+def small_config(tmp_dir, queue_size=72):
+    config = yaml.load(open(os.path.join(ROOT, 'configs/train.yaml'), 'r'), Loader=yaml.Loader)
+    with open(os.path.join(ROOT, 'configs/config_bert.json'), 'r') as f:
+        bert_config = json.load(f)
+    bert_config.update(num_hidden_layers=2, fusion_layer=1, intermediate_size=512)
+    config['bert_config'] = os.path.join(tmp_dir, 'config_bert.json')
+    with open(config['bert_config'], 'w') as f:
+        json.dump(bert_config, f)
+    config.update(image_res=64, queue_size=queue_size)
+    return config
+
+
+def small_setup(tmp_dir, **kwargs):
+    """config and WordPiece tokenizer of the small HAMMER, their files are written to tmp_dir"""
+    from benchmarks.run import make_tokenizer
+    os.makedirs(tmp_dir, exist_ok=True)
+    return small_config(tmp_dir, **kwargs), make_tokenizer(tmp_dir)
+
+
+def small_hammer(config, tokenizer, token_momentum=False, seed=0):
+    from models.HAMMER import HAMMER
+    torch.manual_seed(seed)
+    return HAMMER(args=SimpleNamespace(token_momentum=token_momentum), config=config, tokenizer=tokenizer,
+                  init_deit=False, init_bert=False)
+
+
+def make_batch(tokenizer, config, batch_size, seed=0):
+    """image, label (all nine classes in turn), text, fake_image_box, fake_token_pos of train.py"""
+    import numpy as np
+    from benchmarks.run import make_captions
+    from train import text_input_adjust
+    rng = np.random.RandomState(seed)
+    g = torch.Generator().manual_seed(seed)
+    fake_word_pos = torch.zeros(batch_size, config['max_words'])
+    fake_word_pos[:, 1:4] = 1
+    text_input = tokenizer(make_captions(rng, batch_size), max_length=128, truncation=True, add_special_tokens=True,
+                           return_attention_mask=True, return_token_type_ids=False)
+    text, fake_token_pos = text_input_adjust(text_input, fake_word_pos, 'cpu')
+    image = torch.randn(batch_size, 3, config['image_res'], config['image_res'], generator=g)
+    label = torch.arange(batch_size) % 9
+    fake_image_box = torch.tensor([[0.5, 0.5, 0.3, 0.3]]).repeat(batch_size, 1)
+    return SimpleNamespace(image=image, label=label, text=text, fake_image_box=fake_image_box,
+                           fake_token_pos=fake_token_pos)
@@ -0,0 +1,52 @@
+"""BreakdownMeter and the breakdown files of test.py"""
+import csv
+import json
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from tools.breakdown_metrics import BREAKDOWN_METRICS, BreakdownMeter, write_breakdown
+from tools.multilabel_metrics import get_multi_label_from_ids
+
+
+def make_meter(num_batches=3, batch_size=18, seq_len=12):
+    meter = BreakdownMeter()
+    g = torch.Generator().manual_seed(0)
+    for b in range(num_batches):
+        label = (torch.arange(batch_size) + b * batch_size) % 9
+        cls_score = torch.rand(batch_size, generator=g)
+        multicls_target, _ = get_multi_label_from_ids(label, 'cpu')
+        token_label = torch.randint(0, 2, (batch_size, seq_len), generator=g)
+        token_label[:, -2:] = -100
+        meter.add(label, cls_score, (cls_score > 0.5) == (label != 0), torch.randn(batch_size, 4, generator=g),
+                  multicls_target, torch.rand(batch_size, generator=g), token_label,
+                  torch.randint(0, 2, (batch_size, seq_len), generator=g))
+    return meter
+
+
+def test_write_breakdown_strict_json(tmp_path):
+    rows = make_meter().compute()
+    orig = [row for row in rows if row['type'] == 'orig'][0]
+    # a single class, no AUC
+    assert orig['AUC_cls'] != orig['AUC_cls']
+
+    json_file, csv_file = str(tmp_path / 'breakdown.json'), str(tmp_path / 'breakdown.csv')
+    write_breakdown(rows, json_file, csv_file)
+
+    def reject(constant):
+        raise ValueError('non strict json constant %s' % constant)
+    with open(json_file, 'r') as f:
+        out_rows = json.load(f, parse_constant=reject)
+    assert [row['type'] for row in out_rows] == [row['type'] for row in rows]
+    out_orig = [row for row in out_rows if row['type'] == 'orig'][0]
+    assert out_orig['AUC_cls'] is None and out_orig['EER_cls'] is None
+    assert all(out_rows[0][m] is not None for m in BREAKDOWN_METRICS)
+    with open(csv_file, 'r', newline='') as f:
+        assert [row['AUC_cls'] for row in csv.DictReader(f) if row['type'] == 'orig'] == ['']
+
+
+def test_records_on_cpu():
+    meter = make_meter()
+    assert all(t.device.type == 'cpu' for v in meter.records.values() for t in v)
+    assert [row['num'] for row in meter.compute()][0] == 3 * 18
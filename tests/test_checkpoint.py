@@ -0,0 +1,43 @@
+"""save_checkpoint replacing an existing checkpoint directory, and resolve_checkpoint after an interrupted save"""
+import os
+import shutil
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from tools.checkpoint import load_model_state_dict, load_training_state, resolve_checkpoint, save_checkpoint
+
+
+def save_obj(value):
+    return {'model': {'w': torch.full((4,), float(value))}, 'epoch': value}
+
+
+def test_replace(tmp_path):
+    path = str(tmp_path / 'checkpoint_last')
+    save_checkpoint(save_obj(1), path)
+    save_checkpoint(save_obj(2), path)
+    assert sorted(os.listdir(str(tmp_path))) == ['checkpoint_last']
+    assert resolve_checkpoint(path) == path
+    assert load_training_state(path)['epoch'] == 2
+    assert torch.equal(load_model_state_dict(path, mmap=False)['w'], torch.full((4,), 2.))
+
+
+def test_resolve_interrupted_save(tmp_path):
+    path = str(tmp_path / 'checkpoint_last')
+    save_checkpoint(save_obj(1), path)
+    save_checkpoint(save_obj(2), path + '.tmp_new')
+    # interrupted between moving the previous checkpoint aside and renaming the new one
+    os.replace(path, path + '.old')
+    assert resolve_checkpoint(path) == path + '.old'
+    os.replace(path + '.tmp_new', path + '.tmp')
+    assert resolve_checkpoint(path) == path + '.tmp'
+    assert load_training_state(resolve_checkpoint(path))['epoch'] == 2
+    # an incomplete new checkpoint is not used
+    os.remove(os.path.join(path + '.tmp', 'training_state.pth'))
+    assert resolve_checkpoint(path) == path + '.old'
+    # the next save cleans up
+    save_checkpoint(save_obj(3), path)
+    assert sorted(os.listdir(str(tmp_path))) == ['checkpoint_last']
+    shutil.rmtree(path)
+    assert resolve_checkpoint(path) == path + '.pth'
@@ -0,0 +1,54 @@
+"""tools/ddp.wrap_model against DDP with find_unused_parameters, on gloo CPU processes"""
+import os
+
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('transformers')
+
+from torch.nn.parallel import DistributedDataParallel
+
+from tests.helpers import make_batch, run_distributed, small_hammer, small_setup
+
+BATCH_SIZE = 9
+
+
+def loss_of(model, batch):
+    return sum(model(batch.image, batch.label, batch.text, batch.fake_image_box, batch.fake_token_pos, alpha=0.4))
+
+
+def _compare_worker(rank, world_size, tmp_dir, static_graph):
+    from tools.ddp import wrap_model
+    config, tokenizer = small_setup(os.path.join(tmp_dir, 'rank%d' % rank))
+    batch = make_batch(tokenizer, config, BATCH_SIZE, seed=rank)
+    models = [wrap_model(small_hammer(config, tokenizer), static_graph=static_graph),
+              DistributedDataParallel(small_hammer(config, tokenizer), find_unused_parameters=True)]
+    for step in range(3):
+        grads = []
+        for model in models:
+            model.train()
+            model.zero_grad(set_to_none=True)
+            # same dropout in both models
+            torch.manual_seed(100 * step + rank)
+            loss_of(model, batch).backward()
+            grads.append({n: p.grad for n, p in model.module.named_parameters() if p.grad is not None})
+        assert grads[0].keys() == grads[1].keys()
+        for n, grad in grads[1].items():
+            torch.testing.assert_close(grads[0][n], grad, rtol=1e-5, atol=1e-7, msg=lambda m: '%s: %s' % (n, m))
+
+
+@pytest.mark.parametrize('static_graph', [False, True])
+def test_wrap_model_matches_find_unused_parameters(tmp_path, static_graph):
+    run_distributed(_compare_worker, 2, str(tmp_path), static_graph)
+
+
+@pytest.mark.parametrize('token_momentum', [False, True])
+def test_ddp_unused_parameters(tmp_path, token_momentum):
+    """the declared unused parameters are exactly the trainable ones without gradient"""
+    config, tokenizer = small_setup(str(tmp_path))
+    model = small_hammer(config, tokenizer, token_momentum=token_momentum)
+    model.train()
+    loss_of(model, make_batch(tokenizer, config, BATCH_SIZE)).backward()
+    unused = {n for n, p in model.named_parameters() if p.requires_grad and p.grad is None}
+    assert unused == set(model.ddp_unused_parameters())
+    assert len(unused) == 36
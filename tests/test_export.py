@@ -0,0 +1,60 @@
+"""HAMMERInference eager, TorchScript and ONNX (export.py) against HAMMER.forward(is_train=False)"""
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('transformers')
+
+from export import INPUT_NAMES, OUTPUT_NAMES, example_inputs, export_onnx, export_torchscript
+from models.HAMMER import HAMMERInference
+from tests.helpers import small_hammer, small_setup
+
+ATOL = 1e-4
+
+
+@pytest.fixture(scope='module')
+def setup(tmp_path_factory):
+    config, tokenizer = small_setup(str(tmp_path_factory.mktemp('hammer')))
+    model = small_hammer(config, tokenizer).eval()
+    inference = HAMMERInference(model).eval()
+    # the MultiheadAttention with an onnx_trace flag of the REC transformers is not on the inference path
+    assert not any(hasattr(m, 'prepare_for_onnx_export_') for m in inference.modules())
+    inputs = example_inputs(tokenizer, config, 2, 32)
+    # another batch size and sequence length for the dynamic shapes
+    check_inputs = [example_inputs(tokenizer, config, 3, 16, seed=1)]
+    with torch.no_grad():
+        references = [model(image, None, SimpleNamespace(input_ids=input_ids, attention_mask=attention_mask),
+                            None, None, is_train=False)
+                      for image, input_ids, attention_mask in [inputs] + check_inputs]
+    return SimpleNamespace(inference=inference, inputs=inputs, check_inputs=check_inputs, references=references)
+
+
+def assert_outputs_close(outputs, references, atol):
+    assert len(outputs) == len(OUTPUT_NAMES)
+    for name, out, ref in zip(OUTPUT_NAMES, outputs, references):
+        torch.testing.assert_close(out, ref, rtol=0, atol=atol, msg=lambda m: '%s: %s' % (name, m))
+
+
+def test_eager(setup):
+    with torch.no_grad():
+        for x, references in zip([setup.inputs] + setup.check_inputs, setup.references):
+            assert_outputs_close(setup.inference(*x), references, atol=0)
+
+
+def test_torchscript(setup, tmp_path):
+    loaded = export_torchscript(setup.inference, setup.inputs, setup.check_inputs,
+                                str(tmp_path / 'HAMMER.torchscript.pt'), ATOL)
+    with torch.no_grad():
+        for x, references in zip([setup.inputs] + setup.check_inputs, setup.references):
+            assert_outputs_close(loaded(*x), references, ATOL)
+
+
+def test_onnx(setup, tmp_path):
+    onnxruntime = pytest.importorskip('onnxruntime')
+    output_file = str(tmp_path / 'HAMMER.onnx')
+    export_onnx(setup.inference, setup.inputs, setup.check_inputs, output_file, 14, ATOL)
+    session = onnxruntime.InferenceSession(output_file, providers=['CPUExecutionProvider'])
+    for x, references in zip([setup.inputs] + setup.check_inputs, setup.references):
+        outputs = session.run(OUTPUT_NAMES, {name: t.numpy() for name, t in zip(INPUT_NAMES, x)})
+        assert_outputs_close([torch.from_numpy(o) for o in outputs], references, ATOL)
@@ -0,0 +1,51 @@
+"""FeatureGather of models/HAMMER.py against separate all_gather calls, on gloo CPU processes"""
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import torch.distributed as dist
+
+from tests.helpers import run_distributed
+
+
+def all_gather(tensor):
+    out = [torch.empty_like(tensor) for _ in range(dist.get_world_size())]
+    dist.all_gather(out, tensor)
+    return torch.cat(out)
+
+
+def _gather_worker(rank, world_size):
+    from models.HAMMER import FeatureGather, concat_all_gather
+    gather = FeatureGather()
+    buffers = set()
+    for step in range(3):
+        g = torch.Generator().manual_seed(10 * step + rank)
+        image_feat, text_feat = torch.randn(4, 8, generator=g), torch.randn(4, 16, generator=g)
+        image_feats, text_feats = gather.start(image_feat, text_feat).wait()
+        assert image_feats.shape == (4 * world_size, 8) and text_feats.shape == (4 * world_size, 16)
+        assert torch.equal(image_feats, all_gather(image_feat))
+        assert torch.equal(text_feats, all_gather(text_feat))
+        assert torch.equal(image_feats[4 * rank:4 * (rank + 1)], image_feat)
+        assert torch.equal(concat_all_gather(text_feat), all_gather(text_feat))
+        buffers.add((gather._send.data_ptr(), gather._recv.data_ptr()))
+    # the same buffers at every step
+    assert len(buffers) == 1
+
+    # a start() without wait(), as left by an interrupted forward, is completed by the next one
+    gather.start(image_feat, text_feat)
+    image_feats, = gather.start(image_feat).wait()
+    assert torch.equal(image_feats, all_gather(image_feat))
+    # new shapes, new buffers
+    assert gather._recv.shape == (world_size, 4, 8)
+
+
+def test_feature_gather():
+    run_distributed(_gather_worker, 3)
+
+
+def test_feature_gather_single_process():
+    from models.HAMMER import FeatureGather, concat_all_gather
+    image_feat, text_feat = torch.randn(4, 8), torch.randn(4, 16)
+    image_feats, text_feats = FeatureGather().start(image_feat, text_feat).wait()
+    assert image_feats is image_feat and text_feats is text_feat
+    assert concat_all_gather(image_feat) is image_feat
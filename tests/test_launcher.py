@@ -0,0 +1,81 @@
+"""an epoch of train.train() in two CPU processes started as by torchrun, through tools.env.init_dist"""
+import argparse
+import os
+import socket
+
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('transformers')
+
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from tests.helpers import small_hammer, small_setup
+
+WORLD_SIZE = 2
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _train_worker(rank, port, tmp_dir, ann_files):
+    import train
+    import utils
+    from dataset import create_dataset, create_loader
+    from dataset.sampler import ResumableSampler, SeededDataset
+    from optim import create_optimizer
+    from scheduler import create_step_scheduler
+    from tools.ddp import add_ddp_args, wrap_model_from_args
+    from tools.env import init_dist
+
+    torch.set_num_threads(1)
+    os.environ.update(RANK=str(rank), WORLD_SIZE=str(WORLD_SIZE), LOCAL_RANK=str(rank),
+                      MASTER_ADDR='127.0.0.1', MASTER_PORT=str(port))
+    parser = argparse.ArgumentParser()
+    add_ddp_args(parser)
+    args = parser.parse_args([])
+    args.__dict__.update(launcher='none', device='cpu', dist_backend='auto', seed=0, checkpoint_steps=0)
+    # the torchrun environment is picked up without --launcher torchrun
+    init_dist(args)
+    assert args.distributed and dist.get_backend() == 'gloo'
+    assert (args.rank, args.world_size, args.restart_count) == (rank, WORLD_SIZE, 0)
+
+    config, tokenizer = small_setup(os.path.join(tmp_dir, 'rank%d' % rank))
+    config.update(root_dir=os.path.join(tmp_dir, 'dgm4'), train_file=[ann_files['train']],
+                  val_file=[ann_files['val']], batch_size_train=2)
+    train_dataset = SeededDataset(create_dataset(config)[0])
+    sampler = ResumableSampler(train_dataset, args.world_size, args.rank, shuffle=True, seed=args.seed)
+    train_loader, = create_loader([train_dataset], [sampler], batch_size=[config['batch_size_train']],
+                                  num_workers=[0], is_trains=[True], collate_fns=[None])
+
+    model = small_hammer(config, tokenizer)
+    optimizer = create_optimizer(utils.AttrDict(config['optimizer']), model)
+    scheduler = create_step_scheduler(utils.AttrDict(config['schedular']), optimizer, len(train_loader),
+                                      lr=config['optimizer']['lr'])
+    model = wrap_model_from_args(model, args)
+    summary_writer = None
+    if args.log:
+        from torch.utils.tensorboard import SummaryWriter
+        summary_writer = SummaryWriter(os.path.join(tmp_dir, 'log'))
+    stats = train.train(args, model, train_loader, optimizer, tokenizer, 0, torch.device('cpu'), scheduler, config,
+                        summary_writer)
+
+    # the averaged stats and the weights are the same on both ranks
+    all_stats = [None] * WORLD_SIZE
+    dist.all_gather_object(all_stats, stats)
+    assert all_stats[0] == all_stats[1]
+    for p in model.module.parameters():
+        reference = p.detach().clone()
+        dist.broadcast(reference, 0)
+        assert torch.equal(p.detach(), reference)
+    dist.destroy_process_group()
+
+
+def test_train_epoch_torchrun_gloo(tmp_path):
+    from dataset.synthetic import generate
+    ann_files = generate(str(tmp_path / 'dgm4'), {'train': 8, 'val': 4}, size_range=(64, 96))
+    mp.spawn(_train_worker, nprocs=WORLD_SIZE, args=(_free_port(), str(tmp_path), ann_files))
@@ -0,0 +1,24 @@
+"""opt_foreach reaches the optimizers of torch.optim and of optim/"""
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from optim import create_optimizer
+from utils import AttrDict
+
+
+@pytest.mark.parametrize('opt', ['adamw', 'adam', 'sgd', 'momentum', 'adadelta', 'rmsprop', 'nadam', 'radam'])
+@pytest.mark.parametrize('foreach', [True, False])
+def test_opt_foreach(opt, foreach):
+    model = torch.nn.Sequential(torch.nn.Linear(4, 4), torch.nn.LayerNorm(4))
+    args = AttrDict(opt=opt, lr=1e-3, weight_decay=0.02, momentum=0.9, opt_foreach=foreach)
+    optimizer = create_optimizer(args, model)
+    assert all(group['foreach'] is foreach for group in optimizer.param_groups)
+
+
+@pytest.mark.parametrize('opt', ['adahessian', 'lookahead_adamw'])
+def test_opt_shard_state_unsupported(opt):
+    model = torch.nn.Linear(4, 4)
+    args = AttrDict(opt=opt, lr=1e-3, weight_decay=0.02, opt_shard_state=True)
+    with pytest.raises(AssertionError, match='opt_shard_state does not support'):
+        create_optimizer(args, model)
@@ -0,0 +1,26 @@
+"""trace_steps of StepProfiler"""
+import os
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from tools.profiler import StepProfiler
+
+
+@pytest.mark.parametrize('trace_steps', [(0, 2), (3, 3), (4, 2)])
+def test_invalid_trace_steps(trace_steps):
+    with pytest.raises(ValueError):
+        StepProfiler(use_cuda=False, trace_steps=trace_steps)
+
+
+def test_trace_steps(tmp_path):
+    profiler = StepProfiler(window=2, use_cuda=False, trace_steps=(1, 3), trace_dir=str(tmp_path))
+    traced = []
+    for _ in range(5):
+        traced.append(profiler._trace is not None)
+        with profiler.region('forward'):
+            torch.ones(8).sum()
+        profiler.step()
+    assert traced == [False, True, True, False, False]
+    assert os.listdir(str(tmp_path)) == ['trace_steps1-3_rank0.json']
@@ -0,0 +1,107 @@
+"""ShardedOptimizer (optim/zero.py) against a regular AdamW, on gloo CPU processes"""
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from optim import ShardedOptimizer, gather_optimizer_state, load_optimizer_state
+from optim.zero import merge_shards
+from tests.helpers import run_distributed
+
+STEPS = 4
+
+
+def make_model():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(torch.nn.Linear(8, 32), torch.nn.LayerNorm(32), torch.nn.GELU(),
+                               torch.nn.Linear(32, 32), torch.nn.Linear(32, 4))
+
+
+def make_optimizer(model):
+    decay = [p for p in model.parameters() if p.dim() > 1]
+    no_decay = [p for p in model.parameters() if p.dim() <= 1]
+    return torch.optim.AdamW([{'params': decay, 'weight_decay': 0.05},
+                              {'params': no_decay, 'weight_decay': 0., 'lr': 2e-2}], lr=1e-2, foreach=False)
+
+
+def train(model, optimizer, first_step, last_step):
+    """the same batches and gradients on every rank, as after the all-reduce of DDP"""
+    for step in range(first_step, last_step):
+        g = torch.Generator().manual_seed(step)
+        x, y = torch.randn(16, 8, generator=g), torch.randn(16, 4, generator=g)
+        optimizer.zero_grad(set_to_none=True)
+        torch.nn.functional.mse_loss(model(x), y).backward()
+        optimizer.step()
+        # as a scheduler does, on the full param groups
+        for group in optimizer.param_groups:
+            group['lr'] *= 0.9
+
+
+def run(sharded, first_step, last_step, load_file=None):
+    model = make_model()
+    optimizer = make_optimizer(model)
+    if sharded:
+        optimizer = ShardedOptimizer(optimizer)
+    if load_file is not None:
+        checkpoint = torch.load(load_file)
+        model.load_state_dict(checkpoint['model'])
+        load_optimizer_state(optimizer, checkpoint['optimizer'])
+    train(model, optimizer, first_step, last_step)
+    return model, gather_optimizer_state(optimizer)
+
+
+def _sharded_worker(rank, world_size, first_step, last_step, load_file, save_file):
+    model, optimizer_state = run(True, first_step, last_step, load_file)
+    if rank == 0:
+        torch.save({'model': model.state_dict(), 'optimizer': optimizer_state}, save_file)
+
+
+def run_and_save(world_size, first_step, last_step, save_file, load_file=None):
+    """world_size 0: a regular AdamW in this process, else a ShardedOptimizer over world_size processes"""
+    if world_size == 0:
+        model, optimizer_state = run(False, first_step, last_step, load_file)
+        torch.save({'model': model.state_dict(), 'optimizer': optimizer_state}, save_file)
+    else:
+        run_distributed(_sharded_worker, world_size, first_step, last_step, load_file, save_file)
+    return torch.load(save_file)
+
+
+def assert_same(checkpoint, reference):
+    for k, v in reference['model'].items():
+        assert torch.equal(checkpoint['model'][k], v), k
+    state, ref_state = merge_shards(checkpoint['optimizer'])['state'], reference['optimizer']['state']
+    assert sorted(state) == sorted(ref_state)
+    for i in ref_state:
+        for k, v in ref_state[i].items():
+            assert torch.equal(torch.as_tensor(state[i][k]), torch.as_tensor(v)), (i, k)
+    for group, ref_group in zip(checkpoint['optimizer']['param_groups'], reference['optimizer']['param_groups']):
+        assert group == ref_group
+
+
+@pytest.fixture(scope='module')
+def reference(tmp_path_factory):
+    return run_and_save(0, 0, STEPS, str(tmp_path_factory.mktemp('reference') / 'reference.pth'))
+
+
+def test_sharded_adamw_matches_adamw(reference, tmp_path):
+    checkpoint = run_and_save(2, 0, STEPS, str(tmp_path / 'sharded.pth'))
+    assert len(checkpoint['optimizer']['shards']) == 2
+    assert all(len(shard['state']) for shard in checkpoint['optimizer']['shards'])
+    assert_same(checkpoint, reference)
+
+
+@pytest.mark.parametrize('save_world_size,resume_world_size', [(2, 3), (2, 0), (0, 2)])
+def test_resume(reference, tmp_path, save_world_size, resume_world_size):
+    """half of the steps, then the rest from the checkpoint on another world size / optimizer"""
+    first_half = str(tmp_path / 'first_half.pth')
+    run_and_save(save_world_size, 0, STEPS // 2, first_half)
+    checkpoint = run_and_save(resume_world_size, STEPS // 2, STEPS, str(tmp_path / 'resumed.pth'), first_half)
+    assert_same(checkpoint, reference)
+
+
+def test_single_process_zero_grad():
+    model = make_model()
+    optimizer = ShardedOptimizer(make_optimizer(model))
+    train(model, optimizer, 0, 2)
+    optimizer.zero_grad()
+    assert all(p.grad is None or not p.grad.any() for p in model.parameters())
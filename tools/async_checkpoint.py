@@ -0,0 +1,119 @@
+"""
+Background checkpoint writer.
+
+save() copies the checkpoint into pinned CPU buffers and returns, the disk
+write runs on a worker thread through tools.checkpoint.save_checkpoint
+(written to a temporary path, then renamed). The pinned buffers are allocated
+once per slot and reused, max_pending bounds the number of snapshots held in
+memory: save() blocks until a slot is free. Numbered checkpoints
+(checkpoint_XX) beyond keep_last are deleted after each write.
+"""
+import os
+import queue
+import re
+import shutil
+import threading
+
+import torch
+
+from tools.checkpoint import save_checkpoint
+
+NUMBERED_CHECKPOINT = re.compile(r'^checkpoint_(\d+)(\.pth)?$')
+
+
+def _snapshot(obj, buffers, key=''):
+    """copy of obj with every tensor copied into buffers[key], a pinned CPU tensor reused across calls"""
+    if isinstance(obj, torch.Tensor):
+        buf = buffers.get(key)
+        if buf is None or buf.shape != obj.shape or buf.dtype != obj.dtype:
+            buf = torch.empty(obj.shape, dtype=obj.dtype, device='cpu',
+                              pin_memory=obj.is_cuda and torch.cuda.is_available())
+            buffers[key] = buf
+        buf.copy_(obj.detach(), non_blocking=obj.is_cuda)
+        return buf
+    if isinstance(obj, dict):
+        return {k: _snapshot(v, buffers, '%s/%s' % (key, k)) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_snapshot(v, buffers, '%s/%d' % (key, i)) for i, v in enumerate(obj))
+    return obj
+
+
+def remove_old_checkpoints(log_dir, keep_last):
+    """delete all but the keep_last highest numbered checkpoints of log_dir, checkpoint_best is kept"""
+    numbered = []
+    for name in os.listdir(log_dir):
+        match = NUMBERED_CHECKPOINT.match(name)
+        if match:
+            numbered.append((int(match.group(1)), name))
+    for _, name in sorted(numbered)[:-keep_last]:
+        path = os.path.join(log_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+class AsyncCheckpointWriter:
+    """
+    Args:
+        checkpoint_format: 'dir' or 'pth', see tools.checkpoint.save_checkpoint
+        keep_last: number of numbered checkpoints to keep, 0 keeps all
+        max_pending: number of snapshots waiting for or being written at the same time
+    """
+    def __init__(self, checkpoint_format='dir', keep_last=0, max_pending=1):
+        self.checkpoint_format = checkpoint_format
+        self.keep_last = keep_last
+        self.slots = [{} for _ in range(max(max_pending, 1))]
+        self.free_slots = queue.Queue()
+        for i in range(len(self.slots)):
+            self.free_slots.put(i)
+        self.jobs = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._worker, name='checkpoint-writer', daemon=True)
+        self.thread.start()
+
+    def save(self, save_obj, paths):
+        """snapshot save_obj and write it to each of paths (without .pth suffix) in the background"""
+        self._raise_error()
+        if isinstance(paths, str):
+            paths = [paths]
+        slot = self.free_slots.get()
+        snapshot = _snapshot(save_obj, self.slots[slot])
+        if torch.cuda.is_available():
+            # the non_blocking copies must be done before the worker reads the buffers
+            torch.cuda.current_stream().synchronize()
+        self.jobs.put((slot, snapshot, list(paths)))
+
+    def wait(self):
+        """block until every submitted checkpoint is on disk"""
+        self.jobs.join()
+        self._raise_error()
+
+    def close(self):
+        self.wait()
+        self.jobs.put(None)
+        self.thread.join()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('background checkpoint write failed') from error
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            slot, snapshot, paths = job
+            try:
+                for path in paths:
+                    save_checkpoint(snapshot, path, self.checkpoint_format)
+                    if self.keep_last > 0 and NUMBERED_CHECKPOINT.match(os.path.basename(path)):
+                        remove_old_checkpoints(os.path.dirname(path), self.keep_last)
+            except Exception as e:
+                self.error = e
+            finally:
+                del snapshot
+                self.free_slots.put(slot)
+                self.jobs.task_done()
@@ -0,0 +1,169 @@
+"""
+Per manipulation type breakdown of the evaluation metrics.
+
+Every evaluation batch is recorded once with its integer label ids (see
+tools.multilabel_metrics.MANIPULATION_CLASSES), the metrics of each
+manipulation type are then computed from the same pass. A type bucket holds
+the samples of that type plus all pristine (orig) samples, as a per-type test
+json would, so that AUC / EER stay defined.
+"""
+import csv
+import json
+import math
+
+import numpy as np
+import torch
+
+from tools.multilabel_metrics import AveragePrecisionMeter, MANIPULATION_CLASSES, MULTI_LABEL_TABLE, REAL_LABEL_ID
+from tools.roc_metrics import ROCMeter
+
+MULTI_LABEL_NAMES = ['face_swap', 'face_attribute', 'text_swap', 'text_attribute']
+
+BREAKDOWN_METRICS = ['AUC_cls', 'ACC_cls', 'EER_cls',
+                     'MAP', 'OP', 'OR', 'OF1', 'CP', 'CR', 'CF1',
+                     'IOU_score', 'IOU_ACC_50', 'IOU_ACC_75', 'IOU_ACC_95',
+                     'ACC_tok', 'Precision_tok', 'Recall_tok', 'F1_tok']
+
+
+def get_breakdown_buckets():
+    """
+    (name, label ids) of every bucket:
+        all: every sample
+        <fake_cls>: one manipulation type, e.g. face_swap&text_attribute (+ orig)
+        any_<manipulation>: every type containing it, e.g. any_face_swap (+ orig)
+    """
+    buckets = [('all', None), ('orig', [REAL_LABEL_ID])]
+    for label_id, name in enumerate(MANIPULATION_CLASSES):
+        if label_id != REAL_LABEL_ID:
+            buckets.append((name, [REAL_LABEL_ID, label_id]))
+    for k, name in enumerate(MULTI_LABEL_NAMES):
+        label_ids = [label_id for label_id, row in enumerate(MULTI_LABEL_TABLE) if row[k] == 1]
+        buckets.append(('any_' + name, [REAL_LABEL_ID] + label_ids))
+    return buckets
+
+
+def _safe_div(a, b):
+    return a / b if b else float('nan')
+
+
+class BreakdownMeter(object):
+    """Records per-sample evaluation results and computes the metrics of every bucket"""
+
+    def __init__(self, roc_num_bins=None):
+        self.roc_meter = ROCMeter(num_bins=roc_num_bins, num_groups=len(MANIPULATION_CLASSES))
+        self.buckets = get_breakdown_buckets()
+        self.records = {'label': [], 'cls_correct': [], 'multicls_logits': [], 'multicls_target': [],
+                        'iou': [], 'tok_counts': []}
+
+    def add(self, label, cls_score, cls_correct, multicls_logits, multicls_target, iou, token_label, tok_pred):
+        """
+        Args:
+            label (LongTensor): N label ids
+            cls_score (Tensor): N fake probabilities
+            cls_correct (BoolTensor): N, real/fake prediction is correct
+            multicls_logits, multicls_target (Tensor): Nx4
+            iou (Tensor): N bbox IoU
+            token_label, tok_pred (LongTensor): NxL token labels (-100 = padding) and predictions
+        """
+        self.roc_meter.add(cls_score, (label != REAL_LABEL_ID).long(), groups=label)
+        # TP, TN, FP, FN of each sample
+        tok_counts = torch.stack([((token_label == 1) & (tok_pred == 1)).sum(1),
+                                  ((token_label == 0) & (tok_pred == 0)).sum(1),
+                                  ((token_label == 0) & (tok_pred == 1)).sum(1),
+                                  ((token_label == 1) & (tok_pred == 0)).sum(1)], dim=1)
+        batch = {'label': label, 'cls_correct': cls_correct, 'multicls_logits': multicls_logits,
+                 'multicls_target': multicls_target, 'iou': iou, 'tok_counts': tok_counts}
+        # on the host, so that the device memory does not grow with the number of samples
+        for k, v in batch.items():
+            self.records[k].append(v.detach().to('cpu', non_blocking=True))
+
+    def compute(self):
+        """list of rows {'type', 'num', <BREAKDOWN_METRICS>}, one per bucket"""
+        if torch.cuda.is_available():
+            # the non_blocking copies of add()
+            torch.cuda.synchronize()
+        records = {k: torch.cat(v) for k, v in self.records.items()}
+        label = records['label'].numpy()
+        roc_values = self.roc_meter.values([label_ids for _, label_ids in self.buckets])
+
+        rows = []
+        for (name, label_ids), roc in zip(self.buckets, roc_values):
+            mask = np.ones_like(label, dtype=bool) if label_ids is None else np.isin(label, label_ids)
+            mask = torch.from_numpy(mask)
+            num = int(mask.sum())
+            row = {'type': name, 'num': num}
+            if num == 0:
+                row.update(dict.fromkeys(BREAKDOWN_METRICS, float('nan')))
+                rows.append(row)
+                continue
+
+            ##================= real/fake cls ========================##
+            row['AUC_cls'] = roc['AUC']
+            row['ACC_cls'] = records['cls_correct'][mask].float().mean().item()
+            row['EER_cls'] = roc['EER']
+
+            ##================= multi-label cls ========================##
+            row.update(self._multi_label_metrics(records['multicls_logits'][mask], records['multicls_target'][mask]))
+
+            ##================= bbox cls ========================##
+            iou = records['iou'][mask].double()
+            row['IOU_score'] = iou.mean().item()
+            row['IOU_ACC_50'] = (iou > 0.5).double().mean().item()
+            row['IOU_ACC_75'] = (iou > 0.75).double().mean().item()
+            row['IOU_ACC_95'] = (iou > 0.95).double().mean().item()
+
+            ##================= token cls ========================##
+            TP, TN, FP, FN = records['tok_counts'][mask].sum(0).tolist()
+            row['ACC_tok'] = _safe_div(TP + TN, TP + TN + FP + FN)
+            row['Precision_tok'] = _safe_div(TP, TP + FP)
+            row['Recall_tok'] = _safe_div(TP, TP + FN)
+            row['F1_tok'] = _safe_div(2 * row['Precision_tok'] * row['Recall_tok'], row['Precision_tok'] + row['Recall_tok'])
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _multi_label_metrics(scores, targets):
+        # only the manipulations present in the bucket have a defined AP / recall
+        present = (targets == 1).any(0)
+        names = ['MAP', 'OP', 'OR', 'OF1', 'CP', 'CR', 'CF1']
+        if not present.any():
+            return dict.fromkeys(names, float('nan'))
+        scores, targets = scores[:, present], targets[:, present]
+        meter = AveragePrecisionMeter(difficult_examples=False)
+        meter.add(scores, targets)
+        MAP = meter.value().mean().item()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            OP, OR, OF1, CP, CR, CF1 = meter.overall()
+        return dict(zip(names, [MAP, OP, OR, OF1, CP, CR, CF1]))
+
+
+def format_breakdown_table(rows, metrics=BREAKDOWN_METRICS):
+    """fixed width text table, metrics in percent"""
+    width = max(len(row['type']) for row in rows)
+    header = '{:<{w}}  {:>8}  '.format('type', 'num', w=width) + '  '.join('{:>13}'.format(m) for m in metrics)
+    lines = [header]
+    for row in rows:
+        lines.append('{:<{w}}  {:>8d}  '.format(row['type'], row['num'], w=width)
+                     + '  '.join('{:>13.4f}'.format(row[m] * 100) for m in metrics))
+    return '\n'.join(lines)
+
+
+def _percent(value):
+    """metric in percent, None for an undefined (NaN) metric, e.g. the AUC of the orig bucket"""
+    value = float(value)
+    return round(value * 100, 4) if math.isfinite(value) else None
+
+
+def write_breakdown(rows, json_file, csv_file=None):
+    """
+    write the breakdown rows as strict json (undefined metrics are null) and optionally
+    csv (undefined metrics are empty), metrics in percent
+    """
+    out_rows = [{k: (_percent(v) if k in BREAKDOWN_METRICS else v) for k, v in row.items()} for row in rows]
+    with open(json_file, 'w') as f:
+        json.dump(out_rows, f, indent=2, allow_nan=False)
+    if csv_file is not None:
+        with open(csv_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['type', 'num'] + BREAKDOWN_METRICS)
+            writer.writeheader()
+            writer.writerows(out_rows)
@@ -0,0 +1,204 @@
+"""
+Directory checkpoint format with memory-mapped model weights.
+
+    checkpoint_XX/
+        model.json          index: key -> dtype, shape, byte offset in model.bin
+        model.bin           raw tensor bytes, every tensor 64 byte aligned
+        training_state.pth  everything else of the checkpoint (optimizer, lr_scheduler, epoch, step, rng_states, config, ...)
+
+Model weights are read through a copy-on-write np.memmap, a tensor only touches
+the file pages it covers, and the optimizer state is never read unless asked
+for. Legacy single file checkpoints (torch.save of {'model', 'optimizer', ...})
+are still accepted by every loader.
+"""
+import json
+import os
+import random
+import shutil
+
+import numpy as np
+import torch
+import torch.distributed as dist
+
+MODEL_INDEX = 'model.json'
+MODEL_BIN = 'model.bin'
+TRAINING_STATE = 'training_state.pth'
+ALIGNMENT = 64
+FORMAT_VERSION = 1
+
+# momentum encoders and queues of HAMMER, only needed to continue training
+MOMENTUM_KEYS = ('visual_encoder_m.', 'vision_proj_m.', 'text_encoder_m.', 'text_proj_m.',
+                 'image_queue', 'text_queue', 'queue_ptr')
+
+_DTYPES = {str(dtype): dtype for dtype in [torch.float64, torch.float32, torch.float16, torch.bfloat16,
+                                           torch.int64, torch.int32, torch.int16, torch.int8, torch.uint8,
+                                           torch.bool]}
+
+
+def is_momentum_key(key):
+    return key.startswith(MOMENTUM_KEYS)
+
+
+def is_checkpoint_dir(path):
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, MODEL_INDEX))
+
+
+def is_complete_checkpoint_dir(path):
+    return is_checkpoint_dir(path) and os.path.isfile(os.path.join(path, TRAINING_STATE))
+
+
+def resolve_checkpoint(path):
+    """
+    checkpoint_XX -> the checkpoint_XX directory if it exists, else checkpoint_XX.pth.
+    When save_checkpoint was interrupted after moving the previous checkpoint_XX aside,
+    the complete new checkpoint_XX.tmp, else the previous checkpoint_XX.old.
+    """
+    if is_checkpoint_dir(path) or path.endswith('.pth'):
+        return path
+    if not os.path.exists(path + '.pth'):
+        for interrupted in [path + '.tmp', path + '.old']:
+            if is_complete_checkpoint_dir(interrupted):
+                return interrupted
+    return path + '.pth'
+
+
+def _select(state_dict, keys=None, skip_momentum=False):
+    out = {}
+    for k, v in state_dict.items():
+        if skip_momentum and is_momentum_key(k):
+            continue
+        if keys is not None and not any(k.startswith(p) for p in keys):
+            continue
+        out[k] = v
+    return out
+
+
+def _torch_load(path, mmap=True):
+    # the RNG states of the training state are not loadable with weights_only, the default of torch >= 2.6
+    kwargs = {'map_location': 'cpu', 'weights_only': False}
+    if mmap:
+        try:
+            # zip format checkpoints are mapped instead of read, torch >= 2.1
+            return torch.load(path, mmap=True, **kwargs)
+        except (TypeError, RuntimeError):
+            pass
+    try:
+        return torch.load(path, **kwargs)
+    except TypeError:
+        # torch < 1.13 has no weights_only
+        return torch.load(path, map_location='cpu')
+
+
+def save_model_state_dict(state_dict, path):
+    """write model.bin + model.json into the directory path"""
+    os.makedirs(path, exist_ok=True)
+    index = {}
+    offset = 0
+    with open(os.path.join(path, MODEL_BIN), 'wb') as f:
+        for k, v in state_dict.items():
+            v = v.detach().cpu().contiguous()
+            data = v.reshape(-1).view(torch.uint8).numpy() if v.numel() > 0 else np.zeros(0, dtype=np.uint8)
+            pad = -offset % ALIGNMENT
+            f.write(b'\0' * pad)
+            offset += pad
+            f.write(memoryview(data))
+            index[k] = {'dtype': str(v.dtype), 'shape': list(v.shape), 'offset': offset, 'nbytes': data.nbytes}
+            offset += data.nbytes
+    with open(os.path.join(path, MODEL_INDEX), 'w') as f:
+        json.dump({'format_version': FORMAT_VERSION, 'tensors': index}, f)
+
+
+def save_checkpoint(save_obj, path, checkpoint_format='dir'):
+    """
+    Save a {'model': state_dict, ...} checkpoint.
+    'dir': the directory format above at path, written to path.tmp then renamed. A previous
+    checkpoint at path is renamed to path.old first and only deleted once the new one is in place.
+    'pth': legacy torch.save to path.pth, written to path.pth.tmp then renamed.
+    Returns the written path.
+    """
+    if checkpoint_format == 'pth':
+        torch.save(save_obj, path + '.pth.tmp')
+        os.replace(path + '.pth.tmp', path + '.pth')
+        return path + '.pth'
+
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    save_model_state_dict(save_obj['model'], tmp_path)
+    torch.save({k: v for k, v in save_obj.items() if k != 'model'}, os.path.join(tmp_path, TRAINING_STATE))
+    old_path = path + '.old'
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    return path
+
+
+def load_model_state_dict(path, keys=None, skip_momentum=False, mmap=True):
+    """
+    Model state dict of a checkpoint directory or legacy .pth file.
+    Args:
+        keys: only load the keys starting with one of these prefixes
+        skip_momentum: leave out the momentum encoders and queues (MOMENTUM_KEYS)
+        mmap: tensors are views of a copy-on-write memmap of model.bin, else they are read into memory
+    """
+    if not is_checkpoint_dir(path):
+        checkpoint = _torch_load(path)
+        return _select(checkpoint['model'] if 'model' in checkpoint else checkpoint, keys, skip_momentum)
+
+    with open(os.path.join(path, MODEL_INDEX), 'r') as f:
+        index = _select(json.load(f)['tensors'], keys, skip_momentum)
+    bin_file = os.path.join(path, MODEL_BIN)
+    if os.path.getsize(bin_file) == 0:
+        buffer = torch.zeros(0, dtype=torch.uint8)
+    elif mmap:
+        buffer = torch.from_numpy(np.memmap(bin_file, dtype=np.uint8, mode='c'))
+    else:
+        buffer = torch.from_numpy(np.fromfile(bin_file, dtype=np.uint8))
+
+    state_dict = {}
+    for k, meta in index.items():
+        dtype = _DTYPES[meta['dtype']]
+        if meta['nbytes'] == 0:
+            state_dict[k] = torch.zeros(meta['shape'], dtype=dtype)
+        else:
+            data = buffer[meta['offset']:meta['offset'] + meta['nbytes']]
+            state_dict[k] = data.view(dtype).view(meta['shape'])
+    return state_dict
+
+
+def load_training_state(path):
+    """optimizer / lr_scheduler / epoch / config of a checkpoint, the model weights are not returned"""
+    if is_checkpoint_dir(path):
+        return _torch_load(os.path.join(path, TRAINING_STATE), mmap=False)
+    checkpoint = _torch_load(path)
+    return {k: v for k, v in checkpoint.items() if k != 'model'}
+
+
+def get_rng_state():
+    """python / numpy / torch (CPU and current CUDA device) random states of this process"""
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state(state['cuda'])
+
+
+def gather_rng_states():
+    """random states of every rank, indexed by rank. Collective, must be called on all ranks"""
+    state = get_rng_state()
+    if not (dist.is_available() and dist.is_initialized()):
+        return [state]
+    states = [None] * dist.get_world_size()
+    dist.all_gather_object(states, state)
+    return states
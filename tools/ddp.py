@@ -0,0 +1,95 @@
+"""
+DistributedDataParallel wrapping of HAMMER without find_unused_parameters, and
+its gradient communication settings.
+
+The parameters that never get a gradient are known in advance: the momentum
+encoders and frozen parameters (requires_grad=False, skipped by DDP anyway) and
+the ones listed by model.ddp_unused_parameters(), which DDP is told to ignore.
+Every other trainable parameter gets a gradient at every step, so DDP does not
+need to walk the autograd graph after each forward to find the unused ones, and
+with static_graph it can also reuse the bucket order of the first iteration.
+Buffers (queues, queue pointer, position ids) are synced once when wrapping: the
+queues stay identical on all ranks since every rank enqueues the same gathered
+features, so they are not broadcast again before every forward.
+
+Gradients are all-reduced in buckets of bucket_cap_mb, launched as soon as all
+gradients of a bucket are ready, so they overlap with the rest of the backward.
+The buckets first follow the reverse registration order of the parameters, and
+are rebuilt after the first iteration in the order the gradients actually became
+ready, which for HAMMER is the heads and BERT fusion layers first and the lower
+BERT and ViT blocks last. This needs find_unused_parameters=False. A comm hook
+compresses what is sent:
+    fp16 / bf16: all-reduce the buckets in half precision, half the bytes
+    powersgd: low-rank (powersgd_rank) approximation of the gradient matrices with
+              error feedback, plain all-reduce for the first powersgd_start_iter steps
+"""
+import torch
+from torch.nn.parallel import DistributedDataParallel
+
+COMM_HOOKS = ['none', 'fp16', 'bf16', 'powersgd']
+
+
+def register_comm_hook(model, comm_hook, process_group=None, powersgd_rank=1, powersgd_start_iter=1000):
+    """Registers comm_hook (one of COMM_HOOKS) on the DDP model, returns the hook state"""
+    from torch.distributed.algorithms.ddp_comm_hooks import default_hooks, powerSGD_hook
+    if comm_hook == 'none':
+        return None
+    if comm_hook == 'fp16':
+        model.register_comm_hook(process_group, default_hooks.fp16_compress_hook)
+        return process_group
+    if comm_hook == 'bf16':
+        # NCCL >= 2.10 only
+        model.register_comm_hook(process_group, default_hooks.bf16_compress_hook)
+        return process_group
+    if comm_hook == 'powersgd':
+        state = powerSGD_hook.PowerSGDState(process_group=process_group, matrix_approximation_rank=powersgd_rank,
+                                            start_powerSGD_iter=powersgd_start_iter)
+        model.register_comm_hook(state, powerSGD_hook.powerSGD_hook)
+        return state
+    raise ValueError('Invalid comm hook: {}, expected one of {}'.format(comm_hook, COMM_HOOKS))
+
+
+def wrap_model(model, device_ids=None, static_graph=False, find_unused_parameters=False, bucket_cap_mb=25,
+               gradient_as_bucket_view=False, comm_hook='none', powersgd_rank=1, powersgd_start_iter=1000):
+    """
+    device_ids: [gpu] for a model on that GPU, None on CPU.
+    find_unused_parameters=True restores the graph search, for a forward that skips
+    trainable parameters not declared by ddp_unused_parameters.
+    gradient_as_bucket_view: the .grad of the parameters are views of the buckets,
+    which saves their memory and a copy per step.
+    """
+    if hasattr(model, 'ddp_unused_parameters'):
+        DistributedDataParallel._set_params_and_buffers_to_ignore_for_model(model, model.ddp_unused_parameters())
+    if device_ids is not None and not torch.cuda.is_available():
+        device_ids = None
+    model = DistributedDataParallel(model, device_ids=device_ids, broadcast_buffers=False,
+                                    find_unused_parameters=find_unused_parameters, bucket_cap_mb=bucket_cap_mb,
+                                    gradient_as_bucket_view=gradient_as_bucket_view)
+    if static_graph:
+        # the static_graph argument is only there from torch 1.11 on
+        model._set_static_graph()
+    register_comm_hook(model, comm_hook, powersgd_rank=powersgd_rank, powersgd_start_iter=powersgd_start_iter)
+    return model
+
+
+def add_ddp_args(parser):
+    parser.add_argument('--ddp_static_graph', default=False, action='store_true',
+                        help='let DDP reuse the gradient bucket order and hooks of the first iteration')
+    parser.add_argument('--find_unused_parameters', default=False, action='store_true',
+                        help='let DDP search the graph for unused parameters every step, for modified forwards')
+    parser.add_argument('--ddp_bucket_cap_mb', default=25, type=int, help='size of the gradient all-reduce buckets')
+    parser.add_argument('--ddp_grad_as_bucket_view', default=False, action='store_true',
+                        help='gradients are views of the all-reduce buckets, saves their memory and a copy')
+    parser.add_argument('--ddp_comm_hook', default='none', choices=COMM_HOOKS,
+                        help='gradient compression: half precision all-reduce or PowerSGD')
+    parser.add_argument('--powersgd_rank', default=1, type=int, help='rank of the PowerSGD approximation')
+    parser.add_argument('--powersgd_start_iter', default=1000, type=int,
+                        help='steps of plain all-reduce before PowerSGD starts')
+
+
+def wrap_model_from_args(model, args):
+    device_ids = [args.gpu] if args.device.startswith('cuda') else None
+    return wrap_model(model, device_ids=device_ids, static_graph=args.ddp_static_graph,
+                      find_unused_parameters=args.find_unused_parameters, bucket_cap_mb=args.ddp_bucket_cap_mb,
+                      gradient_as_bucket_view=args.ddp_grad_as_bucket_view, comm_hook=args.ddp_comm_hook,
+                      powersgd_rank=args.powersgd_rank, powersgd_start_iter=args.powersgd_start_iter)
@@ -1,38 +1,133 @@
+"""
+Process group setup for the launchers of train.py / test.py (--launcher):
+
+    none      a single process without process group, unless the environment of
+              torchrun is found, which is then used as with 'torchrun'
+    torchrun  processes started by torchrun / torch.distributed.elastic: RANK,
+              WORLD_SIZE, LOCAL_RANK and the MASTER_ADDR / MASTER_PORT rendezvous
+              come from the environment. After a failure torchrun restarts all
+              workers with TORCHELASTIC_RESTART_COUNT > 0, train.py then resumes
+              from checkpoint_last of the run.
+    pytorch   one process per GPU of the node, spawned by train.py, rendezvous at
+              --dist-url, --rank is the node rank
+    slurm     one process per task of srun, the first node of the job is the master
+    mpi       one process per rank of mpirun (Open MPI, MVAPICH, Intel MPI / MPICH)
+
+--dist-backend auto picks nccl when the processes run on GPUs (--device cuda and
+CUDA available) and gloo otherwise, so the same launchers run several CPU
+processes for local scaling tests. init_dist sets args.rank, args.world_size,
+args.gpu (local rank), args.log, and args.distributed to False without process group.
+"""
 import os
 import re
+import subprocess
+
 import torch
 import torch.distributed as dist
 
+LAUNCHERS = ['none', 'torchrun', 'pytorch', 'slurm', 'mpi']
+
+
+def is_torchrun():
+    """started by torchrun / torch.distributed.elastic (or torch.distributed.launch --use_env)"""
+    return 'TORCHELASTIC_RUN_ID' in os.environ or all(k in os.environ for k in ('RANK', 'WORLD_SIZE', 'LOCAL_RANK'))
+
+
+def _use_cuda(args):
+    return torch.cuda.is_available() and str(getattr(args, 'device', 'cuda')).startswith('cuda')
+
+
+def _backend(args):
+    backend = getattr(args, 'dist_backend', 'auto')
+    if backend == 'auto':
+        return 'nccl' if _use_cuda(args) else 'gloo'
+    return backend
+
+
+def _env_int(*names, default=None):
+    for name in names:
+        if name in os.environ:
+            return int(os.environ[name])
+    if default is None:
+        raise KeyError('None of the environment variables {} is set'.format(', '.join(names)))
+    return default
+
+
+def _master_port(args, default=29500):
+    """MASTER_PORT, else the port of --dist-url"""
+    if 'MASTER_PORT' in os.environ:
+        return int(os.environ['MASTER_PORT'])
+    match = re.match(r'^tcp://.+:(\d+)$', getattr(args, 'dist_url', '') or '')
+    return int(match.group(1)) if match else default
+
 
 def init_dist(args):
-    """Initialize distributed computing environmen
-    t."""
+    """Initialize distributed computing environment."""
     args.ngpus_per_node = torch.cuda.device_count()
+    args.restart_count = 0
 
-    if args.launcher == 'pytorch':
+    launcher = args.launcher
+    if launcher == 'none' and is_torchrun():
+        launcher = 'torchrun'
+    if launcher == 'none':
+        _init_single(args)
+    elif launcher == 'torchrun':
+        _init_dist_torchrun(args)
+    elif launcher == 'pytorch':
         _init_dist_pytorch(args)
-    elif args.launcher == 'mpi':
+    elif launcher == 'mpi':
         _init_dist_mpi(args)
-    elif args.launcher == 'slurm':
+    elif launcher == 'slurm':
         _init_dist_slurm(args)
     else:
         raise ValueError('Invalid launcher type: {}'.format(args.launcher))
+    args.distributed = getattr(args, 'distributed', True) and dist.is_initialized()
+
+
+def _init_process_group(args, rank, world_size, local_rank, init_method):
+    args.rank = rank
+    args.world_size = world_size
+    args.gpu = local_rank
+    if _use_cuda(args):
+        torch.cuda.set_device(local_rank)
+    backend = _backend(args)
+    dist.init_process_group(backend=backend, init_method=init_method, world_size=world_size, rank=rank)
+    print(f"{init_method}, backend: {backend}, ws: {world_size}, rank: {rank}, local rank: {local_rank}")
+
+
+def _init_single(args):
+    """Single process, no process group."""
+    args.rank = 0
+    args.world_size = 1
+    args.gpu = getattr(args, 'gpu', None) or 0
+    if _use_cuda(args):
+        torch.cuda.set_device(args.gpu)
+    args.log = True
+
+
+def _init_dist_torchrun(args):
+    """Set up the environment of torchrun / torch.distributed.elastic."""
+    args.restart_count = int(os.environ.get('TORCHELASTIC_RESTART_COUNT', 0))
+    _init_process_group(args, int(os.environ['RANK']), int(os.environ['WORLD_SIZE']),
+                        int(os.environ.get('LOCAL_RANK', 0)), 'env://')
+    args.log = args.rank == 0
 
 
 def _init_dist_pytorch(args, **kwargs):
     """Set up environment."""
-    # TODO: use local_rank instead of rank % num_gpus
-    args.rank = args.rank * args.ngpus_per_node + args.gpu
-    args.world_size = args.world_size
-    dist.init_process_group(backend=args.dist_backend, init_method=args.dist_url,
-                            world_size=args.world_size, rank=args.rank)
-    torch.cuda.set_device(args.gpu)
-    print(f"{args.dist_url}, ws:{args.world_size}, rank:{args.rank}")
-
-    if args.rank % args.ngpus_per_node == 0:
-        args.log = True
-    else:
-        args.log = False
+    # --rank is the node rank, args.gpu the local rank given by mp.spawn
+    rank = args.rank * args.ngpus_per_node + args.gpu
+    _init_process_group(args, rank, args.world_size, args.gpu, args.dist_url)
+    args.log = args.rank % args.ngpus_per_node == 0
+
+
+def _slurm_master_addr(node_list):
+    """first host of the job node list, e.g. node[03-05,07],gpu12 -> node03"""
+    try:
+        return subprocess.check_output(['scontrol', 'show', 'hostnames', node_list]).decode().split()[0]
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        match = re.match(r'^([^\[,]+)(?:\[([^\-,\]]+))?', node_list)
+        return match.group(1) + (match.group(2) or '')
 
 
 def _init_dist_slurm(args, port=23333, **kwargs):
@@ -40,31 +135,20 @@ def _init_dist_slurm(args, port=23333, **kwargs):
     rank = int(os.environ['SLURM_PROCID'])
     world_size = int(os.environ['SLURM_NTASKS'])
     local_rank = int(os.environ['SLURM_LOCALID'])
-    node_list = str(os.environ['SLURM_NODELIST'])
-    num_gpus = torch.cuda.device_count()
-
-    node_parts = re.findall('[0-9]+', node_list)
-    host_ip = '{}.{}.{}.{}'.format(node_parts[1], node_parts[2], node_parts[3], node_parts[4])
-    init_method = 'tcp://{}:{}'.format(host_ip, port)
-
-    print(f"{init_method}, rank: {rank}, local rank: {local_rank}")
-
-    dist.init_process_group(backend=args.dist_backend,
-                            init_method=init_method,
-                            world_size=world_size,
-                            rank=rank)
-
-    torch.cuda.set_device(local_rank)
-    args.rank = rank
-    args.world_size = world_size
-    args.ngpus_per_node = num_gpus
-    args.gpu = local_rank
-
-    if args.rank == 0:
-        args.log = True
-    else:
-        args.log = False
+    node_list = os.environ.get('SLURM_JOB_NODELIST', os.environ.get('SLURM_NODELIST'))
+    os.environ.setdefault('MASTER_ADDR', _slurm_master_addr(node_list))
+    os.environ.setdefault('MASTER_PORT', str(_master_port(args, default=port)))
+    _init_process_group(args, rank, world_size, local_rank, 'env://')
+    args.log = args.rank == 0
 
 
-def _init_dist_mpi(backend, **kwargs):
-    raise NotImplementedError
+def _init_dist_mpi(args, **kwargs):
+    """Set up the environment of mpirun, the master is MASTER_ADDR / MASTER_PORT or --dist-url"""
+    rank = _env_int('OMPI_COMM_WORLD_RANK', 'MV2_COMM_WORLD_RANK', 'PMI_RANK')
+    world_size = _env_int('OMPI_COMM_WORLD_SIZE', 'MV2_COMM_WORLD_SIZE', 'PMI_SIZE')
+    local_rank = _env_int('OMPI_COMM_WORLD_LOCAL_RANK', 'MV2_COMM_WORLD_LOCAL_RANK', 'MPI_LOCALRANKID',
+                          default=rank % max(args.ngpus_per_node, 1))
+    init_method = 'env://' if 'MASTER_ADDR' in os.environ else args.dist_url
+    os.environ.setdefault('MASTER_PORT', str(_master_port(args)))
+    _init_process_group(args, rank, world_size, local_rank, init_method)
+    args.log = args.rank == 0
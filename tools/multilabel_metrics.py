@@ -4,35 +4,74 @@ import torch
 import numpy as np
 
 
+# manipulation types in DGM4 `fake_cls`, the index is the integer label id emitted by DGM4_Dataset
+MANIPULATION_CLASSES = [
+    'orig',
+    'face_swap',
+    'face_attribute',
+    'text_swap',
+    'text_attribute',
+    'face_swap&text_swap',
+    'face_swap&text_attribute',
+    'face_attribute&text_swap',
+    'face_attribute&text_attribute',
+]
+CLS2ID = {cls: idx for idx, cls in enumerate(MANIPULATION_CLASSES)}
+REAL_LABEL_ID = CLS2ID['orig']
+
+# multi-label target of each manipulation type, columns = [face_swap, face_attribute, text_swap, text_attribute]
+MULTI_LABEL_TABLE = [
+    [0, 0, 0, 0], # orig
+    [1, 0, 0, 0], # face_swap
+    [0, 1, 0, 0], # face_attribute
+    [0, 0, 1, 0], # text_swap
+    [0, 0, 0, 1], # text_attribute
+    [1, 0, 1, 0], # face_swap&text_swap
+    [1, 0, 0, 1], # face_swap&text_attribute
+    [0, 1, 1, 0], # face_attribute&text_swap
+    [0, 1, 0, 1], # face_attribute&text_attribute
+]
+
+_label_table_cache = {}
+
+
+def get_label_table(device):
+    """(num_classes x 4) multi-label lookup table, created once per device"""
+    device = torch.device(device)
+    table = _label_table_cache.get(device)
+    if table is None:
+        table = torch.tensor(MULTI_LABEL_TABLE, dtype=torch.long, device=device)
+        _label_table_cache[device] = table
+    return table
+
+
+def label_to_ids(label):
+    """map a list of `fake_cls` strings to a LongTensor of label ids"""
+    return torch.tensor([CLS2ID[cls] for cls in label], dtype=torch.long)
+
+
+def get_multi_label_from_ids(label_ids, device):
+    """
+    Args:
+        label_ids (LongTensor): N label ids, see MANIPULATION_CLASSES
+        device: device of the returned tensors
+    Return:
+        multi_label (LongTensor): Nx4 multi-hot targets
+        real_label_mask (BoolTensor): N, True for orig samples
+    """
+    label_ids = label_ids.to(device, non_blocking=True)
+    multi_label = get_label_table(device).index_select(0, label_ids)
+    real_label_mask = label_ids == REAL_LABEL_ID
+    return multi_label, real_label_mask
+
+
 def get_multi_label(label, image):
-    multi_label = torch.zeros([len(label), 4], dtype=torch.long).to(image.device) 
-    # origin cls = [0, 0, 0, 0]
-    real_label_pos = np.where(np.array(label) == 'orig')[0].tolist()
-    multi_label[real_label_pos,:] = torch.tensor([0, 0, 0, 0]).to(image.device) 
-    # face_swap cls = [1, 0, 0, 0]
-    pos = np.where(np.array(label) == 'face_swap')[0].tolist() 
-    multi_label[pos,:] = torch.tensor([1, 0, 0, 0]).to(image.device) 
-    # face_attribute cls = [0, 1, 0, 0]
-    pos = np.where(np.array(label) == 'face_attribute')[0].tolist()
-    multi_label[pos,:] = torch.tensor([0, 1, 0, 0]).to(image.device) 
-    # text_swap cls = [0, 0, 1, 0]
-    pos = np.where(np.array(label) == 'text_swap')[0].tolist()
-    multi_label[pos,:] = torch.tensor([0, 0, 1, 0]).to(image.device) 
-    # text_attribute cls = [0, 0, 0, 1]
-    pos = np.where(np.array(label) == 'text_attribute')[0].tolist()
-    multi_label[pos,:] = torch.tensor([0, 0, 0, 1]).to(image.device) 
-    #  face_swap&text_swap cls = [1, 0, 1, 0]
-    pos = np.where(np.array(label) == 'face_swap&text_swap')[0].tolist()
-    multi_label[pos,:] = torch.tensor([1, 0, 1, 0]).to(image.device) 
-    #  face_swap&text_attribute cls = [1, 0, 0, 1]
-    pos = np.where(np.array(label) == 'face_swap&text_attribute')[0].tolist()
-    multi_label[pos,:] = torch.tensor([1, 0, 0, 1]).to(image.device) 
-    #  face_attribute&text_swap cls = [0, 1, 1, 0]
-    pos = np.where(np.array(label) == 'face_attribute&text_swap')[0].tolist()
-    multi_label[pos,:] = torch.tensor([0, 1, 1, 0]).to(image.device) 
-    #  face_attribute&text_attribute cls = [0, 1, 0, 1]
-    pos = np.where(np.array(label) == 'face_attribute&text_attribute')[0].tolist()
-    multi_label[pos,:] = torch.tensor([0, 1, 0, 1]).to(image.device) 
+    """
+    Backward compatible string API, `label` is a list of `fake_cls` strings.
+    Returns the Nx4 multi-hot targets and the list of orig positions.
+    """
+    multi_label, real_label_mask = get_multi_label_from_ids(label_to_ids(label), image.device)
+    real_label_pos = torch.where(real_label_mask)[0].tolist()
 
     return multi_label, real_label_pos
 
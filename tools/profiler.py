@@ -0,0 +1,125 @@
+"""
+Step profiler: timing of named regions of the training step.
+
+    with region('forward/vit'):
+        image_embeds = self.visual_encoder(image)
+
+region() is a no-op returning a shared null context until a StepProfiler is
+enabled with set_profiler(). On CUDA a region records a pair of CUDA events,
+on CPU it reads perf_counter, and the events are only resolved every `window`
+steps, so timing adds no host-device sync to the other steps. Per region the
+window reports the mean time per step and the max of a single call.
+With trace_steps=(start, end), steps [start, end) are also recorded by
+torch.profiler and exported as a Chrome trace, with the regions as
+record_function ranges. Steps count from 0 and the trace starts at the end of
+step start - 1, so start is at least 1. Nested regions are named 'parent/child', the summary
+adds up the top level ones only.
+"""
+import contextlib
+import os
+import time
+from collections import OrderedDict
+
+import torch
+
+_NULL = contextlib.nullcontext()
+_profiler = None
+
+
+def set_profiler(profiler):
+    global _profiler
+    _profiler = profiler
+
+
+def get_profiler():
+    return _profiler
+
+
+def region(name):
+    if _profiler is None:
+        return _NULL
+    return _profiler.region(name)
+
+
+class StepProfiler(object):
+    def __init__(self, window=100, use_cuda=None, trace_steps=None, trace_dir='.'):
+        if trace_steps is not None and not 1 <= trace_steps[0] < trace_steps[1]:
+            raise ValueError('Invalid trace steps: {}, expected start,end with 1 <= start < end'.format(trace_steps))
+        self.window = window
+        self.use_cuda = torch.cuda.is_available() if use_cuda is None else use_cuda
+        self.trace_steps = trace_steps
+        self.trace_dir = trace_dir
+        self.steps = 0
+        self.stats = OrderedDict()
+        self._timings = OrderedDict()
+        self._trace = None
+
+    @contextlib.contextmanager
+    def region(self, name):
+        timings = self._timings.setdefault(name, [])
+        record = torch.profiler.record_function(name) if self._trace is not None else _NULL
+        with record:
+            if self.use_cuda:
+                start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+                start.record()
+                yield
+                end.record()
+                timings.append((start, end))
+            else:
+                start = time.perf_counter()
+                yield
+                timings.append((start, time.perf_counter()))
+
+    def _elapsed_ms(self, start, end):
+        if self.use_cuda:
+            return start.elapsed_time(end)
+        return (end - start) * 1000.
+
+    def step(self):
+        """
+        Call at the end of every training step. Returns the stats of the window,
+        {region: {'mean_ms', 'max_ms', 'calls'}}, on its last step, else None.
+        """
+        self.steps += 1
+        self._step_trace()
+        if self.steps % self.window != 0:
+            return None
+        if self.use_cuda:
+            torch.cuda.synchronize()
+        stats = OrderedDict()
+        for name, timings in self._timings.items():
+            if not timings:
+                continue
+            elapsed = [self._elapsed_ms(start, end) for start, end in timings]
+            stats[name] = {'mean_ms': sum(elapsed) / self.window, 'max_ms': max(elapsed), 'calls': len(elapsed)}
+        self._timings = OrderedDict((name, []) for name in self._timings)
+        self.stats = stats
+        return stats
+
+    def _step_trace(self):
+        if self.trace_steps is None:
+            return
+        start, end = self.trace_steps
+        if self.steps == start and self._trace is None:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.use_cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._trace = torch.profiler.profile(activities=activities)
+            self._trace.__enter__()
+        elif self.steps == end and self._trace is not None:
+            self._trace.__exit__(None, None, None)
+            os.makedirs(self.trace_dir, exist_ok=True)
+            rank = torch.distributed.get_rank() if torch.distributed.is_initialized() else 0
+            self._trace.export_chrome_trace(os.path.join(self.trace_dir, 'trace_steps%d-%d_rank%d.json' % (start, end, rank)))
+            self._trace = None
+
+    def summary(self, stats=None):
+        stats = self.stats if stats is None else stats
+        total = sum(s['mean_ms'] for name, s in stats.items() if '/' not in name)
+        return '  '.join('{}: {:.2f} ms'.format(name, s['mean_ms']) for name, s in stats.items()) \
+            + '  (top level {:.2f} ms / step)'.format(total)
+
+    def add_scalars(self, summary_writer, global_step, stats=None):
+        stats = self.stats if stats is None else stats
+        for name, s in stats.items():
+            summary_writer.add_scalar('profile/%s_ms' % name, s['mean_ms'], global_step)
@@ -0,0 +1,199 @@
+"""
+Binary ROC metrics (AUC, EER, TPR at fixed FPR) computed from one sorted pass.
+
+The exact path sorts all scores once and derives every metric from the same
+curve, the streaming path accumulates per-bin positive / negative counts on
+device, which can be merged across batches, processes and evaluation runs.
+Both paths support sample groups (e.g. manipulation types) so per-group
+metrics are computed without re-sorting.
+"""
+import numpy as np
+import torch
+import torch.distributed as dist
+
+
+def roc_curve_sorted(y_true, y_score):
+    """
+    Exact ROC curve of scores already sorted in descending order.
+
+    Args:
+        y_true (ndarray): N binary labels, 1 = positive
+        y_score (ndarray): N scores, sorted in descending order
+    Return:
+        fpr, tpr, thresholds: same as sklearn.metrics.roc_curve with
+            drop_intermediate=False
+    """
+    # the last index of each run of equal scores is a threshold
+    distinct_value_indices = np.where(np.diff(y_score))[0]
+    threshold_idxs = np.r_[distinct_value_indices, y_true.size - 1]
+
+    tps = np.cumsum(y_true, dtype=np.float64)[threshold_idxs]
+    fps = 1 + threshold_idxs - tps
+    fpr, tpr = _rates(tps, fps)
+    return fpr, tpr, np.r_[np.inf, y_score[threshold_idxs]]
+
+
+def roc_curve_histogram(pos_counts, neg_counts):
+    """
+    ROC curve of per-bin positive / negative counts, bins in ascending score order.
+    Scores inside the same bin are treated as ties.
+    """
+    tps = np.cumsum(pos_counts[::-1], dtype=np.float64)
+    fps = np.cumsum(neg_counts[::-1], dtype=np.float64)
+    return _rates(tps, fps)
+
+
+def _rates(tps, fps):
+    tps = np.r_[0, tps]
+    fps = np.r_[0, fps]
+    fpr = fps / fps[-1] if fps[-1] > 0 else np.full_like(fps, np.nan)
+    tpr = tps / tps[-1] if tps[-1] > 0 else np.full_like(tps, np.nan)
+    return fpr, tpr
+
+
+def auc(fpr, tpr):
+    """trapezoidal area under the ROC curve, equal to sklearn.metrics.roc_auc_score"""
+    return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+
+def eer(fpr, tpr):
+    """
+    Equal error rate, the FPR where FPR == 1 - TPR on the linearly interpolated
+    ROC curve. Solved in closed form on the crossing segment, it gives the
+    same value as brentq over interp1d(fpr, tpr).
+    """
+    diff = 1. - fpr - tpr # decreasing along the curve
+    k = int(np.argmax(diff <= 0))
+    if diff[k] > 0:
+        return float('nan')
+    if k == 0:
+        return float(fpr[0])
+    fpr0, fpr1, tpr0, tpr1 = fpr[k - 1], fpr[k], tpr[k - 1], tpr[k]
+    t = diff[k - 1] / ((fpr1 - fpr0) + (tpr1 - tpr0))
+    return float(fpr0 + t * (fpr1 - fpr0))
+
+
+def tpr_at_fpr(fpr, tpr, target_fpr):
+    """highest TPR of an operating point whose FPR does not exceed target_fpr"""
+    return float(tpr[fpr <= target_fpr].max())
+
+
+def roc_metrics(fpr, tpr, fpr_targets=()):
+    names = ['AUC', 'EER'] + ['TPR@FPR={:g}'.format(target) for target in fpr_targets]
+    if np.isnan(fpr).any() or np.isnan(tpr).any():
+        # positives or negatives missing, the ROC is undefined
+        return dict.fromkeys(names, float('nan'))
+    values = [auc(fpr, tpr), eer(fpr, tpr)] + [tpr_at_fpr(fpr, tpr, target) for target in fpr_targets]
+    return dict(zip(names, values))
+
+
+class ROCMeter(object):
+    """
+    Accumulates binary scores and labels batch by batch.
+
+    Args:
+        num_bins (int, optional): if set, scores in [0, 1] are counted in
+            num_bins histogram bins on device instead of being stored. The
+            histograms are mergeable (see merge / synchronize_between_processes)
+            and the metrics are exact up to the bin resolution.
+        num_groups (int): number of sample groups passed to add()
+        fpr_targets (tuple): FPRs at which TPR is reported
+    """
+
+    def __init__(self, num_bins=None, num_groups=1, fpr_targets=()):
+        self.num_bins = num_bins
+        self.num_groups = num_groups
+        self.fpr_targets = tuple(fpr_targets)
+        self.reset()
+
+    def reset(self):
+        self.scores, self.targets, self.groups = [], [], []
+        self.counts = None # [num_groups, 2 (neg / pos), num_bins]
+
+    def add(self, scores, targets, groups=None):
+        """
+        Args:
+            scores (Tensor): N scores, higher = more likely positive
+            targets (Tensor): N binary labels
+            groups (Tensor, optional): N group ids in [0, num_groups)
+        """
+        scores = scores.detach().flatten()
+        targets = targets.detach().flatten().long()
+        if groups is None:
+            groups = torch.zeros_like(targets)
+        groups = groups.detach().flatten().long().to(scores.device)
+        targets = targets.to(scores.device)
+
+        if self.num_bins is None:
+            self.scores.append(scores)
+            self.targets.append(targets)
+            self.groups.append(groups)
+            return
+
+        if self.counts is None:
+            self.counts = torch.zeros(self.num_groups * 2 * self.num_bins, dtype=torch.long, device=scores.device)
+        bins = (scores * self.num_bins).long().clamp_(0, self.num_bins - 1)
+        index = (groups * 2 + targets) * self.num_bins + bins
+        self.counts += torch.bincount(index, minlength=self.counts.numel())
+
+    def merge(self, other):
+        """add the samples / histograms of another ROCMeter with the same settings"""
+        assert self.num_bins == other.num_bins and self.num_groups == other.num_groups
+        if self.num_bins is None:
+            self.scores += other.scores
+            self.targets += other.targets
+            self.groups += other.groups
+        elif other.counts is not None:
+            self.counts = other.counts.clone() if self.counts is None else self.counts + other.counts.to(self.counts.device)
+
+    def synchronize_between_processes(self):
+        """sum the histograms of all processes, only supported with num_bins"""
+        if not (dist.is_available() and dist.is_initialized()):
+            return
+        assert self.num_bins is not None, 'exact ROCMeter can not be synchronized, set num_bins'
+        dist.barrier()
+        dist.all_reduce(self.counts)
+
+    def _sorted_samples(self):
+        # one descending (stable) sort shared by all groups
+        scores = torch.cat(self.scores).float().cpu().numpy()
+        targets = torch.cat(self.targets).cpu().numpy()
+        groups = torch.cat(self.groups).cpu().numpy()
+        order = np.argsort(-scores, kind='mergesort')
+        return scores[order], targets[order], groups[order]
+
+    def value(self, groups=None):
+        """
+        Args:
+            groups (iterable, optional): group ids to include, default all
+        Return:
+            dict with AUC, EER and TPR@FPR=<target> for each fpr target
+        """
+        return self.values([groups])[0]
+
+    def values(self, group_sets):
+        """
+        metrics of several group subsets, e.g. [[0, 1], [0, 2]], from the same sorted pass.
+        A None entry selects all groups.
+        """
+        results = []
+        if self.num_bins is None:
+            scores, targets, groups = self._sorted_samples()
+            for group_set in group_sets:
+                if group_set is None:
+                    mask = slice(None)
+                else:
+                    mask = np.isin(groups, list(group_set))
+                if not targets[mask].size:
+                    results.append(roc_metrics(np.array([np.nan]), np.array([np.nan]), self.fpr_targets))
+                    continue
+                fpr, tpr, _ = roc_curve_sorted(targets[mask], scores[mask])
+                results.append(roc_metrics(fpr, tpr, self.fpr_targets))
+        else:
+            counts = self.counts.view(self.num_groups, 2, self.num_bins).cpu().numpy()
+            for group_set in group_sets:
+                group_counts = counts if group_set is None else counts[list(group_set)]
+                group_counts = group_counts.sum(0)
+                fpr, tpr = roc_curve_histogram(group_counts[1], group_counts[0])
+                results.append(roc_metrics(fpr, tpr, self.fpr_targets))
+        return results
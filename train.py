@@ -25,23 +25,25 @@ from models.vit import interpolate_pos_embed
 from transformers import BertTokenizerFast
 
 import utils
-from dataset import create_dataset, create_sampler, create_loader
-from scheduler import create_scheduler
-from optim import create_optimizer
+from dataset import create_dataset, create_loader
+from dataset.sampler import ResumableSampler, SeededDataset
+from scheduler import create_step_scheduler
+from tools.profiler import StepProfiler, get_profiler, region, set_profiler
+from optim import create_optimizer, gather_optimizer_state, load_optimizer_state
 
 import torch.multiprocessing as mp
 from torch.utils.tensorboard import SummaryWriter
 import logging
 from types import MethodType
-from tools.env import init_dist
+from tools.env import LAUNCHERS, init_dist
+from tools.ddp import add_ddp_args, wrap_model_from_args
 from tqdm import tqdm
 
-from sklearn.metrics import roc_auc_score, roc_curve, f1_score
-from scipy.optimize import brentq
-from scipy.interpolate import interp1d
-
 from models import box_ops
-from tools.multilabel_metrics import AveragePrecisionMeter, get_multi_label
+from tools.multilabel_metrics import AveragePrecisionMeter, get_multi_label_from_ids
+from tools.roc_metrics import ROCMeter
+from tools.checkpoint import is_checkpoint_dir, resolve_checkpoint, load_model_state_dict, load_training_state, gather_rng_states, set_rng_state
+from tools.async_checkpoint import AsyncCheckpointWriter
 from models.HAMMER import HAMMER
 
 def setlogger(log_file):
@@ -97,7 +99,30 @@ def text_input_adjust(text_input, fake_word_pos, device):
     return text_input, fake_token_pos_batch
 
 
-def train(args, model, data_loader, optimizer, tokenizer, epoch, warmup_steps, device, scheduler, config, summary_writer):
+def make_save_obj(model_without_ddp, optimizer_state, lr_scheduler, config, epoch, **extra):
+    save_obj = {
+        'model': model_without_ddp.state_dict(),
+        'optimizer': optimizer_state,
+        'lr_scheduler': lr_scheduler.state_dict(),
+        'config': config,
+        'epoch': epoch,
+    }
+    save_obj.update(extra)
+    return save_obj
+
+
+def save_step_checkpoint(args, model, optimizer, scheduler, config, epoch, step, checkpoint_writer, log_dir):
+    """checkpoint_last after step batches of epoch, with the random states of every rank"""
+    rng_states = gather_rng_states()
+    optimizer_state = gather_optimizer_state(optimizer)
+    if utils.is_main_process():
+        model_without_ddp = model.module if args.distributed else model
+        save_obj = make_save_obj(model_without_ddp, optimizer_state, scheduler, config, epoch, step=step, rng_states=rng_states)
+        checkpoint_writer.save(save_obj, os.path.join(log_dir, 'checkpoint_last'))
+
+
+def train(args, model, data_loader, optimizer, tokenizer, epoch, device, scheduler, config, summary_writer,
+          start_step=0, checkpoint_writer=None, log_dir=None):
     # train
     model.train()  
     
@@ -114,33 +139,38 @@ def train(args, model, data_loader, optimizer, tokenizer, epoch, warmup_steps, d
     
     header = 'Train Epoch: [{}]'.format(epoch)
     print_freq = 100   
-    step_size = 100
-    warmup_iterations = warmup_steps*step_size  
+    scalar_buffer = utils.ScalarBuffer(summary_writer, flush_every=print_freq) if args.log else None
+    profiler = get_profiler()
 
-    global_step = epoch*len(data_loader)
-    
-    if args.distributed:
-        data_loader.sampler.set_epoch(epoch)
+    # the sampler skips the start_step batches already trained on, i counts from start_step
+    data_loader.sampler.set_epoch(epoch)
+    data_loader.sampler.set_start_index(start_step*config['batch_size_train'])
+    steps_per_epoch = start_step + len(data_loader)
 
-    for i, (image, label, text, fake_image_box, fake_word_pos, W, H) in enumerate(metric_logger.log_every(args, data_loader, print_freq, header)):
+    global_step = epoch*steps_per_epoch + start_step
 
-        if config['schedular']['sched'] == 'cosine_in_step':
-            scheduler.adjust_learning_rate(optimizer, i / len(data_loader) + epoch, args, config)        
+    for i, (image, label, text, fake_image_box, fake_word_pos, W, H) in enumerate(metric_logger.log_every(args, data_loader, print_freq, header), start=start_step):
+
+        # lr of this update from the precomputed schedule
+        scheduler.step_update(global_step)
 
         optimizer.zero_grad()
   
-        image = image.to(device,non_blocking=True) 
+        with region('data'):
+            image = image.to(device,non_blocking=True) 
+            label = label.to(device,non_blocking=True) 
         
-        text_input = tokenizer(text, max_length=128, truncation=True, add_special_tokens=True, return_attention_mask=True, return_token_type_ids=False) 
+            text_input = tokenizer(text, max_length=128, truncation=True, add_special_tokens=True, return_attention_mask=True, return_token_type_ids=False) 
         
-        text_input, fake_token_pos = text_input_adjust(text_input, fake_word_pos, device)
+            text_input, fake_token_pos = text_input_adjust(text_input, fake_word_pos, device)
  
         if epoch>0:
             alpha = config['alpha']
         else:
-            alpha = config['alpha']*min(1,i/len(data_loader)) 
+            alpha = config['alpha']*min(1,i/steps_per_epoch) 
         
-        loss_MAC, loss_BIC, loss_bbox, loss_giou, loss_TMG, loss_MLC, loss_REC = model(image, label, text_input, fake_image_box, fake_token_pos, alpha = alpha)  
+        with region('forward'):
+            loss_MAC, loss_BIC, loss_bbox, loss_giou, loss_TMG, loss_MLC, loss_REC = model(image, label, text_input, fake_image_box, fake_token_pos, alpha = alpha)  
             
         loss = config['loss_MAC_wgt']*loss_MAC \
              + config['loss_BIC_wgt']*loss_BIC \
@@ -150,41 +180,52 @@ def train(args, model, data_loader, optimizer, tokenizer, epoch, warmup_steps, d
              + config['loss_MLC_wgt']*loss_MLC \
              + config['loss_REC_wgt']*loss_REC
           
-        loss.backward()
-        optimizer.step()    
+        # second order optimizers (Adahessian) differentiate through the gradients
+        with region('backward'):
+            loss.backward(create_graph=getattr(optimizer, 'is_second_order', False))
+        with region('optimizer'):
+            optimizer.step()    
         
-        metric_logger.update(loss_MAC=loss_MAC.item())
-        metric_logger.update(loss_BIC=loss_BIC.item())
-        metric_logger.update(loss_bbox=loss_bbox.item())
-        metric_logger.update(loss_giou=loss_giou.item())
-        metric_logger.update(loss_TMG=loss_TMG.item())
-        metric_logger.update(loss_MLC=loss_MLC.item())
-        metric_logger.update(loss_REC=loss_REC.item())
-        metric_logger.update(loss=loss.item())
+        # the losses stay on the device, they are copied to the host every print_freq steps
+        metric_logger.update(loss_MAC=loss_MAC)
+        metric_logger.update(loss_BIC=loss_BIC)
+        metric_logger.update(loss_bbox=loss_bbox)
+        metric_logger.update(loss_giou=loss_giou)
+        metric_logger.update(loss_TMG=loss_TMG)
+        metric_logger.update(loss_MLC=loss_MLC)
+        metric_logger.update(loss_REC=loss_REC)
+        metric_logger.update(loss=loss)
         metric_logger.update(lr=optimizer.param_groups[0]["lr"])         
-        
-        if epoch==0 and i%step_size==0 and i<=warmup_iterations and config['schedular']['sched'] != 'cosine_in_step': 
-            scheduler.step(i//step_size)   
 
         global_step+=1
+
+        if profiler is not None:
+            profile_stats = profiler.step()
+            if profile_stats and args.log:
+                print('Step profile:', profiler.summary(profile_stats), flush=True)
+                profiler.add_scalars(summary_writer, global_step, profile_stats)
         
 
         #============ tensorboard train log info ============#
         if args.log:
             lossinfo = {
                 'lr': optimizer.param_groups[0]["lr"],                                                                                                  
-                'loss_MAC': loss_MAC.item(),                                                                                                  
-                'loss_BIC': loss_BIC.item(),                                                                                                  
-                'loss_bbox': loss_bbox.item(),                                                                                                  
-                'loss_giou': loss_giou.item(),                                                                                                  
-                'loss_TMG': loss_TMG.item(),                                                                                                  
-                'loss_MLC': loss_MLC.item(),
-                'loss_MLC': loss_REC.item(),                                                                                                  
-                'loss': loss.item(),                                                                                                  
+                'loss_MAC': loss_MAC,                                                                                                  
+                'loss_BIC': loss_BIC,                                                                                                  
+                'loss_bbox': loss_bbox,                                                                                                  
+                'loss_giou': loss_giou,                                                                                                  
+                'loss_TMG': loss_TMG,                                                                                                  
+                'loss_MLC': loss_MLC,
+                'loss_REC': loss_REC,                                                                                                  
+                'loss': loss,                                                                                                  
                     } 
-            for tag, value in lossinfo.items():
-                summary_writer.add_scalar(tag, value, global_step)
+            scalar_buffer.add_scalars(lossinfo, global_step)
+
+        if args.checkpoint_steps > 0 and (i+1) % args.checkpoint_steps == 0 and i+1 < steps_per_epoch:
+            save_step_checkpoint(args, model, optimizer, scheduler, config, epoch, i+1, checkpoint_writer, log_dir)
         
+    if args.log:
+        scalar_buffer.flush()
     # gather the stats from all processes
     metric_logger.synchronize_between_processes()
     if args.log:
@@ -205,7 +246,10 @@ def evaluation(args, model, data_loader, tokenizer, device, config):
     start_time = time.time()   
     print_freq = 200 
 
-    y_true, y_pred, IOU_pred, IOU_50, IOU_75, IOU_95 = [], [], [], [], [], []
+    roc_meter = ROCMeter(num_bins=config.get('roc_num_bins', None))
+    IOU_sum = torch.zeros((), dtype=torch.float64, device=device)
+    IOU_acc_all = torch.zeros(3, dtype=torch.long, device=device)
+    IOU_nums_all = 0
     cls_nums_all = 0
     cls_acc_all = 0   
     
@@ -220,6 +264,7 @@ def evaluation(args, model, data_loader, tokenizer, device, config):
     for i, (image, label, text, fake_image_box, fake_word_pos, W, H) in enumerate(metric_logger.log_every(args, data_loader, print_freq, header)):
         
         image = image.to(device,non_blocking=True) 
+        label = label.to(device,non_blocking=True) 
         
         text_input = tokenizer(text, max_length=128, truncation=True, add_special_tokens=True, return_attention_mask=True, return_token_type_ids=False) 
         
@@ -228,19 +273,16 @@ def evaluation(args, model, data_loader, tokenizer, device, config):
         logits_real_fake, logits_multicls, output_coord, logits_tok = model(image, label, text_input, fake_image_box, fake_token_pos, is_train=False)
 
         ##================= real/fake cls ========================## 
-        cls_label = torch.ones(len(label), dtype=torch.long).to(image.device) 
-        real_label_pos = np.where(np.array(label) == 'orig')[0].tolist()
-        cls_label[real_label_pos] = 0
+        target, real_label_mask = get_multi_label_from_ids(label, image.device)
+        cls_label = (~real_label_mask).long()
 
-        y_pred.extend(F.softmax(logits_real_fake,dim=1)[:,1].cpu().flatten().tolist())
-        y_true.extend(cls_label.cpu().flatten().tolist())
+        roc_meter.add(F.softmax(logits_real_fake,dim=1)[:,1], cls_label)
 
         pred_acc = logits_real_fake.argmax(1)
         cls_nums_all += cls_label.shape[0]
         cls_acc_all += torch.sum(pred_acc == cls_label).item()
 
         # ----- multi metrics -----
-        target, _ = get_multi_label(label, image)
         multi_label_meter.add(logits_multicls, target)
         
         ##================= bbox cls ========================## 
@@ -249,19 +291,9 @@ def evaluation(args, model, data_loader, tokenizer, device, config):
 
         IOU, _ = box_ops.box_iou(boxes1, boxes2.to(device), test=True)
 
-        IOU_pred.extend(IOU.cpu().tolist())
-
-        IOU_50_bt = torch.zeros(IOU.shape, dtype=torch.long)
-        IOU_75_bt = torch.zeros(IOU.shape, dtype=torch.long)
-        IOU_95_bt = torch.zeros(IOU.shape, dtype=torch.long)
-
-        IOU_50_bt[IOU>0.5] = 1
-        IOU_75_bt[IOU>0.75] = 1
-        IOU_95_bt[IOU>0.95] = 1
-
-        IOU_50.extend(IOU_50_bt.cpu().tolist())
-        IOU_75.extend(IOU_75_bt.cpu().tolist())
-        IOU_95.extend(IOU_95_bt.cpu().tolist())
+        IOU_sum += IOU.double().sum()
+        IOU_acc_all += box_ops.iou_accuracy(IOU, thresholds=(0.5, 0.75, 0.95))
+        IOU_nums_all += IOU.shape[0]
 
         ##================= token cls ========================##  
         token_label = text_input.attention_mask[:,1:].clone() # [:,1:] for ingoring class token
@@ -285,11 +317,10 @@ def evaluation(args, model, data_loader, tokenizer, device, config):
         FN_all += torch.sum((token_label_reshape == 1) * (logits_tok_pred == 0)).item()
 
     ##================= real/fake cls ========================## 
-    y_true, y_pred = np.array(y_true), np.array(y_pred)
-    AUC_cls = roc_auc_score(y_true, y_pred)
+    roc_cls = roc_meter.value()
+    AUC_cls = roc_cls['AUC']
     ACC_cls = cls_acc_all / cls_nums_all
-    fpr, tpr, thresholds = roc_curve(y_true, y_pred, pos_label=1)
-    EER_cls = brentq(lambda x: 1. - x - interp1d(fpr, tpr)(x), 0., 1.)
+    EER_cls = roc_cls['EER']
     
     ##================= multi-label cls ========================## 
     MAP = multi_label_meter.value().mean()
@@ -297,10 +328,8 @@ def evaluation(args, model, data_loader, tokenizer, device, config):
     OP_k, OR_k, OF1_k, CP_k, CR_k, CF1_k = multi_label_meter.overall_topk(3)
     
     ##================= bbox cls ========================##
-    IOU_score = sum(IOU_pred)/len(IOU_pred)
-    IOU_ACC_50 = sum(IOU_50)/len(IOU_50)
-    IOU_ACC_75 = sum(IOU_75)/len(IOU_75)
-    IOU_ACC_95 = sum(IOU_95)/len(IOU_95)
+    IOU_score = IOU_sum.item()/IOU_nums_all
+    IOU_ACC_50, IOU_ACC_75, IOU_ACC_95 = (IOU_acc_all.double()/IOU_nums_all).tolist()
 
     # ##================= token cls========================##
     ACC_tok = (TP_all + TN_all) / (TP_all + TN_all + FP_all + FN_all)
@@ -322,6 +351,11 @@ def main_worker(gpu, args, config):
 
     log_dir = os.path.join(args.output_dir, 'log'+ args.log_num)
     os.makedirs(log_dir, exist_ok=True)
+    if args.restart_count > 0:
+        # workers restarted by torchrun after a failure continue from checkpoint_last of the run
+        last = resolve_checkpoint(os.path.join(log_dir, 'checkpoint_last'))
+        if is_checkpoint_dir(last) or os.path.isfile(last):
+            args.checkpoint, args.resume = last, True
     log_file = os.path.join(log_dir, 'shell.txt')
     logger = setlogger(log_file)
     yaml.dump(config, open(os.path.join(log_dir, 'config.yaml'), 'w')) 
@@ -331,6 +365,11 @@ def main_worker(gpu, args, config):
     else:
         summary_writer = None
 
+    if args.profile_window > 0 or args.profile_trace:
+        trace_steps = tuple(int(s) for s in args.profile_trace.split(',')) if args.profile_trace else None
+        set_profiler(StepProfiler(window=args.profile_window or 100, use_cuda=args.device.startswith('cuda'),
+                                  trace_steps=trace_steps, trace_dir=log_dir))
+
     if args.log:
         logger.info('******************************')
         logger.info(args)
@@ -346,11 +385,16 @@ def main_worker(gpu, args, config):
     torch.manual_seed(seed)
     np.random.seed(seed)
     random.seed(seed)
-    cudnn.benchmark = True
+    if args.deterministic:
+        cudnn.benchmark = False
+        cudnn.deterministic = True
+    else:
+        cudnn.benchmark = True
     
     start_epoch = 0
+    start_step = 0
+    rng_states = None
     max_epoch = config['schedular']['epochs']
-    warmup_steps = config['schedular']['warmup_epochs']  
     best = 0
     best_epoch = 0  
 
@@ -358,18 +402,22 @@ def main_worker(gpu, args, config):
     if args.log:
         print("Creating dataset")
     train_dataset, val_dataset = create_dataset(config)
-    
+    # per-sample augmentation seeds and a permutation that only depends on (seed, epoch), so that
+    # training can resume in the middle of an epoch
+    train_dataset = SeededDataset(train_dataset)
     if args.distributed:
-        samplers = create_sampler([train_dataset], [True], args.world_size, args.rank) + [None]    
+        train_sampler = ResumableSampler(train_dataset, args.world_size, args.rank, shuffle=True, seed=args.seed)
     else:
-        samplers = [None, None]
+        train_sampler = ResumableSampler(train_dataset, shuffle=True, seed=args.seed)
+    samplers = [train_sampler, None]
 
     train_loader, val_loader = create_loader([train_dataset, val_dataset],
                                 samplers,
                                 batch_size=[config['batch_size_train']]+[config['batch_size_val']], 
                                 num_workers=[4, 4], 
                                 is_trains=[True, False], 
-                                collate_fns=[None, None])
+                                collate_fns=[None, None],
+                                generators=[torch.Generator().manual_seed(seed), None])
 
     tokenizer = BertTokenizerFast.from_pretrained(args.text_encoder)
 
@@ -382,17 +430,22 @@ def main_worker(gpu, args, config):
     arg_opt = utils.AttrDict(config['optimizer'])
     optimizer = create_optimizer(arg_opt, model)
     arg_sche = utils.AttrDict(config['schedular'])
-    lr_scheduler, _ = create_scheduler(arg_sche, optimizer)
-    if config['schedular']['sched'] == 'cosine_in_step':
-        args.lr = config['optimizer']['lr']
+    # lr of every update of the run, indexed by the global step
+    lr_scheduler = create_step_scheduler(arg_sche, optimizer, len(train_loader), lr=config['optimizer']['lr'])
     
     if args.checkpoint:    
-        checkpoint = torch.load(args.checkpoint, map_location='cpu') 
-        state_dict = checkpoint['model']                       
+        state_dict = load_model_state_dict(args.checkpoint, mmap=False)
         if args.resume:
-            optimizer.load_state_dict(checkpoint['optimizer'])
-            lr_scheduler.load_state_dict(checkpoint['lr_scheduler'])
-            start_epoch = checkpoint['epoch']+1         
+            checkpoint = load_training_state(args.checkpoint)
+            load_optimizer_state(optimizer, checkpoint['optimizer'])
+            lr_scheduler.load_state_dict(checkpoint.get('lr_scheduler', {}))
+            if 'step' in checkpoint:
+                # mid-epoch checkpoint_last
+                start_epoch = checkpoint['epoch']
+                start_step = checkpoint['step']
+            else:
+                start_epoch = checkpoint['epoch']+1         
+            rng_states = checkpoint.get('rng_states')
         else:
             pos_embed_reshaped = interpolate_pos_embed(state_dict['visual_encoder.pos_embed'],model.visual_encoder)   
             state_dict['visual_encoder.pos_embed'] = pos_embed_reshaped       
@@ -403,18 +456,36 @@ def main_worker(gpu, args, config):
         if args.log:
             print(msg)  
 
+    # encoders frozen by the param_groups of the optimizer config run without autograd and momentum encoder
+    model.update_frozen()
+    if args.log and (model.frozen_vision or model.frozen_text):
+        print('frozen encoders: vision %s, text %s' % (model.frozen_vision, model.frozen_text))
+
     model_without_ddp = model
     if args.distributed:
-        model = torch.nn.parallel.DistributedDataParallel(model, device_ids=[args.gpu], find_unused_parameters=True)
+        model = wrap_model_from_args(model, args)
         model_without_ddp = model.module
 
+    checkpoint_writer = None
+    if utils.is_main_process():
+        checkpoint_writer = AsyncCheckpointWriter(args.checkpoint_format, keep_last=args.checkpoint_keep_last,
+                                                  max_pending=args.checkpoint_max_pending)
+
+    if rng_states is not None:
+        if len(rng_states) == utils.get_world_size():
+            set_rng_state(rng_states[utils.get_rank()])
+        elif args.log:
+            print('checkpoint was saved with %d processes, random states are not restored' % len(rng_states))
+
     if args.log:
         print("Start training")
     start_time = time.time()
 
     for epoch in range(start_epoch, max_epoch):
             
-        train_stats = train(args, model, train_loader, optimizer, tokenizer, epoch, warmup_steps, device, lr_scheduler, config, summary_writer) 
+        train_stats = train(args, model, train_loader, optimizer, tokenizer, epoch, device, lr_scheduler, config, summary_writer,
+                            start_step=start_step, checkpoint_writer=checkpoint_writer, log_dir=log_dir) 
+        start_step = 0
         train_stats
         AUC_cls, ACC_cls, EER_cls, \
         MAP, OP, OR, OF1, CP, CR, CF1, OP_k, OR_k, OF1_k, CP_k, CR_k, CF1_k, \
@@ -480,6 +551,8 @@ def main_worker(gpu, args, config):
                      "F1_tok": "{:.4f}".format(F1_tok*100),
         }
         print(val_stats)
+        rng_states = gather_rng_states()
+        optimizer_state = gather_optimizer_state(optimizer)
         if utils.is_main_process(): 
             log_stats = {**{f'train_{k}': v for k, v in train_stats.items()},
                             **{f'val_{k}': v for k, v in val_stats.items()},
@@ -488,36 +561,25 @@ def main_worker(gpu, args, config):
             with open(os.path.join(log_dir, "log.txt"),"a") as f:
                 f.write(json.dumps(log_stats) + "\n")
 
-            if config['schedular']['sched'] != 'cosine_in_step':
-                save_obj = {
-                    'model': model_without_ddp.state_dict(),
-                    'optimizer': optimizer.state_dict(),
-                    'lr_scheduler': lr_scheduler.state_dict(),
-                    'config': config,
-                    'epoch': epoch,
-                }
-            else:
-                save_obj = {
-                    'model': model_without_ddp.state_dict(),
-                    'optimizer': optimizer.state_dict(),
-                    'lr': optimizer.param_groups[0]["lr"],
-                    'config': config,
-                    'epoch': epoch,
-                }                    
+            save_obj = make_save_obj(model_without_ddp, optimizer_state, lr_scheduler, config, epoch, rng_states=rng_states)
+            # snapshot to pinned CPU memory, the disk write runs in the background
+            checkpoint_paths = []
             if (epoch % args.model_save_epoch == 0 and epoch!=0):
-                torch.save(save_obj, os.path.join(log_dir, 'checkpoint_%02d.pth'%epoch)) 
+                checkpoint_paths.append(os.path.join(log_dir, 'checkpoint_%02d'%epoch))
             if float(val_stats['AUC_cls'])>best:
-                torch.save(save_obj, os.path.join(log_dir, 'checkpoint_best.pth')) 
+                checkpoint_paths.append(os.path.join(log_dir, 'checkpoint_best'))
                 print("best checkpoint:",val_stats)
                 best = float(val_stats['AUC_cls'])
                 best_epoch = epoch 
+            if checkpoint_paths:
+                checkpoint_writer.save(save_obj, checkpoint_paths)
 
-        if config['schedular']['sched'] != 'cosine_in_step':
-            lr_scheduler.step(epoch+warmup_steps+1)  
-        dist.barrier() 
+        if args.distributed:
+            dist.barrier() 
 
     if utils.is_main_process():
-        torch.save(save_obj, os.path.join(log_dir, 'checkpoint_%02d.pth'%epoch))   
+        checkpoint_writer.save(save_obj, os.path.join(log_dir, 'checkpoint_%02d'%epoch))
+        checkpoint_writer.close()
     total_time = time.time() - start_time
     total_time_str = str(datetime.timedelta(seconds=int(total_time)))
     if args.log:
@@ -542,23 +604,41 @@ if __name__ == '__main__':
                         help='world size for distributed training')
     parser.add_argument('--dist-url', default='tcp://127.0.0.1:23459', type=str,
                         help='url used to set up distributed training')
-    parser.add_argument('--dist-backend', default='nccl', type=str,
-                        help='distributed backend')
-    parser.add_argument('--launcher', choices=['none', 'pytorch', 'slurm', 'mpi'], default='none',
-                        help='job launcher')
+    parser.add_argument('--dist-backend', default='auto', type=str,
+                        help='distributed backend, auto: nccl on GPU, gloo on CPU')
+    parser.add_argument('--launcher', choices=LAUNCHERS, default='none',
+                        help='job launcher, see tools/env.py')
     parser.add_argument('--log_num', '-l', type=str)
     parser.add_argument('--model_save_epoch', type=int, default=20)
+    parser.add_argument('--checkpoint_format', choices=['dir', 'pth'], default='dir',
+                        help='dir: memory-mapped model weights + separate training state, pth: single torch.save file')
+    parser.add_argument('--checkpoint_keep_last', type=int, default=0,
+                        help='number of numbered checkpoints to keep, 0 keeps all')
+    parser.add_argument('--checkpoint_max_pending', type=int, default=1,
+                        help='number of checkpoint snapshots held in pinned memory while being written')
+    parser.add_argument('--checkpoint_steps', type=int, default=0,
+                        help='save checkpoint_last every this many steps to resume in the middle of an epoch, 0 disables')
+    parser.add_argument('--deterministic', default=False, action='store_true',
+                        help='deterministic cuDNN kernels, a resumed run then continues the interrupted one exactly')
     parser.add_argument('--token_momentum', default=False, action='store_true')
+    parser.add_argument('--profile_window', type=int, default=0,
+                        help='time the regions of the training step, averaged over this many steps, 0 disables')
+    parser.add_argument('--profile_trace', type=str, default='',
+                        help='"start,end": export a torch.profiler Chrome trace of steps start to end - 1 '
+                             '(counted from 0, start >= 1) to the log dir')
+
+    add_ddp_args(parser)
 
     args = parser.parse_args()
 
     config = yaml.load(open(args.config, 'r'), Loader=yaml.Loader)
 
     # main(args, config)
-    if args.launcher == 'none':
-        args.launcher = 'pytorch'
-        main_worker(0, args, config)
-    else:
+    if args.launcher == 'pytorch':
+        # one process per GPU of this node
         ngpus_per_node = torch.cuda.device_count()
         args.ngpus_per_node = ngpus_per_node
-        mp.spawn(main_worker, nprocs=ngpus_per_node, args=(args, config))
\ No newline at end of file
+        mp.spawn(main_worker, nprocs=ngpus_per_node, args=(args, config))
+    else:
+        # a single process, or one of the processes started by torchrun / srun / mpirun
+        main_worker(None, args, config)
\ No newline at end of file
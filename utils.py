@@ -11,6 +11,8 @@ import torch.distributed as dist
 class SmoothedValue(object):
     """Track a series of values and provide access to smoothed values over a
     window or the global series average.
+    Tensor values are kept on their device in a ring buffer of window_size and
+    only copied to the host, with one sync, when a smoothed value is read.
     """
 
     def __init__(self, window_size=20, fmt=None):
@@ -20,19 +22,49 @@ class SmoothedValue(object):
         self.total = 0.0
         self.count = 0
         self.fmt = fmt
+        # device ring buffer of the tensor values not copied to the host yet
+        self._buffer = None
+        self._buffer_total = None
+        self._pending = 0
 
     def update(self, value, n=1):
+        if isinstance(value, torch.Tensor):
+            self._update_tensor(value.detach().reshape(()), n)
+            return
+        self._sync()
         self.deque.append(value)
         self.count += n
         self.total += value * n
 
+    def _update_tensor(self, value, n):
+        if self._buffer is None or self._buffer.device != value.device:
+            self._sync()
+            self._buffer = torch.zeros(self.deque.maxlen, dtype=torch.float64, device=value.device)
+            self._buffer_total = torch.zeros((), dtype=torch.float64, device=value.device)
+        self._buffer[self._pending % self.deque.maxlen].copy_(value)
+        self._buffer_total.add_(value, alpha=n)
+        self._pending += 1
+        self.count += n
+
+    def _sync(self):
+        if not self._pending:
+            return
+        num = min(self._pending, self.deque.maxlen)
+        index = [(self._pending - num + i) % self.deque.maxlen for i in range(num)]
+        values = torch.cat([self._buffer[index], self._buffer_total.view(1)]).tolist()
+        self.deque.extend(values[:-1])
+        self.total += values[-1]
+        self._buffer_total.zero_()
+        self._pending = 0
+
     def synchronize_between_processes(self):
         """
         Warning: does not synchronize the deque!
         """
+        self._sync()
         if not is_dist_avail_and_initialized():
             return
-        t = torch.tensor([self.count, self.total], dtype=torch.float64, device='cuda')
+        t = torch.tensor([self.count, self.total], dtype=torch.float64, device=get_dist_device())
         dist.barrier()
         dist.all_reduce(t)
         t = t.tolist()
@@ -41,24 +73,29 @@ class SmoothedValue(object):
 
     @property
     def median(self):
+        self._sync()
         d = torch.tensor(list(self.deque))
         return d.median().item()
 
     @property
     def avg(self):
+        self._sync()
         d = torch.tensor(list(self.deque), dtype=torch.float32)
         return d.mean().item()
 
     @property
     def global_avg(self):
+        self._sync()
         return self.total / self.count
 
     @property
     def max(self):
+        self._sync()
         return max(self.deque)
 
     @property
     def value(self):
+        self._sync()
         return self.deque[-1]
 
     def __str__(self):
@@ -76,10 +113,9 @@ class MetricLogger(object):
         self.delimiter = delimiter
 
     def update(self, **kwargs):
+        # tensors stay on their device until the meters are printed
         for k, v in kwargs.items():
-            if isinstance(v, torch.Tensor):
-                v = v.item()
-            assert isinstance(v, (float, int))
+            assert isinstance(v, (float, int, torch.Tensor))
             self.meters[k].update(v)
 
     def __getattr__(self, attr):
@@ -164,6 +200,39 @@ class MetricLogger(object):
         
 
 
+class ScalarBuffer(object):
+    """
+    Per-step scalars for a SummaryWriter. Tensor scalars stay on their device and
+    are copied to the host with one sync per flush, every flush_every steps.
+    """
+
+    def __init__(self, summary_writer, flush_every=100):
+        self.summary_writer = summary_writer
+        self.flush_every = flush_every
+        self.steps = []
+        self.tensors = []
+        self.floats = []
+
+    def add_scalars(self, scalars, global_step):
+        self.steps.append(global_step)
+        self.tensors.append({k: v.detach().reshape(()) for k, v in scalars.items() if isinstance(v, torch.Tensor)})
+        self.floats.append({k: v for k, v in scalars.items() if not isinstance(v, torch.Tensor)})
+        if len(self.steps) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.steps:
+            return
+        tensors = [v.double() for scalars in self.tensors for v in scalars.values()]
+        values = iter(torch.stack(tensors).tolist() if tensors else [])
+        for step, tensor_scalars, float_scalars in zip(self.steps, self.tensors, self.floats):
+            for tag, value in float_scalars.items():
+                self.summary_writer.add_scalar(tag, value, step)
+            for tag in tensor_scalars:
+                self.summary_writer.add_scalar(tag, next(values), step)
+        self.steps, self.tensors, self.floats = [], [], []
+
+
 class AttrDict(dict):
     def __init__(self, *args, **kwargs):
         super(AttrDict, self).__init__(*args, **kwargs)
@@ -227,6 +296,13 @@ def get_rank():
     return dist.get_rank()
 
 
+def get_dist_device():
+    """device of the tensors of collectives: the current GPU with nccl, the CPU with gloo"""
+    if is_dist_avail_and_initialized() and dist.get_backend() == 'nccl':
+        return torch.device('cuda', torch.cuda.current_device())
+    return torch.device('cpu')
+
+
 def is_main_process():
     return get_rank() == 0
 